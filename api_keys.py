@@ -0,0 +1,185 @@
+# API keys for header token checks (dependencies_path_decorators.verify_token / verify_key)
+# comparing a header to a literal with != returns as soon as a character differs, the response time tells how
+# much of a guess was right, and a literal in the code can't be changed without a release
+#
+# the store keeps only the sha256 of the keys, indexed by it: a presented key is hashed, looked up and confirmed
+# with hmac.compare_digest, whose time doesn't depend on where the values differ; the lookup itself is done on the
+# hash, which tells nothing about the keys
+# the digests of keys that failed can be remembered in a negative LRU cache for API_KEYS_NEGATIVE_TTL seconds, to
+# count the clients retrying the same bad key (negative_hits), it is off by default (API_KEYS_NEGATIVE_SIZE=0):
+# the key is hashed before the cache is asked, after that the index lookup is as cheap as the cache, and a flood of
+# unique invalid keys only fills and evicts it, half the checks/s of the uncached store in benchmarks/api_keys.py
+# only digests are kept, never the presented keys
+#
+# API_KEYS_FILE is a JSON file of hashed keys, reloaded without a restart when its mtime or size changes (checked
+# at most every API_KEYS_RELOAD_INTERVAL seconds), a file that fails to load keeps the previous keys
+#   {"keys": [{"name": "ci", "scopes": ["token"], "sha256": "<hex digest of the key>"}]}
+# the digest of a key: python -c "import hashlib; print(hashlib.sha256(b'the key').hexdigest())"
+# without API_KEYS_FILE the store holds the keys it is seeded with
+
+import hashlib
+import hmac
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, Iterable, Mapping, Optional
+
+API_KEYS_FILE = os.getenv('API_KEYS_FILE')
+API_KEYS_RELOAD_INTERVAL = float(os.getenv('API_KEYS_RELOAD_INTERVAL', '2'))
+API_KEYS_NEGATIVE_SIZE = int(os.getenv('API_KEYS_NEGATIVE_SIZE', '0'))
+API_KEYS_NEGATIVE_TTL = float(os.getenv('API_KEYS_NEGATIVE_TTL', '60'))
+
+
+def digest(key: str) -> bytes:
+    return hashlib.sha256(key.encode('utf-8')).digest()
+
+
+class ApiKey:
+    __slots__ = ('name', 'scopes', 'digest')
+
+    def __init__(self, name: str, scopes: Iterable[str], key_digest: bytes):
+        self.name = name
+        self.scopes: FrozenSet[str] = frozenset(scopes)
+        self.digest = key_digest
+
+
+class ApiKeyStats:
+    def __init__(self):
+        self.accepted = 0
+        self.rejected = 0
+        self.negative_hits = 0  # rejected from the negative cache
+        self.reloads = 0
+        self.reload_errors = 0
+
+    def as_dict(self):
+        return {
+            'accepted': self.accepted,
+            'rejected': self.rejected,
+            'negative_hits': self.negative_hits,
+            'reloads': self.reloads,
+            'reload_errors': self.reload_errors,
+        }
+
+
+class NegativeCache:
+    """ digests of the presented keys that failed, least recently used first"""
+
+    def __init__(self, maxsize: int = API_KEYS_NEGATIVE_SIZE, ttl: float = API_KEYS_NEGATIVE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # (scope, digest of the presented key) -> expires_at
+        self._lock = threading.Lock()
+
+    def __contains__(self, entry) -> bool:
+        expires_at = self._entries.get(entry)  # no lock, a dict lookup is atomic
+        if expires_at is None:
+            return False
+        if expires_at <= time.monotonic():
+            with self._lock:
+                self._entries.pop(entry, None)
+            return False
+        return True
+
+    def add(self, entry):
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            # only keys that are not in the cache are added, they go to the end without move_to_end
+            self._entries[entry] = time.monotonic() + self.ttl
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def load_keys(path: str) -> Dict[bytes, ApiKey]:
+    with open(path) as file:
+        entries = json.load(file)['keys']
+    keys = {}
+    for entry in entries:
+        key_digest = bytes.fromhex(entry['sha256'])
+        if len(key_digest) != hashlib.sha256().digest_size:
+            raise ValueError(f'{entry.get("name")}: sha256 is not a sha256 hex digest')
+        keys[key_digest] = ApiKey(entry.get('name', ''), entry.get('scopes', ()), key_digest)
+    return keys
+
+
+class ApiKeyStore:
+    def __init__(
+            self,
+            seed: Optional[Mapping[str, Iterable[str]]] = None,
+            path: Optional[str] = None,
+            reload_interval: float = API_KEYS_RELOAD_INTERVAL,
+            negative_cache: Optional[NegativeCache] = None,
+    ):
+        """ seed: scope -> plain keys, replaced by the keys of path once it loads"""
+        self.path = path
+        self.reload_interval = reload_interval
+        self.negative = negative_cache if negative_cache is not None else NegativeCache()
+        self.stats = ApiKeyStats()
+        self.last_error: Optional[str] = None
+        self._keys: Dict[bytes, ApiKey] = {}
+        self._file_version = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+        for scope, plain_keys in (seed or {}).items():
+            for plain_key in plain_keys:
+                key_digest = digest(plain_key)
+                existing = self._keys.get(key_digest)
+                scopes = {scope} | (existing.scopes if existing else set())
+                self._keys[key_digest] = ApiKey(f'seed:{scope}', scopes, key_digest)
+        if path is not None:
+            self.reload()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def reload(self):
+        """ loads the file if it changed since the last load"""
+        try:
+            stat = os.stat(self.path)
+            version = (stat.st_mtime_ns, stat.st_size)
+            if version == self._file_version:
+                return
+            self._file_version = version  # a broken file is not parsed again until it changes
+            keys = load_keys(self.path)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            self.stats.reload_errors += 1
+            self.last_error = f'{type(error).__name__}: {error}'
+            return
+        self._keys = keys  # replaced at once, verify never sees half of a file
+        self.negative.clear()  # keys that failed may be in the new file
+        self.stats.reloads += 1
+        self.last_error = None
+
+    def _maybe_reload(self):
+        now = time.monotonic()
+        if self.path is None or now < self._next_check:
+            return
+        with self._lock:
+            if now < self._next_check:
+                return
+            self._next_check = now + self.reload_interval
+            self.reload()
+
+    def verify(self, key: str, scope: str) -> Optional[ApiKey]:
+        """ the ApiKey of key if it is valid for scope, None otherwise"""
+        self._maybe_reload()
+        key_digest = digest(key)
+        if (scope, key_digest) in self.negative:
+            self.stats.negative_hits += 1
+            self.stats.rejected += 1
+            return None
+        api_key = self._keys.get(key_digest)
+        # the lookup found the digest already, compare_digest keeps the check constant time should the index
+        # ever be replaced by a lookup on something else (a prefix, a database row)
+        if api_key is None or not hmac.compare_digest(api_key.digest, key_digest) or scope not in api_key.scopes:
+            self.negative.add((scope, key_digest))
+            self.stats.rejected += 1
+            return None
+        self.stats.accepted += 1
+        return api_key
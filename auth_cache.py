@@ -0,0 +1,78 @@
+# caches for security_jwt.get_current_user
+# a client sends the same bearer token with every request until it expires, verifying its signature and rebuilding
+# the user model each time repeats the same work
+#
+# TokenCache remembers tokens that were already verified, keyed by the sha256 digest of the token (so the cache
+# doesn't keep the tokens themselves), and forgets them when their exp claim passes
+# UserCache keeps the user models by username until they are invalidated
+# both are bounded LRUs, locked because sync dependencies use them from threadpool threads
+
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional
+
+
+class _LRU:
+    def __init__(self, maxsize: int):
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+            return value
+
+    def _set(self, key, value):
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def _delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class TokenCache(_LRU):
+    @staticmethod
+    def _key(token: str) -> bytes:
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token: str) -> Optional[str]:
+        """ the subject of an already verified token that has not expired yet"""
+        key = self._key(token)
+        entry = self._get(key)
+        if entry is None:
+            return None
+        subject, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            self._delete(key)
+            return None  # the caller decodes it again, which rejects it as expired
+        return subject
+
+    def set(self, token: str, subject: str, expires_at: Optional[float]):
+        self._set(self._key(token), (subject, expires_at))
+
+
+class UserCache(_LRU):
+    def get(self, username: str):
+        return self._get(username)
+
+    def set(self, username: str, user):
+        self._set(username, user)
+
+    def invalidate(self, username: str):
+        self._delete(username)
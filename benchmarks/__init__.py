@@ -0,0 +1,3 @@
+# benchmarks and load tests for the sample apps
+# run them from the repository root, e.g. python -m benchmarks.sqlite_concurrency
+# python -m benchmarks.suite runs the scenarios of benchmarks/scenarios against every app, see suite.py
@@ -0,0 +1,87 @@
+# header key checks/sec of api_keys.ApiKeyStore under mixes of valid and invalid keys
+#   literal   - the x_token != 'fake-super-secret-token' check it replaced, for reference
+#   store     - ApiKeyStore.verify, sha256 index + compare_digest, as configured by default
+#   negative  - ApiKeyStore.verify with a negative cache of 10000 digests (API_KEYS_NEGATIVE_SIZE)
+# and the same mixes as requests/sec of GET /items/ in dependencies_path_decorators, in-process
+#
+# python -m benchmarks.api_keys --checks 200000 --requests 2000 --keys 10000
+
+import argparse
+import asyncio
+import random
+import secrets
+import time
+
+import httpx
+
+from api_keys import ApiKeyStore, NegativeCache
+from dependencies_path_decorators import dependencies_path_decorators, get_api_keys
+
+VALID_TOKEN = 'fake-super-secret-token'
+VALID_KEY = 'fake-super-secret-key'
+
+
+def mixes(count: int, repeated_invalid: int) -> dict:
+    """ name -> list of presented tokens"""
+    flood = [secrets.token_urlsafe(24) for _ in range(repeated_invalid)]  # a client retrying a few bad keys
+    return {
+        'valid': [VALID_TOKEN] * count,
+        '50% invalid': [VALID_TOKEN if i % 2 else random.choice(flood) for i in range(count)],
+        '99% repeated invalid': [VALID_TOKEN if i % 100 == 0 else random.choice(flood) for i in range(count)],
+        '99% unique invalid': [VALID_TOKEN if i % 100 == 0 else secrets.token_urlsafe(24) for i in range(count)],
+    }
+
+
+def checks_per_second(check, tokens: list) -> float:
+    start = time.perf_counter()
+    for token in tokens:
+        check(token)
+    return len(tokens) / (time.perf_counter() - start)
+
+
+def literal(token: str) -> bool:
+    return token == VALID_TOKEN
+
+
+def store_with(keys: int, negative_cache: NegativeCache) -> ApiKeyStore:
+    seed = {'token': [VALID_TOKEN] + [secrets.token_urlsafe(24) for _ in range(keys)], 'key': [VALID_KEY]}
+    return ApiKeyStore(seed=seed, negative_cache=negative_cache)
+
+
+async def requests_per_second(tokens: list) -> float:
+    transport = httpx.ASGITransport(app=dependencies_path_decorators)
+    async with httpx.AsyncClient(transport=transport, base_url='http://bench') as client:
+        start = time.perf_counter()
+        for token in tokens:
+            response = await client.get('/items/', headers={'X-Token': token, 'X-Key': VALID_KEY})
+            assert response.status_code == (200 if token == VALID_TOKEN else 400)
+        return len(tokens) / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--checks', type=int, default=200000)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--keys', type=int, default=10000, help='valid keys in the store')
+    parser.add_argument('--repeated-invalid', type=int, default=100, help='distinct keys of the invalid flood')
+    args = parser.parse_args()
+    store = store_with(args.keys, NegativeCache())
+    negative = store_with(args.keys, NegativeCache(maxsize=10000))
+    print(f'{args.keys + 2} keys in the store, checks/s')
+    print(f'{"":22} {"literal":>10} {"store":>10} {"negative":>10}')
+    for name, tokens in mixes(args.checks, args.repeated_invalid).items():
+        results = [
+            checks_per_second(literal, tokens),
+            checks_per_second(lambda token: store.verify(token, 'token'), tokens),
+            checks_per_second(lambda token: negative.verify(token, 'token'), tokens),
+        ]
+        print(f'{name:22} ' + ' '.join(f'{result:10.0f}' for result in results))
+
+    print('\nGET /items/ of dependencies_path_decorators, requests/s')
+    for name, tokens in mixes(args.requests, args.repeated_invalid).items():
+        get_api_keys.cache_clear()  # a fresh store for every mix
+        print(f'{name:22} {asyncio.run(requests_per_second(tokens)):10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,37 @@
+# per-request cost of security_jwt.get_current_user for a client that keeps sending the same bearer token
+# cold clears the token and user caches before every call, which is the work done without them
+#
+# python -m benchmarks.auth_overhead --calls 20000
+
+import argparse
+import asyncio
+import time
+from datetime import timedelta
+
+import security_jwt
+
+
+async def run(calls: int, cold: bool) -> float:
+    token = security_jwt.create_access_token({'sub': 'johndoe'}, expires_delta=timedelta(minutes=5))
+    await security_jwt.get_current_user(token)
+    start = time.perf_counter()
+    for _ in range(calls):
+        if cold:
+            security_jwt.token_cache.clear()
+            security_jwt.user_cache.clear()
+        await security_jwt.get_current_user(token)
+    return (time.perf_counter() - start) / calls
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--calls', type=int, default=20000)
+    args = parser.parse_args()
+    cold = asyncio.run(run(args.calls, cold=True))
+    warm = asyncio.run(run(args.calls, cold=False))
+    print(f'cold  {cold * 1e6:8.2f} us/request')
+    print(f'warm  {warm * 1e6:8.2f} us/request  ({cold / warm:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
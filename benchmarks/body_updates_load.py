@@ -0,0 +1,67 @@
+# lost update check for the PATCH of body_updates
+# every client reads the counter item, adds 1 to its price and PATCHes it back, all clients at the same time
+# (they yield to the event loop between the read and the write, so the requests interleave as over a network)
+#   if-match - the PATCH carries the ETag that was read, a 412 makes the client read again and retry after a
+#              random backoff
+#   blind    - no If-Match, the last write wins
+# with If-Match the final price must equal the number of clients, the blind run shows how many updates get lost
+#
+# python -m benchmarks.body_updates_load --clients 1000
+
+import argparse
+import asyncio
+import random
+import time
+
+import httpx
+
+from body_updates import body_updates_app
+
+KEY = 'counter'
+
+
+async def run(clients: int, use_if_match: bool):
+    transport = httpx.ASGITransport(app=body_updates_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        (await client.put(f'/items/{KEY}', json={'name': 'Counter', 'price': 0})).raise_for_status()
+        conflicts = 0
+
+        async def increment():
+            nonlocal conflicts
+            for attempt in range(1000):
+                response = await client.get(f'/items/{KEY}')
+                await asyncio.sleep(0)
+                headers = {'If-Match': response.headers['ETag']} if use_if_match else {}
+                response = await client.patch(
+                    f'/items/{KEY}', json={'price': response.json()['price'] + 1}, headers=headers
+                )
+                if response.status_code != 412:
+                    response.raise_for_status()
+                    return
+                conflicts += 1
+                await asyncio.sleep(random.uniform(0, 0.001 * 2 ** min(attempt, 12)))
+            raise RuntimeError('gave up after 1000 conflicts')
+
+        start = time.perf_counter()
+        await asyncio.gather(*[increment() for _ in range(clients)])
+        elapsed = time.perf_counter() - start
+        price = (await client.get(f'/items/{KEY}')).json()['price']
+    return int(price), conflicts, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--clients', type=int, default=1000)
+    args = parser.parse_args()
+    for mode, use_if_match in (('blind', False), ('if-match', True)):
+        price, conflicts, elapsed = asyncio.run(run(args.clients, use_if_match))
+        print(
+            f'{mode:9} final {price:6} of {args.clients}  lost {args.clients - price:6}  '
+            f'412 retries {conflicts:7}  {elapsed:6.1f} s'
+        )
+        if use_if_match:
+            assert price == args.clients, 'updates were lost'
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+# cost and gain of compression.py per encoding and level, on the bodies the middleware compresses
+#   read_items             - GET /items/?limit=100 of database_app, 100 items
+#   create_multiple_images - POST /images/multiple of main, 30 images
+#   export                 - GET /items/export of database_app, ndjson in batches of 50, through the stream encoder
+# per level: compressed size, ratio and µs per body, and the µs of a body found in the PrecompressedCache
+# (digest of the body + lookup)
+#
+# python -m benchmarks.compression --repeat 200
+
+import argparse
+import json
+import time
+
+from compression import ENCODING_CLASSES, PrecompressedCache, cache_key
+
+LEVELS = {'gzip': (1, 6, 9), 'br': (1, 4, 11), 'zstd': (1, 3, 19)}
+
+
+def bodies() -> dict:
+    items = [
+        {'title': f'item {i}', 'description': 'created by the benchmark' if i % 3 else None, 'id': i, 'owner_id': 1}
+        for i in range(1, 101)
+    ]
+    images = [{'url': f'http://example.com/{i}.png', 'name': f'img {i}'} for i in range(1, 31)]
+    rows = [json.dumps(item, separators=(',', ':')).encode() + b'\n' for item in items * 10]
+    return {
+        'read_items': json.dumps(items, separators=(',', ':')).encode(),
+        'create_multiple_images': json.dumps(images, separators=(',', ':')).encode(),
+        'export': [b''.join(rows[start:start + 50]) for start in range(0, len(rows), 50)],
+    }
+
+
+def timed(function, repeat: int) -> float:
+    """ µs per call"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    return (time.perf_counter() - start) / repeat * 1e6
+
+
+def stream(encoding, chunks: list) -> bytes:
+    encoder = encoding.stream()
+    return b''.join([encoder.compress(chunk) for chunk in chunks]) + encoder.finish()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    cache = PrecompressedCache()
+    print(f'{"":24} {"encoding":>8} {"level":>5} {"bytes":>8} {"ratio":>6} {"µs":>9} {"cached µs":>9}')
+    for name, body in bodies().items():
+        size = len(body) if isinstance(body, bytes) else sum(len(chunk) for chunk in body)
+        print(f'{name:24} {"identity":>8} {"":>5} {size:8}')
+        for encoding_name, levels in LEVELS.items():
+            for level in levels:
+                try:
+                    encoding = ENCODING_CLASSES[encoding_name](level)
+                except ImportError:
+                    break
+                if isinstance(body, bytes):
+                    compressed = encoding.compress(body)
+                    cost = timed(lambda: encoding.compress(body), args.repeat)
+                    key = (cache_key(body), encoding.name)
+                    cache.put(key, compressed)
+                    cached = f'{timed(lambda: cache.get((cache_key(body), encoding.name)), args.repeat):9.1f}'
+                else:
+                    compressed = stream(encoding, body)
+                    cost = timed(lambda: stream(encoding, body), args.repeat)
+                    cached = f'{"-":>9}'  # streams are not cached
+                print(
+                    f'{"":24} {encoding_name:>8} {level:5} {len(compressed):8} {size / len(compressed):6.1f} '
+                    f'{cost:9.1f} {cached}'
+                )
+
+
+if __name__ == '__main__':
+    main()
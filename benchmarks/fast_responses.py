@@ -0,0 +1,73 @@
+# cpu time to serialize a list of items as database_app.read_items returns them (ORM objects, List[schemas.Item])
+#   fastapi   - serialize_response (validation + jsonable_encoder) and JSONResponse
+#   fast      - FastJSONRoute.serialize (validation + .dict()) and FastJSONResponse
+#
+# python -m benchmarks.fast_responses --items 1000 --repeat 200
+# JSON_BACKEND picks the encoder of FastJSONResponse, see fast_responses.py
+
+import argparse
+import asyncio
+import json
+import time
+from typing import List
+
+from fastapi.routing import APIRoute, serialize_response
+from starlette.responses import JSONResponse, Response
+
+import fast_responses
+from database_app import models, schemas
+
+
+def endpoint():
+    pass
+
+
+def make_items(count: int) -> list:
+    return [
+        models.Item(
+            id=i, title=f'item {i}', description='a description of the item' if i % 2 else None, owner_id=i % 10
+        )
+        for i in range(count)
+    ]
+
+
+async def fastapi_serialize(route: APIRoute, items: list) -> bytes:
+    content = await serialize_response(field=route.response_field, response_content=items)
+    return JSONResponse(content).body
+
+
+def fast_serialize(route: fast_responses.FastJSONRoute, items: list) -> bytes:
+    sub_response = Response()
+    del sub_response.headers['content-length']
+    sub_response.status_code = None
+    return route.serialize(items, sub_response).body
+
+
+def cpu_time(func, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    items = make_items(args.items)
+    route = APIRoute('/items/', endpoint, response_model=List[schemas.Item])
+    fast_route = fast_responses.FastJSONRoute('/items/', endpoint, response_model=List[schemas.Item])
+    loop = asyncio.new_event_loop()
+    expected = json.loads(loop.run_until_complete(fastapi_serialize(route, items)))
+    assert json.loads(fast_serialize(fast_route, items)) == expected
+
+    fastapi = cpu_time(lambda: loop.run_until_complete(fastapi_serialize(route, items)), args.repeat)
+    fast = cpu_time(lambda: fast_serialize(fast_route, items), args.repeat)
+    print(f'{args.items} items, FastJSONResponse encodes with {fast_responses.backend_name}')
+    print(f'fastapi  {fastapi * 1e3:8.2f} ms cpu')
+    print(f'fast     {fast * 1e3:8.2f} ms cpu  (saves {(fastapi - fast) * 1e3:.2f} ms, {fastapi / fast:.1f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# query latency of item_store.ItemStore against a linear scan of the same items
+#
+# python -m benchmarks.item_store --items 1000000
+
+import argparse
+import random
+import string
+import time
+
+from item_store import ItemStore
+
+TAGS = [f'tag{i}' for i in range(50)]
+
+
+def make_items(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    syllables = [''.join(rng.choices(string.ascii_lowercase, k=3)) for _ in range(300)]
+    return [
+        {'item_name': ''.join(rng.choices(syllables, k=3)), 'tags': rng.sample(TAGS, 3)}
+        for _ in range(count)
+    ]
+
+
+def scan(items: list, q=None, tag=None, skip=0, limit=100) -> list:
+    # what filtering the list would cost
+    results = []
+    for item in items:
+        name = item['item_name']
+        if tag is not None and tag not in item['tags']:
+            continue
+        if q and (not name.startswith(q) if len(q) < 3 else q not in name):
+            continue
+        results.append(item)
+    return results[skip:skip + limit]
+
+
+def timed(func, repeat: int) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--items', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=200)
+    args = parser.parse_args()
+    items = make_items(args.items)
+    start = time.perf_counter()
+    store = ItemStore(items)
+    print(f'indexed {len(store)} items in {time.perf_counter() - start:.1f} s')
+
+    sample = items[len(items) // 2]['item_name']
+    queries = {
+        'page skip=500000': dict(skip=min(500000, len(items) // 2)),
+        'tag': dict(tag='tag7'),
+        'q prefix (2 chars)': dict(q=sample[:2]),
+        'q substring (5 chars)': dict(q=sample[2:7]),
+        'q substring + tag': dict(q=sample[2:7], tag='tag7'),
+        'q no match': dict(q='zzzzzz'),
+    }
+    for label, query in queries.items():
+        assert store.query(**query) == scan(items, **query), label
+        indexed = timed(lambda: store.query(**query), args.repeat)
+        linear = timed(lambda: scan(items, **query), 3)
+        print(f'{label:24} indexed {indexed * 1e3:8.3f} ms  scan {linear * 1e3:9.1f} ms  ({linear / indexed:,.0f}x)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# encode and decode micro-benchmark of access tokens
+# python-jose (what security_jwt used before jwt_signing) against the keyring signers, and PyJWT when it is installed
+#
+# python -m benchmarks.jwt_backends --rounds 5000
+
+import argparse
+import time
+
+from jose import jwt as jose_jwt
+
+import jwt_signing
+
+SECRET = 'f9739e470ee4d039995f7b5fd7789816fdbbb3d93b1b3bbe3c7cac11c3df1f55'
+
+
+def _claims():
+    return {'sub': 'johndoe', 'exp': int(time.time()) + 3600}
+
+
+def measure(encode, decode, rounds: int):
+    token = encode(_claims())
+    start = time.perf_counter()
+    for _ in range(rounds):
+        encode(_claims())
+    encode_time = (time.perf_counter() - start) / rounds
+    start = time.perf_counter()
+    for _ in range(rounds):
+        decode(token)
+    decode_time = (time.perf_counter() - start) / rounds
+    return encode_time, decode_time
+
+
+def backends():
+    yield 'jose HS256', (
+        lambda claims: jose_jwt.encode(claims, SECRET, algorithm='HS256'),
+        lambda token: jose_jwt.decode(token, SECRET, algorithms=['HS256']),
+    )
+    try:
+        import jwt as pyjwt  # PyJWT, optional
+    except ImportError:
+        pyjwt = None
+    if pyjwt is not None and hasattr(pyjwt, 'PyJWT'):
+        yield 'pyjwt HS256', (
+            lambda claims: pyjwt.encode(claims, SECRET, algorithm='HS256'),
+            lambda token: pyjwt.decode(token, SECRET, algorithms=['HS256']),
+        )
+    for alg in jwt_signing.SIGNERS:
+        keyring = jwt_signing.KeyRing(jwt_signing.signer_for(alg, SECRET))
+        yield f'keyring {alg}', (keyring.encode, keyring.decode)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rounds', type=int, default=5000)
+    args = parser.parse_args()
+    for name, (encode, decode) in backends():
+        encode_time, decode_time = measure(encode, decode, args.rounds)
+        print(f'{name:16} encode {encode_time * 1e6:8.2f} us   decode {decode_time * 1e6:8.2f} us')
+
+
+if __name__ == '__main__':
+    main()
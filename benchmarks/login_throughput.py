@@ -0,0 +1,44 @@
+# logins/sec of POST /token in security_jwt_app at increasing concurrency
+# the app runs in-process behind httpx's ASGI transport, so the numbers show the event loop and the hashing pool
+# and not the network
+#
+# python -m benchmarks.login_throughput --requests 64 --concurrency 1 4 16 64
+# BCRYPT_ROUNDS, PASSWORD_HASH_SCHEME, PASSWORD_HASH_EXECUTOR and PASSWORD_HASH_WORKERS apply, see passwords.py
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from security_jwt import security_jwt_app
+
+LOGIN = {'username': 'johndoe', 'password': 'secret'}
+
+
+async def run(requests: int, concurrency: int) -> float:
+    semaphore = asyncio.Semaphore(concurrency)
+    transport = httpx.ASGITransport(app=security_jwt_app)
+    async with httpx.AsyncClient(transport=transport, base_url='http://test') as client:
+        async def login():
+            async with semaphore:
+                response = await client.post('/token', data=LOGIN)
+                response.raise_for_status()
+
+        await login()  # the first login may re-hash the stored password to the current parameters
+        start = time.perf_counter()
+        await asyncio.gather(*[login() for _ in range(requests)])
+        return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=64)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    args = parser.parse_args()
+    for concurrency in args.concurrency:
+        print(f'concurrency {concurrency:4}  logins/s {asyncio.run(run(args.requests, concurrency)):8.1f}')
+
+
+if __name__ == '__main__':
+    main()
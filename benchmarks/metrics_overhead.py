@@ -0,0 +1,54 @@
+# per-request cost of metrics.MetricsMiddleware
+# the middleware wraps a bare ASGI app answering right away, so the difference between the wrapped and the bare
+# app is the cost of the middleware alone, without the framework around it
+#
+# python -m benchmarks.metrics_overhead --requests 100000
+
+import argparse
+import asyncio
+import time
+
+import metrics
+
+
+class Route:
+    path = '/items/{item_id}'
+
+
+async def endpoint(scope, receive, send):
+    await receive()
+    scope['route'] = Route  # what the router does when a route matches
+    await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'application/json')]})
+    await send({'type': 'http.response.body', 'body': b'{"item_id":"foo"}'})
+
+
+async def receive():
+    return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+
+async def send(message):
+    pass
+
+
+async def run(app, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        await app({'type': 'http', 'method': 'GET', 'path': '/items/foo'}, receive, send)
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=100000)
+    args = parser.parse_args()
+    wrapped = metrics.MetricsMiddleware(endpoint, registry=metrics.MetricsRegistry())
+    bare = asyncio.run(run(endpoint, args.requests))
+    measured = asyncio.run(run(wrapped, args.requests))
+    overhead = (measured - bare) * 1e6
+    print(f'bare     {bare * 1e6:8.2f} us/request')
+    print(f'metrics  {measured * 1e6:8.2f} us/request')
+    print(f'overhead {overhead:8.2f} us/request  ({"within" if overhead < 20 else "over"} the 20 us budget)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,81 @@
+# requests/sec of a small app with the X-process-time header added by middleware.ProcessTimeMiddleware (asgi)
+# and by the @app.middleware('http') decorator, which runs in starlette's BaseHTTPMiddleware
+# requests are sent straight to the ASGI app, so only the app and its middleware are measured
+#
+# python -m benchmarks.middleware_modes --requests 5000 --concurrency 1 64
+
+import argparse
+import asyncio
+import time
+
+from fastapi import FastAPI
+
+from middleware import ProcessTimeMiddleware, add_process_time_header
+
+
+def make_app(mode: str) -> FastAPI:
+    app = FastAPI()
+    if mode == 'asgi':
+        app.add_middleware(ProcessTimeMiddleware)
+    else:
+        app.middleware('http')(add_process_time_header)
+
+    @app.get('/items/{item_id}')
+    async def read_item(item_id: str):
+        return {'item_id': item_id}
+
+    return app
+
+
+async def request(app):
+    scope = {
+        'type': 'http', 'asgi': {'version': '3.0'}, 'http_version': '1.1', 'method': 'GET', 'scheme': 'http',
+        'path': '/items/foo', 'raw_path': b'/items/foo', 'root_path': '', 'query_string': b'',
+        'headers': [(b'host', b'test')], 'client': ('127.0.0.1', 1234), 'server': ('test', 80),
+    }
+    headers = []
+    received = []
+
+    async def receive():
+        if received:  # the client stays connected, BaseHTTPMiddleware listens for a disconnect meanwhile
+            await asyncio.Event().wait()
+        received.append(True)
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            headers.extend(message['headers'])
+
+    await app(scope, receive, send)
+    assert any(name == b'x-process-time' for name, _ in headers)
+
+
+async def run(mode: str, requests: int, concurrency: int) -> float:
+    app = make_app(mode)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with semaphore:
+            await request(app)
+
+    await request(app)  # builds the middleware stack
+    start = time.perf_counter()
+    await asyncio.gather(*[limited() for _ in range(requests)])
+    return requests / (time.perf_counter() - start)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--requests', type=int, default=5000)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 64])
+    args = parser.parse_args()
+    for concurrency in args.concurrency:
+        results = {mode: asyncio.run(run(mode, args.requests, concurrency)) for mode in ('decorator', 'asgi')}
+        print(
+            f'concurrency {concurrency:4}  decorator {results["decorator"]:8.0f} req/s  '
+            f'asgi {results["asgi"]:8.0f} req/s  ({results["asgi"] / results["decorator"]:.2f}x)'
+        )
+
+
+if __name__ == '__main__':
+    main()
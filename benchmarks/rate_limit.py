@@ -0,0 +1,50 @@
+# decisions/sec of rate_limit.RateLimiter.hit per backend
+#   memory    - MemoryBackend, token buckets of this process
+#   fakeredis - RedisBackend on fakeredis, the Lua script without the network (needs lupa)
+# over a few hot keys (one client hammering) and many keys (a crowd, exercising the sweep)
+#
+# python -m benchmarks.rate_limit --hits 100000 --keys 10000
+
+import argparse
+import asyncio
+import time
+
+from rate_limit import MemoryBackend, RateLimiter, RedisBackend
+
+
+async def hits_per_second(limiter: RateLimiter, keys: list, hits: int) -> float:
+    start = time.perf_counter()
+    for i in range(hits):
+        await limiter.hit(keys[i % len(keys)])
+    return hits / (time.perf_counter() - start)
+
+
+def backends() -> dict:
+    result = {'memory': MemoryBackend}
+    try:
+        import fakeredis.aioredis
+        result['fakeredis'] = lambda: RedisBackend(fakeredis.aioredis.FakeRedis())
+    except ImportError:
+        pass
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--hits', type=int, default=100000)
+    parser.add_argument('--keys', type=int, default=10000, help='distinct keys of the crowd')
+    args = parser.parse_args()
+    mixes = {'1 hot key': ['ip:10.0.0.1'], f'{args.keys} keys': [f'ip:10.{i}' for i in range(args.keys)]}
+    print('decisions/s')
+    print(f'{"":14} ' + ' '.join(f'{name:>12}' for name in mixes))
+    for name, backend in backends().items():
+        hits = args.hits if name == 'memory' else args.hits // 10  # the script is much slower, keep the run short
+        results = []
+        for keys in mixes.values():
+            limiter = RateLimiter(rate=100, burst=200, backend=backend())
+            results.append(asyncio.run(hits_per_second(limiter, keys, hits)))
+        print(f'{name:14} ' + ' '.join(f'{result:12.0f}' for result in results))
+
+
+if __name__ == '__main__':
+    main()
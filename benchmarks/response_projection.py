@@ -0,0 +1,80 @@
+# response_model filtering, FastAPI's validation + jsonable_encoder against the compiled projection of FastJSONRoute
+# times
+#   update_item - main.update_item, the dict of an Item with nested images and response_model_exclude_unset
+#   create_user - main.create_user, a UserIn returned as UserOut
+# that both give the same body is checked by tests/test_response_projection.py
+#
+# python -m benchmarks.response_projection --repeat 20000
+
+import argparse
+import asyncio
+import time
+from typing import Any
+
+from fastapi.routing import APIRoute, serialize_response
+from starlette.responses import JSONResponse, Response
+
+import fast_responses
+from main import Image, Item, UserIn, UserOut
+
+
+def endpoint():
+    pass
+
+
+def image(i: int = 0):
+    return Image(url=f'http://example.com/{i}.png', name=f'image {i}')
+
+
+async def fastapi_serialize(route: APIRoute, content: Any) -> bytes:
+    response = await serialize_response(
+        field=route.secure_cloned_response_field,
+        response_content=content,
+        include=route.response_model_include,
+        exclude=route.response_model_exclude,
+        by_alias=route.response_model_by_alias,
+        exclude_unset=route.response_model_exclude_unset,
+        exclude_defaults=route.response_model_exclude_defaults,
+        exclude_none=route.response_model_exclude_none,
+    )
+    return JSONResponse(response).body
+
+
+def fast_serialize(route: fast_responses.FastJSONRoute, content: Any) -> bytes:
+    sub_response = Response()
+    del sub_response.headers['content-length']
+    sub_response.status_code = None
+    return route.serialize(content, sub_response).body
+
+
+def cpu_time(func, repeat: int) -> float:
+    start = time.process_time()
+    for _ in range(repeat):
+        func()
+    return (time.process_time() - start) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--repeat', type=int, default=20000)
+    args = parser.parse_args()
+    loop = asyncio.new_event_loop()
+
+    scenarios = [
+        ('update_item', Item, {'response_model_exclude_unset': True}, {'item_id': 1, **Item(
+            name='Foo', price=10.0, tax=1.0, description='a description', tags={'a', 'b'}, images=[image(1), image(2)]
+        ).dict()}),
+        ('create_user', UserOut, {}, UserIn(username='foo', password='secret', email='foo@example.com')),
+    ]
+    for name, response_model, options, content in scenarios:
+        route = APIRoute('/', endpoint, response_model=response_model, **options)
+        fast_route = fast_responses.FastJSONRoute('/', endpoint, response_model=response_model, **options)
+        fastapi = cpu_time(lambda: loop.run_until_complete(fastapi_serialize(route, content)), args.repeat)
+        fast = cpu_time(lambda: fast_serialize(fast_route, content), args.repeat)
+        print(
+            f'{name:12} fastapi {fastapi * 1e6:7.1f} us  projected {fast * 1e6:7.1f} us  ({fastapi / fast:.1f}x)'
+        )
+
+
+if __name__ == '__main__':
+    main()
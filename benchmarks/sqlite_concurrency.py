@@ -0,0 +1,79 @@
+# load test of the sqlite engine profile in database_app/database.py
+# readers select users by id while writers insert items, both on their own threads, for a fixed time
+# run once with sqlite's defaults (rollback journal, synchronous=FULL) and once with the tuned pragmas
+#
+# python -m benchmarks.sqlite_concurrency --readers 8 --writers 2 --seconds 5
+
+import argparse
+import os
+import random
+import tempfile
+import threading
+import time
+
+from sqlalchemy import insert, select
+from sqlalchemy.exc import OperationalError
+
+from database_app import models
+from database_app.database import SQLITE_PRAGMAS, make_engine
+
+USERS = 1000
+
+
+def run(pragmas, readers: int, writers: int, seconds: float):
+    with tempfile.TemporaryDirectory() as directory:
+        engine = make_engine(f'sqlite:///{os.path.join(directory, "bench.db")}', pragmas)
+        models.Base.metadata.create_all(bind=engine)
+        with engine.begin() as conn:
+            conn.execute(insert(models.User), [
+                {'email': f'user{n}@example.com', 'hashed_password': 'x'} for n in range(USERS)
+            ])
+        counts = {'reads': 0, 'writes': 0, 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def reader():
+            done = 0
+            while time.perf_counter() < deadline:
+                with engine.connect() as conn:
+                    conn.execute(select(models.User).filter(models.User.id == random.randint(1, USERS))).first()
+                done += 1
+            with lock:
+                counts['reads'] += done
+
+        def writer():
+            done = errors = 0
+            while time.perf_counter() < deadline:
+                try:
+                    with engine.begin() as conn:
+                        conn.execute(insert(models.Item), {'title': 'bench', 'owner_id': random.randint(1, USERS)})
+                    done += 1
+                except OperationalError:  # database is locked
+                    errors += 1
+            with lock:
+                counts['writes'] += done
+                counts['errors'] += errors
+
+        threads = [threading.Thread(target=reader) for _ in range(readers)]
+        threads += [threading.Thread(target=writer) for _ in range(writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        engine.dispose()
+    return {name: count / seconds if name != 'errors' else count for name, count in counts.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--readers', type=int, default=8)
+    parser.add_argument('--writers', type=int, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+    for name, pragmas in (('sqlite defaults', {}), ('tuned profile', SQLITE_PRAGMAS)):
+        result = run(pragmas, args.readers, args.writers, args.seconds)
+        print(f'{name:16} reads/s {result["reads"]:10.0f}  writes/s {result["writes"]:8.0f}  errors {result["errors"]}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,358 @@
+# load test of the sample apps from scenario files, with baselines to catch regressions
+#
+#   python -m benchmarks.suite run [scenario files] [--server asgi|uvicorn | --url URL] [--save baseline.json]
+#   python -m benchmarks.suite compare baseline.json current.json [--threshold 10]
+#
+# run   sends the requests of every scenario of the files (all of benchmarks/scenarios/ by default) and prints,
+#       per scenario, requests/sec, p50/p95/p99 latency, the mean response size (as sent, compressed or not), the
+#       CPU time per request and the RSS of the server
+#         --server asgi     the app runs in this process behind httpx's ASGI transport (default), no network
+#         --server uvicorn  the app runs in a uvicorn started for the file, on a free local port
+#         --url URL         an already running server, its RSS is not known
+#       --save writes the results as JSON, a baseline for compare
+#       in-process the RSS is the one of the runner, with the apps of the files run before, compare runs of the
+#       same files; the CPU time is the one of the runner too, the client's share (building the requests, decoding
+#       the responses) included, use --server uvicorn for the server's alone
+# compare  flags every metric worse than the baseline by more than --threshold percent, exits with 1 if any
+#
+# a scenario file describes one app:
+# {
+#   "app": "security_jwt:security_jwt_app",       module:attribute, imported from the repository root
+#   "env": {"NAME": "value"},                      set before the app is imported, unless already set
+#   "fixtures": {"files/a.txt": 4096},             files of that size written in {tmp} before the app starts
+#   "variables": {"images": [...]},                values for {name}, bodies shared by scenarios
+#   "defaults": {"requests": 500, "concurrency": 8, "warmup": 20},
+#   "setup": [                                     sent once (or repeat times), in order, before the scenarios
+#     {"method": "POST", "path": "/token", "data": {...}, "save": {"token": "access_token"}}
+#   ],
+#   "scenarios": [
+#     {"name": "own_items", "path": "/users/me/items", "headers": {"Authorization": "Bearer {token}"}}
+#   ]
+# }
+# a request has method (GET), path, params, headers, json, data, files ([field, filename, size], ...) and
+# expect (200, or a list of status codes), scenarios may override requests, concurrency and warmup
+# {name} in a string is replaced by a variable: tmp (a temporary directory for the run), run (unique per run),
+# n (the number of the request) and the values saved by setup, from the fields of its json response (of the last
+# request of a repeated step)
+
+import argparse
+import asyncio
+import glob
+import importlib
+import json
+import math
+import os
+import platform
+import re
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCENARIOS_DIR = os.path.join(ROOT, 'benchmarks', 'scenarios')
+DEFAULTS = {'requests': 500, 'concurrency': 8, 'warmup': 20}
+# metric: True when higher is better
+METRICS = {
+    'rps': True, 'p50_ms': False, 'p95_ms': False, 'p99_ms': False, 'cpu_ms': False, 'rss_mb': False, 'bytes': False,
+}
+
+VARIABLE = re.compile(r'\{(\w+)\}')
+
+
+def substitute(value: Any, variables: Dict[str, Any]) -> Any:
+    """ value with the {name} of known variables replaced, in strings, lists and dicts, a string that is only
+    {name} is replaced by the value itself"""
+    if isinstance(value, str):
+        match = VARIABLE.fullmatch(value)
+        if match and match.group(1) in variables:
+            return variables[match.group(1)]  # as it is, a list or a number stays one
+        return VARIABLE.sub(lambda match: str(variables.get(match.group(1), match.group(0))), value)
+    if isinstance(value, list):
+        return [substitute(item, variables) for item in value]
+    if isinstance(value, dict):
+        return {key: substitute(item, variables) for key, item in value.items()}
+    return value
+
+
+def rss_mb(pid: Optional[int] = None) -> Optional[float]:
+    try:
+        with open(f'/proc/{pid or "self"}/status') as status:
+            for line in status:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if pid is None:
+        import resource  # peak and not current RSS, where there is no /proc
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / 1024 / (1024 if sys.platform == 'darwin' else 1)
+    return None
+
+
+def cpu_seconds(pid: Optional[int] = None) -> Optional[float]:
+    """ user + system CPU time of the process, of this one when pid is None"""
+    if pid is None:
+        return time.process_time()
+    try:
+        with open(f'/proc/{pid}/stat') as stat:
+            fields = stat.read().rpartition(')')[2].split()  # the name in parentheses may contain spaces
+    except OSError:
+        return None
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')  # utime and stime
+
+
+def percentile(ordered: List[float], p: float) -> float:
+    # nearest rank
+    return ordered[max(math.ceil(p / 100 * len(ordered)) - 1, 0)]
+
+
+def build_request(spec: dict, variables: dict) -> dict:
+    spec = substitute(spec, variables)
+    request = {'method': spec.get('method', 'GET'), 'url': spec['path']}
+    for key in ('params', 'headers', 'json', 'data'):
+        if key in spec:
+            request[key] = spec[key]
+    if 'files' in spec:
+        request['files'] = [(field, (filename, b'x' * int(size))) for field, filename, size in spec['files']]
+    return request
+
+
+def expected_status(spec: dict) -> tuple:
+    expect = spec.get('expect', 200)
+    return tuple(expect) if isinstance(expect, list) else (expect,)
+
+
+async def setup(client: httpx.AsyncClient, steps: List[dict], variables: dict):
+    for step in steps:
+        for n in range(1, step.get('repeat', 1) + 1):
+            response = await client.request(**build_request(step, {**variables, 'n': n}))
+            if response.status_code not in expected_status(step):
+                raise RuntimeError(f'setup {step["path"]}: {response.status_code} {response.text}')
+        for name, field in step.get('save', {}).items():
+            value = response.json()
+            for key in field.split('.'):
+                value = value[int(key)] if isinstance(value, list) else value[key]
+            variables[name] = value
+
+
+async def run_scenario(client: httpx.AsyncClient, spec: dict, variables: dict, pid: Optional[int]) -> dict:
+    requests, concurrency, warmup = spec['requests'], spec['concurrency'], spec['warmup']
+    expect = expected_status(spec)
+    latencies = []
+    counters = {'sent': 0, 'errors': 0, 'bytes': 0}
+
+    async def worker(count: int, record: bool):
+        while counters['sent'] < count:
+            counters['sent'] += 1
+            request = build_request(spec, {**variables, 'n': counters['sent']})
+            start = time.perf_counter()
+            response = await client.request(**request)
+            elapsed = time.perf_counter() - start
+            if not record:
+                continue
+            latencies.append(elapsed)
+            counters['bytes'] += response.num_bytes_downloaded  # as sent, before decompression
+            if response.status_code not in expect:
+                counters['errors'] += 1
+
+    await asyncio.gather(*[worker(warmup, False) for _ in range(min(concurrency, warmup))])
+    counters['sent'] = 0
+    cpu_start = None if pid == 0 else cpu_seconds(pid)
+    start = time.perf_counter()
+    await asyncio.gather(*[worker(requests, True) for _ in range(concurrency)])
+    elapsed = time.perf_counter() - start
+    cpu_end = None if cpu_start is None else cpu_seconds(pid)
+    latencies.sort()
+    rss = None if pid == 0 else rss_mb(pid)
+    return {
+        'requests': requests,
+        'concurrency': concurrency,
+        'errors': counters['errors'],
+        'rps': round(requests / elapsed, 1),
+        'p50_ms': round(percentile(latencies, 50) * 1e3, 3),
+        'p95_ms': round(percentile(latencies, 95) * 1e3, 3),
+        'p99_ms': round(percentile(latencies, 99) * 1e3, 3),
+        'cpu_ms': None if cpu_end is None else round((cpu_end - cpu_start) / requests * 1e3, 3),
+        'rss_mb': None if rss is None else round(rss, 1),
+        'bytes': round(counters['bytes'] / requests),
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_uvicorn(app: str, env: dict) -> (subprocess.Popen, str):
+    port = free_port()
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'uvicorn', app, '--port', str(port), '--log-level', 'warning', '--no-access-log'],
+        cwd=ROOT, env={**env, **os.environ},  # as in-process, the environment wins
+    )
+    url = f'http://127.0.0.1:{port}'
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'uvicorn {app} exited with {process.returncode}')
+        try:
+            with socket.create_connection(('127.0.0.1', port), timeout=0.1):
+                return process, url
+        except OSError:
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f'uvicorn {app} did not start')
+
+
+def import_app(app: str):
+    if ROOT not in sys.path:
+        sys.path.insert(0, ROOT)
+    module, _, attribute = app.partition(':')
+    return getattr(importlib.import_module(module), attribute)
+
+
+async def run_file(path: str, args) -> Dict[str, dict]:
+    with open(path) as file:
+        suite = json.load(file)
+    suite_name = os.path.splitext(os.path.basename(path))[0]
+    defaults = {**DEFAULTS, **suite.get('defaults', {})}
+    overrides = {key: getattr(args, key) for key in DEFAULTS if getattr(args, key) is not None}
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp:
+        variables = {'tmp': tmp, 'run': uuid.uuid4().hex[:12]}
+        variables.update(substitute(suite.get('variables', {}), variables))
+        env = substitute(suite.get('env', {}), variables)
+        for fixture, size in suite.get('fixtures', {}).items():
+            os.makedirs(os.path.dirname(os.path.join(tmp, fixture)), exist_ok=True)
+            with open(os.path.join(tmp, fixture), 'wb') as file:
+                file.write(os.urandom(size))
+        process = app = None
+        if args.url:
+            url, pid = args.url, 0
+            client = httpx.AsyncClient(base_url=url, timeout=60)
+        elif args.server == 'uvicorn':
+            process, url = start_uvicorn(suite['app'], env)
+            pid = process.pid
+            client = httpx.AsyncClient(base_url=url, timeout=60)
+        else:
+            for name, value in env.items():
+                os.environ.setdefault(name, value)
+            app = import_app(suite['app'])
+            await app.router.startup()  # the ASGI transport doesn't send lifespan events
+            pid = None
+            # an exception of the app is a 500 counted in the errors of its scenario, as uvicorn would answer it,
+            # not the end of the run
+            transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+            client = httpx.AsyncClient(transport=transport, base_url='http://bench', timeout=60)
+        try:
+            async with client:
+                await setup(client, suite.get('setup', []), variables)
+                for spec in suite['scenarios']:
+                    name = f'{suite_name}/{spec["name"]}'
+                    if args.scenario and not any(re.search(pattern, name) for pattern in args.scenario):
+                        continue
+                    result = await run_scenario(client, {**defaults, **spec, **overrides}, variables, pid)
+                    results[name] = result
+                    print_result(name, result)
+        finally:
+            if app is not None:
+                await app.router.shutdown()
+            if process is not None:
+                process.terminate()
+                process.wait()
+    return results
+
+
+def print_result(name: str, result: dict):
+    rss = '     -' if result['rss_mb'] is None else f'{result["rss_mb"]:6.1f}'
+    cpu = '     -' if result.get('cpu_ms') is None else f'{result["cpu_ms"]:6.2f}'
+    errors = f'  {result["errors"]} errors' if result['errors'] else ''
+    print(
+        f'{name:40} {result["rps"]:9.1f} req/s  p50 {result["p50_ms"]:8.2f}  p95 {result["p95_ms"]:8.2f}  '
+        f'p99 {result["p99_ms"]:8.2f} ms  cpu {cpu} ms  {result["bytes"]:7} B  rss {rss} MB{errors}',
+        flush=True,
+    )
+
+
+def run(args):
+    files = args.files or sorted(glob.glob(os.path.join(SCENARIOS_DIR, '*.json')))
+    results = {}
+    for path in files:
+        results.update(asyncio.run(run_file(path, args)))
+    if args.save:
+        report = {
+            'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'server': 'url' if args.url else args.server,
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'results': results,
+        }
+        os.makedirs(os.path.dirname(os.path.abspath(args.save)), exist_ok=True)
+        with open(args.save, 'w') as file:
+            json.dump(report, file, indent=2)
+        print(f'saved {args.save}')
+
+
+def compare(args) -> int:
+    with open(args.baseline) as file:
+        baseline = json.load(file)['results']
+    with open(args.current) as file:
+        current = json.load(file)['results']
+    regressions = 0
+    for name in sorted(set(baseline) & set(current)):
+        for metric, higher_is_better in METRICS.items():
+            before, after = baseline[name].get(metric), current[name].get(metric)
+            if not before or after is None:
+                continue
+            change = (after - before) / before * 100
+            worse = -change if higher_is_better else change
+            if metric.endswith('_ms') and abs(after - before) < args.min_ms:
+                worse = 0  # sub-threshold noise of the fastest routes
+            flag = 'REGRESSION' if worse > args.threshold else ''
+            regressions += bool(flag)
+            if flag or args.verbose:
+                print(f'{name:40} {metric:7} {before:10.2f} -> {after:10.2f}  {change:+7.1f}%  {flag}')
+        if current[name].get('errors', 0) > baseline[name].get('errors', 0):
+            regressions += 1
+            print(f'{name:40} errors  {baseline[name].get("errors", 0)} -> {current[name]["errors"]}  REGRESSION')
+    missing = set(baseline) - set(current)
+    if missing:
+        print(f'{len(missing)} scenarios of the baseline were not run')
+    print(f'{regressions} regressions above {args.threshold}%')
+    return 1 if regressions else 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    commands = parser.add_subparsers(dest='command', required=True)
+    run_parser = commands.add_parser('run')
+    run_parser.add_argument('files', nargs='*', help='scenario files, all of benchmarks/scenarios by default')
+    run_parser.add_argument('--server', choices=('asgi', 'uvicorn'), default='asgi')
+    run_parser.add_argument('--url', help='an already running server, instead of --server')
+    run_parser.add_argument('--scenario', action='append', help='regex on suite/scenario, may be repeated')
+    run_parser.add_argument('--requests', type=int)
+    run_parser.add_argument('--concurrency', type=int)
+    run_parser.add_argument('--warmup', type=int)
+    run_parser.add_argument('--save', help='write the results to this JSON file')
+    compare_parser = commands.add_parser('compare')
+    compare_parser.add_argument('baseline')
+    compare_parser.add_argument('current')
+    compare_parser.add_argument('--threshold', type=float, default=10, help='percent')
+    compare_parser.add_argument('--min-ms', type=float, default=0.05, help='latency changes below are ignored')
+    compare_parser.add_argument('--verbose', action='store_true', help='print every metric')
+    args = parser.parse_args()
+    if args.command == 'run':
+        run(args)
+    else:
+        sys.exit(compare(args))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,11 @@
 from typing import Optional, List
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Header, HTTPException, Response
 from fastapi.encoders import jsonable_encoder
 from pydantic import BaseModel
+from starlette import status
+
+from versioned_store import VersionedStore, VersionConflict
 
 body_updates_app = FastAPI()
 
@@ -15,35 +18,56 @@ class Item(BaseModel):
     tags: List[str] = []
 
 
-items = {
+# every item has a version, sent as its ETag, see versioned_store.py
+# writes sent with If-Match: <ETag> fail with 412 when someone else changed the item since it was read
+items = VersionedStore({
     "foo": {"name": "Foo", "price": 50.2},
     "bar": {"name": "Bar", "description": "The bartenders", "price": 62, "tax": 20.2},
     "baz": {"name": "Baz", "description": None, "price": 50.2, "tax": 10.5, "tags": []},
-}
+})
+
+
+def precondition_failed(conflict: VersionConflict):
+    headers = {'ETag': conflict.etag} if conflict.etag is not None else None
+    return HTTPException(status_code=status.HTTP_412_PRECONDITION_FAILED, detail=str(conflict), headers=headers)
+
 
 @body_updates_app.get('/items/{item_id}', response_model=Item)
-async def read_item(item_id: str):
-    return items[item_id]
+async def read_item(item_id: str, response: Response):
+    try:
+        item, etag = items.get(item_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail='Item not found')
+    response.headers['ETag'] = etag
+    return item
 
 
 # PUT is used to receive data that should replace existing data
 # if if the key is not in the new data, it will be substituted by the default value in the pydantic model
 @body_updates_app.put('/items/{item_id}', response_model=Item)
-async def update_item(item_id: str, item: Item):
+async def update_item(item_id: str, item: Item, response: Response, if_match: Optional[str] = Header(None)):
     update_item_encoded = jsonable_encoder(item) # returns a dict with json compatible data
-    items[item_id] = update_item_encoded
-    return update_item_encoded
+    try:
+        stored, etag = items.put(item_id, update_item_encoded, if_match=if_match)
+    except VersionConflict as e:
+        raise precondition_failed(e)
+    response.headers['ETag'] = etag
+    return stored
 
 
 # partial updates with PATCH (the operation type is just a convention)
 # you can send only the data that you want to update, leaving the rest intact
 # if you want to receive partial updates, use parameter exclude_unset in pydantic's mode's .dict()
 @body_updates_app.patch('/items/{item_id}', response_model=Item)
-async def update_item(item_id: str, item: Item): # you can make a separate update model with optional fields instead of required for creation
-    stored_item_data = items[item_id] # retrieve the stored data
-    stored_item_model = Item(**stored_item_data) # put stored data in model
+async def update_item(item_id: str, item: Item, response: Response, if_match: Optional[str] = Header(None)): # you can make a separate update model with optional fields instead of required for creation
     update_data = item.dict(exclude_unset=True) # generate dict without unset default values
-    updated_item = stored_item_model.copy(update=update_data) # creates a copy of stored model and updates model
-    items[item_id] = jsonable_encoder(updated_item) # converts model into dict compatible with json stores dict in the db which is a dict in the example
-    return updated_item # returns updated model
-
+    # the set fields are merged into the stored dict under the store's lock
+    # instead of Item(**stored).copy(update=update_data) and jsonable_encoder of the whole item
+    try:
+        updated_item, etag = items.patch(item_id, update_data, if_match=if_match)
+    except KeyError:
+        raise HTTPException(status_code=404, detail='Item not found')
+    except VersionConflict as e:
+        raise precondition_failed(e)
+    response.headers['ETag'] = etag
+    return updated_item # validated against Item on the way out
@@ -0,0 +1,368 @@
+# negotiated response compression
+# CompressionMiddleware picks the encoding of a response from the Accept-Encoding of the request: zstd, br and gzip,
+# in the order of COMPRESSION_ENCODINGS among those the client accepts with the highest q-value; br needs brotli and
+# zstd needs zstandard, they are left out when not installed
+#
+#   - bodies smaller than COMPRESSION_MIN_SIZE and responses that are not text or json go out as they are, as do
+#     responses that already have a Content-Encoding, partial (206) and bodiless (204, 304, HEAD) responses
+#   - a file the app sends with the pathsend or zerocopysend extension of the server is read in a worker thread and
+#     compressed when its response is compressible, other files are still sent by the server without copying them
+#     through python; compressed responses have no Accept-Ranges
+#   - a body sent in one message (Response, JSONResponse ...) is compressed at once, with a Content-Length; the
+#     compressed body is kept in a PrecompressedCache keyed by (digest of the body, encoding), an identical response
+#     is sent again without compressing it (not by ETag, an ETag is only unique among the versions of one resource,
+#     versioned_store.py gives "1" to every key)
+#   - a body sent in several messages (StreamingResponse) is compressed as it goes, every message of the app is
+#     compressed and flushed on its own so the client gets the rows as they are read
+#
+# the compression level of each encoding is set with COMPRESSION_GZIP_LEVEL (1-9), COMPRESSION_BROTLI_LEVEL (0-11)
+# and COMPRESSION_ZSTD_LEVEL (1-22), the time spent is reported in the Server-Timing header of compressed bodies
+#   compress;dur=0.412;desc="gzip"         compressed for this response
+#   compress;dur=0.006;desc="gzip cached"  found in the cache
+#
+# compressed responses have Vary: Accept-Encoding and their ETag made weak, the compressed bytes are not the ones
+# the ETag was computed from, If-None-Match compares weak ETags (see file_serving.py)
+#
+# use it for a whole app:
+#   app.add_middleware(CompressionMiddleware)
+
+import functools
+import gzip
+import hashlib
+import os
+import time
+import zlib
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional, Tuple
+
+import anyio
+from starlette.datastructures import Headers, MutableHeaders
+
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+COMPRESSION_ENCODINGS = tuple(os.getenv('COMPRESSION_ENCODINGS', 'zstd,br,gzip').split(','))
+COMPRESSION_GZIP_LEVEL = int(os.getenv('COMPRESSION_GZIP_LEVEL', '6'))
+COMPRESSION_BROTLI_LEVEL = int(os.getenv('COMPRESSION_BROTLI_LEVEL', '4'))
+COMPRESSION_ZSTD_LEVEL = int(os.getenv('COMPRESSION_ZSTD_LEVEL', '3'))
+COMPRESSION_CACHE_BYTES = int(os.getenv('COMPRESSION_CACHE_BYTES', str(32 * 1024 * 1024)))
+
+COMPRESSIBLE_TYPES = frozenset((
+    'application/json', 'application/x-ndjson', 'application/javascript', 'application/xml', 'image/svg+xml',
+))
+NO_BODY_STATUSES = frozenset((204, 206, 304))
+SENDFILE_EXTENSIONS = ('http.response.pathsend', 'http.response.zerocopysend')
+FILE_CHUNK_SIZE = 64 * 1024  # of the files of those extensions, read to be compressed
+
+
+class GzipEncoding:
+    name = 'gzip'
+
+    def __init__(self, level: int = COMPRESSION_GZIP_LEVEL):
+        self.level = level
+
+    def compress(self, body: bytes) -> bytes:
+        return gzip.compress(body, compresslevel=self.level, mtime=0)  # no timestamp, the same body compresses the same
+
+    def stream(self) -> 'StreamEncoder':
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)  # with the gzip header
+        return StreamEncoder(compressor.compress, lambda: compressor.flush(zlib.Z_SYNC_FLUSH), compressor.flush)
+
+
+class BrotliEncoding:
+    name = 'br'
+
+    def __init__(self, level: int = COMPRESSION_BROTLI_LEVEL):
+        import brotli  # only needed for this encoding
+        self.brotli = brotli
+        self.level = level
+
+    def compress(self, body: bytes) -> bytes:
+        return self.brotli.compress(body, quality=self.level)
+
+    def stream(self) -> 'StreamEncoder':
+        compressor = self.brotli.Compressor(quality=self.level)
+        return StreamEncoder(compressor.process, compressor.flush, compressor.finish)
+
+
+class ZstdEncoding:
+    name = 'zstd'
+
+    def __init__(self, level: int = COMPRESSION_ZSTD_LEVEL):
+        import zstandard  # only needed for this encoding
+        self.zstandard = zstandard
+        self.compressor = zstandard.ZstdCompressor(level=level)
+        self.level = level
+
+    def compress(self, body: bytes) -> bytes:
+        return self.compressor.compress(body)
+
+    def stream(self) -> 'StreamEncoder':
+        compressor = self.compressor.compressobj()
+        return StreamEncoder(
+            compressor.compress,
+            lambda: compressor.flush(self.zstandard.COMPRESSOBJ_FLUSH_BLOCK),
+            compressor.flush,
+        )
+
+
+class StreamEncoder:
+    """ compresses a body one part at a time, what a part gives can be decompressed before the next is sent"""
+    __slots__ = ('_compress', '_flush', '_finish')
+
+    def __init__(self, compress, flush, finish):
+        self._compress = compress
+        self._flush = flush
+        self._finish = finish
+
+    def compress(self, data: bytes) -> bytes:
+        return self._compress(data) + self._flush()
+
+    def finish(self) -> bytes:
+        return self._finish()
+
+
+ENCODING_CLASSES = {'gzip': GzipEncoding, 'br': BrotliEncoding, 'zstd': ZstdEncoding}
+
+
+def available_encodings(names: Iterable[str]) -> Dict[str, object]:
+    """ name -> encoding of those that can be used here, in the order of names"""
+    encodings = {}
+    for name in names:
+        name = name.strip()
+        if name not in ENCODING_CLASSES:
+            raise ValueError(f'unknown encoding {name!r}, the encodings are {", ".join(ENCODING_CLASSES)}')
+        try:
+            encodings[name] = ENCODING_CLASSES[name]()
+        except ImportError:
+            pass
+    return encodings
+
+
+@functools.lru_cache(maxsize=256)
+def negotiate(accept_encoding: str, offered: Tuple[str, ...]) -> Optional[str]:
+    """ the encoding of offered the client accepts with the highest q-value, the first of them on a tie,
+    None for identity"""
+    # the clients of an app send a handful of different headers, they are parsed once
+    qvalues = {}
+    for part in accept_encoding.lower().split(','):
+        name, _, params = part.partition(';')
+        name = name.strip()
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qvalues['gzip' if name == 'x-gzip' else name] = q
+    best, best_q = None, 0.0
+    for name in offered:
+        q = qvalues.get(name, qvalues.get('*', 0.0))
+        if q > best_q:
+            best, best_q = name, q
+    return best
+
+
+def compressible(status: int, headers: Headers) -> bool:
+    if status < 200 or status in NO_BODY_STATUSES or 'content-encoding' in headers or 'content-range' in headers:
+        return False
+    media_type = headers.get('content-type', '').partition(';')[0].strip().lower()
+    return (
+        media_type.startswith('text/') or media_type in COMPRESSIBLE_TYPES
+        or media_type.endswith('+json') or media_type.endswith('+xml')
+    )
+
+
+class PrecompressedCache:
+    """ compressed bodies by (digest of the body, encoding), least recently used first, at most max_bytes of them"""
+
+    def __init__(self, max_bytes: int = COMPRESSION_CACHE_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # (digest, encoding) -> compressed body
+        # only the event loop touches it, no lock
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key) -> Optional[bytes]:
+        body = self._entries.get(key)
+        if body is None:
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return body
+
+    def put(self, key, body: bytes):
+        if len(body) > self.max_bytes // 8:  # one large body doesn't push out all the others
+            return
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size -= len(previous)
+        self._entries[key] = body
+        self.size += len(body)
+        while self.size > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size -= len(evicted)
+
+    def clear(self):
+        self._entries.clear()
+        self.size = 0
+
+    def as_dict(self):
+        return {'entries': len(self._entries), 'bytes': self.size, 'hits': self.hits, 'misses': self.misses}
+
+
+def cache_key(body: bytes) -> bytes:
+    # an order of magnitude faster than compressing the body
+    return hashlib.blake2b(body, digest_size=16).digest()
+
+
+class CompressionMiddleware:
+    """ compresses the bodies of the responses in the encoding negotiated with the client, see the top of the file"""
+
+    def __init__(
+            self,
+            app,
+            minimum_size: int = COMPRESSION_MIN_SIZE,
+            encodings: Iterable[str] = COMPRESSION_ENCODINGS,
+            cache: Optional[PrecompressedCache] = None,
+    ):
+        self.app = app
+        self.minimum_size = minimum_size
+        self.encodings = available_encodings(encodings)
+        self.offered = tuple(self.encodings)
+        self.cache = cache if cache is not None else PrecompressedCache()
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or scope['method'] == 'HEAD':
+            await self.app(scope, receive, send)
+            return
+        accept_encoding = Headers(scope=scope).get('accept-encoding')
+        name = negotiate(accept_encoding, self.offered) if accept_encoding else None
+        if name is None:
+            await self.app(scope, receive, send)
+            return
+        await self.app(scope, receive, _Responder(self, self.encodings[name], send).send)
+
+
+class _Responder:
+    """ the send of one response, holds the start message until it knows whether the body is compressed"""
+
+    def __init__(self, middleware: CompressionMiddleware, encoding, send):
+        self.middleware = middleware
+        self.encoding = encoding
+        self._send = send
+        self.start = None
+        self.headers: Optional[Headers] = None
+        self.passthrough = False
+        self.buffer = []
+        self.buffered = 0
+        self.encoder: Optional[StreamEncoder] = None
+
+    async def send(self, message):
+        if message['type'] == 'http.response.start':
+            self.start = message
+            self.headers = Headers(raw=message.get('headers', []))
+            if not compressible(message['status'], self.headers):
+                self.passthrough = True
+                await self._send(message)
+            return
+        if self.passthrough:
+            await self._send(message)
+            return
+        if message['type'] in SENDFILE_EXTENSIONS:
+            # the server can't compress the file on the way, it is read here and goes through the body messages
+            await self.send_file(message)
+            return
+        if message['type'] != 'http.response.body':
+            if self.encoder is None and not self.buffer:
+                # a body that is not in body messages (an extension of the server), it goes out as it is
+                self.passthrough = True
+                await self._send(self.start)
+            await self._send(message)
+            return
+        body = message.get('body', b'')
+        more_body = message.get('more_body', False)
+        if self.encoder is not None:
+            data = self.encoder.compress(body) if body else b''
+            if not more_body:
+                data += self.encoder.finish()
+            if data or not more_body:
+                await self._send({'type': 'http.response.body', 'body': data, 'more_body': more_body})
+            return
+        # bodies are held until they reach the minimum size, a stream that ends before goes out as it is
+        self.buffer.append(body)
+        self.buffered += len(body)
+        if not more_body:
+            await self.send_whole(b''.join(self.buffer))
+        elif self.buffered >= self.middleware.minimum_size:
+            await self.start_stream(b''.join(self.buffer))
+
+    def compressed_headers(self) -> MutableHeaders:
+        # a new list, the response may send the same list of headers again
+        headers = MutableHeaders(raw=list(self.start.get('headers', [])))
+        headers['content-encoding'] = self.encoding.name
+        headers.add_vary_header('Accept-Encoding')
+        del headers['accept-ranges']  # ranges would be of the compressed bytes, they are not served
+        etag = headers.get('etag')
+        if etag is not None and not etag.startswith('W/'):
+            headers['etag'] = 'W/' + etag
+        return headers
+
+    async def send_whole(self, body: bytes):
+        if len(body) < self.middleware.minimum_size:
+            await self._send(self.start)
+            await self._send({'type': 'http.response.body', 'body': body})
+            return
+        started = time.perf_counter()
+        cache = self.middleware.cache
+        key = (cache_key(body), self.encoding.name)
+        compressed = cache.get(key)
+        cached = compressed is not None
+        if not cached:
+            compressed = self.encoding.compress(body)
+            cache.put(key, compressed)
+        elapsed = time.perf_counter() - started
+        headers = self.compressed_headers()
+        headers['content-length'] = str(len(compressed))
+        description = f'{self.encoding.name} cached' if cached else self.encoding.name
+        headers.append('server-timing', f'compress;dur={elapsed * 1e3:.3f};desc="{description}"')
+        await self._send({**self.start, 'headers': headers.raw})
+        await self._send({'type': 'http.response.body', 'body': compressed})
+
+    async def send_file(self, message):
+        if message['type'] == 'http.response.pathsend':
+            file = await anyio.to_thread.run_sync(open, message['path'], 'rb')
+            offset, count, more_body = 0, None, False
+        else:
+            file = message['file']
+            offset, count, more_body = message.get('offset'), message.get('count'), message.get('more_body', False)
+        fd = file if isinstance(file, int) else file.fileno()
+        if offset is None:  # from the current position of the file
+            offset = os.lseek(fd, 0, os.SEEK_CUR)
+        try:
+            while count is None or count > 0:
+                size = FILE_CHUNK_SIZE if count is None else min(FILE_CHUNK_SIZE, count)
+                chunk = await anyio.to_thread.run_sync(os.pread, fd, size, offset)  # the position of file is kept
+                if not chunk:
+                    break
+                offset += len(chunk)
+                if count is not None:
+                    count -= len(chunk)
+                await self.send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            if message['type'] == 'http.response.pathsend':
+                await anyio.to_thread.run_sync(file.close)
+        await self.send({'type': 'http.response.body', 'body': b'', 'more_body': more_body})
+
+    async def start_stream(self, body: bytes):
+        headers = self.compressed_headers()
+        del headers['content-length']  # unknown until the end, the server sends the body chunked
+        await self._send({**self.start, 'headers': headers.raw})
+        self.buffer = []
+        self.encoder = self.encoding.stream()
+        await self._send({'type': 'http.response.body', 'body': self.encoder.compress(body), 'more_body': True})
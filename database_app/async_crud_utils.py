@@ -0,0 +1,178 @@
+# async versions of the functions in crud_utils, used when DATABASE_MODE=async
+# an AsyncSession can't lazy load relationships on attribute access (there is no await there)
+# so everything the response models read has to be loaded by the query itself, pass loading.eager_load_options as options
+# unique() is needed when a collection is loaded with a join
+
+from typing import Optional, Sequence, List, Tuple
+
+from sqlalchemy import select, insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import models, schemas
+from .cache import user_key, email_key
+
+
+# Querying (2.0 Style)
+# https://docs.sqlalchemy.org/en/14/orm/extensions/asyncio.html
+async def get_user(db: AsyncSession, user_id: int, options: Sequence = ()):
+    result = await db.execute(
+        select(models.User).options(*options).filter(models.User.id == user_id)
+    )
+    return result.unique().scalars().first()
+
+
+async def get_user_by_email(db: AsyncSession, email: str, options: Sequence = ()):
+    result = await db.execute(
+        select(models.User).options(*options).filter(models.User.email == email)
+    )
+    return result.unique().scalars().first()
+
+
+async def get_user_cached(db: AsyncSession, cache, user_id: int, options: Sequence = ()):
+    cached = cache.get(user_key(user_id))
+    if cached is not None:
+        return schemas.User.parse_obj(cached)
+    db_user = await get_user(db, user_id, options)
+    if db_user is None:
+        return None
+    user = schemas.User.from_orm(db_user)
+    cache.set(user_key(user_id), user.dict())
+    return user
+
+
+async def get_user_by_email_cached(db: AsyncSession, cache, email: str, options: Sequence = ()):
+    user_id = cache.get(email_key(email))
+    if user_id is not None:
+        return await get_user_cached(db, cache, user_id, options)
+    db_user = await get_user_by_email(db, email, options)
+    if db_user is None:
+        return None
+    user = schemas.User.from_orm(db_user)
+    cache.set(email_key(email), user.id)
+    cache.set(user_key(user.id), user.dict())
+    return user
+
+
+async def get_users(
+        db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, options: Sequence = ()
+):
+    query = select(models.User).options(*options).order_by(models.User.id)
+    if after_id is not None:
+        query = query.filter(models.User.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.unique().scalars().all()
+
+
+async def create_user(db: AsyncSession, user: schemas.UserCreate, options: Sequence = (), cache=None):
+    fake_hashed_password = user.password + 'notreallyhashed'
+    db_user = models.User(
+        email=user.email,
+        hashed_password=fake_hashed_password
+    )
+    db.add(db_user)
+    await db.commit()
+    if cache is not None:
+        cache.delete(email_key(db_user.email), user_key(db_user.id))
+    # a plain refresh would expire user.items again, select the user back together with its items
+    return await get_user(db, db_user.id, options)
+
+
+async def get_items(
+        db: AsyncSession, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, options: Sequence = ()
+):
+    query = select(models.Item).options(*options).order_by(models.Item.id)
+    if after_id is not None:
+        query = query.filter(models.Item.id > after_id)
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query.limit(limit))
+    return result.unique().scalars().all()
+
+
+async def create_user_item(db: AsyncSession, item: schemas.ItemCreate, user_id: int, cache=None):
+    db_item = models.Item(**item.dict(), owner_id=user_id)
+    db.add(db_item)
+    await db.commit()
+    await db.refresh(db_item)
+    if cache is not None:
+        cache.delete(user_key(user_id))
+    return db_item
+
+
+# bulk inserts, see crud_utils
+def _returning_supported(db: AsyncSession):
+    return getattr(db.bind.dialect, 'insert_executemany_returning', False)
+
+
+async def _insert_chunk(db: AsyncSession, model, rows: List[dict], returning: bool):
+    if returning:
+        return [row.id for row in await db.execute(insert(model).returning(model.id), rows)]
+    await db.execute(insert(model), rows)
+    return []
+
+
+async def _bulk_insert(
+        db: AsyncSession, model, rows: List[Tuple[int, dict]], chunk_size: int, result: schemas.BulkResult
+):
+    returning = result.ids is not None
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            ids = await _insert_chunk(db, model, [row for _, row in chunk], returning)
+            await db.commit()
+            result.created += len(chunk)
+        except IntegrityError:
+            await db.rollback()
+            ids = []
+            for index, row in chunk:
+                try:
+                    ids += await _insert_chunk(db, model, [row], returning)
+                    await db.commit()
+                    result.created += 1
+                except IntegrityError as e:
+                    await db.rollback()
+                    result.errors.append(schemas.BulkRowError(index=index, detail=str(e.orig)))
+        if returning:
+            result.ids.extend(ids)
+    result.errors.sort(key=lambda error: error.index)
+    return result
+
+
+async def create_users_bulk(
+        db: AsyncSession, users: List[schemas.UserCreate], chunk_size: int = 1000, cache=None
+):
+    result = schemas.BulkResult(created=0, ids=[] if _returning_supported(db) else None)
+    rows = []
+    seen = set()
+    for start in range(0, len(users), chunk_size):
+        emails = [user.email for user in users[start:start + chunk_size]]
+        registered = set((await db.execute(
+            select(models.User.email).filter(models.User.email.in_(emails))
+        )).scalars())
+        for index, user in enumerate(users[start:start + chunk_size], start):
+            if user.email in registered or user.email in seen:
+                result.errors.append(schemas.BulkRowError(index=index, detail='email already registered'))
+                continue
+            seen.add(user.email)
+            rows.append((index, {
+                'email': user.email,
+                'hashed_password': user.password + 'notreallyhashed',
+            }))
+    await _bulk_insert(db, models.User, rows, chunk_size, result)
+    if cache is not None:
+        cache.delete(*[email_key(row['email']) for _, row in rows])
+    return result
+
+
+async def create_user_items_bulk(
+        db: AsyncSession, items: List[schemas.ItemCreate], user_id: int, chunk_size: int = 1000, cache=None
+):
+    result = schemas.BulkResult(created=0, ids=[] if _returning_supported(db) else None)
+    rows = [(index, {**item.dict(), 'owner_id': user_id}) for index, item in enumerate(items)]
+    await _bulk_insert(db, models.Item, rows, chunk_size, result)
+    if cache is not None:
+        cache.delete(user_key(user_id))
+    return result
@@ -0,0 +1,130 @@
+# read-through cache for user lookups
+# get_user / get_user_by_email hit the database on every request, the cache keeps the serialized schemas.User
+# writes that change a cached user (create_user, create_user_item) delete its entries
+#
+# backends
+#   memory - in-process LRU with a TTL (default), each worker process has its own copy
+#   redis  - any client with the redis get/set/delete api (redis.Redis, fakeredis.FakeRedis), shared by all workers
+#   none   - no caching
+# picked with CACHE_BACKEND, CACHE_URL (redis), CACHE_TTL seconds and CACHE_MAXSIZE entries (memory)
+
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Optional
+
+
+class CacheStats:
+    def __init__(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0  # entries dropped to stay under maxsize
+        self.expirations = 0  # entries dropped because their ttl passed
+
+    def as_dict(self):
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'expirations': self.expirations,
+        }
+
+
+class NullCache:
+    def __init__(self):
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Optional[Any]:
+        self.stats.misses += 1
+        return None
+
+    def set(self, key: str, value: Any):
+        pass
+
+    def delete(self, *keys: str):
+        pass
+
+
+class LRUCache:
+    def __init__(self, maxsize: int = 10000, ttl: float = 60):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.stats = CacheStats()
+        self._entries = OrderedDict()  # key -> (expires_at, value), least recently used first
+        self._lock = threading.Lock()  # sync path operations use the cache from threadpool threads
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats.misses += 1
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                self.stats.expirations += 1
+                self.stats.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats.hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.stats.evictions += 1
+
+    def delete(self, *keys: str):
+        with self._lock:
+            for key in keys:
+                self._entries.pop(key, None)
+
+
+class RedisCache:
+    # values are stored as json, expiry and eviction are done by redis itself
+    def __init__(self, client, ttl: float = 60, prefix: str = 'database_app:'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+        self.stats = CacheStats()
+
+    def get(self, key: str) -> Optional[Any]:
+        raw = self.client.get(self.prefix + key)
+        if raw is None:
+            self.stats.misses += 1
+            return None
+        self.stats.hits += 1
+        return json.loads(raw)
+
+    def set(self, key: str, value: Any):
+        self.client.set(self.prefix + key, json.dumps(value), ex=max(1, int(self.ttl)))
+
+    def delete(self, *keys: str):
+        if keys:
+            self.client.delete(*[self.prefix + key for key in keys])
+
+
+def cache_from_env():
+    backend = os.getenv('CACHE_BACKEND', 'memory')
+    ttl = float(os.getenv('CACHE_TTL', '60'))
+    if backend == 'memory':
+        return LRUCache(maxsize=int(os.getenv('CACHE_MAXSIZE', '10000')), ttl=ttl)
+    if backend == 'redis':
+        import redis  # only needed for this backend
+        return RedisCache(redis.Redis.from_url(os.getenv('CACHE_URL', 'redis://localhost:6379/0')), ttl=ttl)
+    if backend == 'none':
+        return NullCache()
+    raise ValueError(f'CACHE_BACKEND must be memory, redis or none, got {backend!r}')
+
+
+def user_key(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def email_key(email: str) -> str:
+    return f'user-email:{email}'  # maps to the user id, the user itself is under user_key
@@ -1,25 +1,63 @@
 # contains reusable functions to interact with the data in the database
 # by creating dedicated functions to interact with db you can add unit tests and reuse them
 
+from typing import Optional, Sequence, List, Tuple
+
 from . import models, schemas
+from .cache import user_key, email_key
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 
 
 # Querying (1.x Style)
 # https://docs.sqlalchemy.org/en/14/orm/session_basics.html#querying-1-x-style
 # https://docs.sqlalchemy.org/en/14/orm/tutorial.html
-def get_user(db: Session, user_id: int):
-    return db.query(models.User).filter(models.User.id == user_id).first()
+# options are loader options for the relationships the caller will read, see loading.eager_load_options
+def get_user(db: Session, user_id: int, options: Sequence = ()):
+    return db.query(models.User).options(*options).filter(models.User.id == user_id).first()
+
+
+def get_user_by_email(db: Session, email: str, options: Sequence = ()):
+    return db.query(models.User).options(*options).filter(models.User.email == email).first()
+
 
+# read-through versions of get_user / get_user_by_email, see cache.py
+# they return a schemas.User (what the cache holds) instead of an orm object
+def get_user_cached(db: Session, cache, user_id: int, options: Sequence = ()):
+    cached = cache.get(user_key(user_id))
+    if cached is not None:
+        return schemas.User.parse_obj(cached)
+    db_user = get_user(db, user_id, options)
+    if db_user is None:
+        return None  # misses are not cached, a user created later must be found right away
+    user = schemas.User.from_orm(db_user)
+    cache.set(user_key(user_id), user.dict())
+    return user
 
-def get_user_by_email(db: Session, email: str):
-    return db.query(models.User).filter(models.User.email == email).first()
 
+def get_user_by_email_cached(db: Session, cache, email: str, options: Sequence = ()):
+    user_id = cache.get(email_key(email))
+    if user_id is not None:
+        return get_user_cached(db, cache, user_id, options)
+    db_user = get_user_by_email(db, email, options)
+    if db_user is None:
+        return None
+    user = schemas.User.from_orm(db_user)
+    cache.set(email_key(email), user.id)
+    cache.set(user_key(user.id), user.dict())
+    return user
 
-def get_users(db: Session, skip: int = 0, limit: int = 100):
-    return db.query(models.User).offset(skip).limit(limit).all()
 
-def create_user(db: Session, user: schemas.UserCreate):
+# after_id switches from offset to keyset pagination (see pagination.py)
+def get_users(db: Session, skip: int = 0, limit: int = 100, after_id: Optional[int] = None, options: Sequence = ()):
+    query = db.query(models.User).options(*options).order_by(models.User.id)
+    if after_id is not None:
+        return query.filter(models.User.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
+
+# cache is the user cache to invalidate, if any
+def create_user(db: Session, user: schemas.UserCreate, cache=None):
     fake_hashed_password = user.password + 'notreallyhashed'
     db_user = models.User(
         email=user.email,
@@ -28,15 +66,96 @@ def create_user(db: Session, user: schemas.UserCreate):
     db.add(db_user)
     db.commit()
     db.refresh(db_user) # refreshes the python object from db with select, it will populate the id on the object and any relationships
+    if cache is not None:
+        cache.delete(email_key(db_user.email), user_key(db_user.id))
     return db_user
 
 
-def get_items(db: Session, skip: int=0, limit: int=100):
-    return db.query(models.Item).offset(skip).limit(limit).all()
+def get_items(db: Session, skip: int=0, limit: int=100, after_id: Optional[int] = None, options: Sequence = ()):
+    query = db.query(models.Item).options(*options).order_by(models.Item.id)
+    if after_id is not None:
+        return query.filter(models.Item.id > after_id).limit(limit).all()
+    return query.offset(skip).limit(limit).all()
 
-def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int):
+def create_user_item(db: Session, item: schemas.ItemCreate, user_id: int, cache=None):
     db_item=models.Item(**item.dict(), owner_id=user_id)
     db.add(db_item)
     db.commit()
     db.refresh(db_item)
-    return db_item
\ No newline at end of file
+    if cache is not None:
+        cache.delete(user_key(user_id))  # the cached user holds its items
+    return db_item
+
+
+# bulk inserts
+# one INSERT executed with a list of parameter sets (executemany) and one commit per chunk
+# instead of add + commit + refresh (3 round trips and a transaction) per row
+def _returning_supported(db: Session):
+    return getattr(db.get_bind().dialect, 'insert_executemany_returning', False)
+
+
+def _insert_chunk(db: Session, model, rows: List[dict], returning: bool):
+    if returning:
+        return [row.id for row in db.execute(insert(model).returning(model.id), rows)]
+    db.execute(insert(model), rows)
+    return []
+
+
+def _bulk_insert(db: Session, model, rows: List[Tuple[int, dict]], chunk_size: int, result: schemas.BulkResult):
+    returning = result.ids is not None
+    for start in range(0, len(rows), chunk_size):
+        chunk = rows[start:start + chunk_size]
+        try:
+            ids = _insert_chunk(db, model, [row for _, row in chunk], returning)
+            db.commit()
+            result.created += len(chunk)
+        except IntegrityError:
+            # a row in the chunk violates a constraint, retry the chunk row by row to report which one
+            db.rollback()
+            ids = []
+            for index, row in chunk:
+                try:
+                    ids += _insert_chunk(db, model, [row], returning)
+                    db.commit()
+                    result.created += 1
+                except IntegrityError as e:
+                    db.rollback()
+                    result.errors.append(schemas.BulkRowError(index=index, detail=str(e.orig)))
+        if returning:
+            result.ids.extend(ids)
+    result.errors.sort(key=lambda error: error.index)
+    return result
+
+
+def create_users_bulk(db: Session, users: List[schemas.UserCreate], chunk_size: int = 1000, cache=None):
+    result = schemas.BulkResult(created=0, ids=[] if _returning_supported(db) else None)
+    rows = []
+    seen = set()
+    for start in range(0, len(users), chunk_size):
+        # one SELECT per chunk finds the emails that are already registered
+        emails = [user.email for user in users[start:start + chunk_size]]
+        registered = {email for (email,) in db.query(models.User.email).filter(models.User.email.in_(emails))}
+        for index, user in enumerate(users[start:start + chunk_size], start):
+            if user.email in registered or user.email in seen:
+                result.errors.append(schemas.BulkRowError(index=index, detail='email already registered'))
+                continue
+            seen.add(user.email)
+            rows.append((index, {
+                'email': user.email,
+                'hashed_password': user.password + 'notreallyhashed',
+            }))
+    _bulk_insert(db, models.User, rows, chunk_size, result)
+    if cache is not None:
+        cache.delete(*[email_key(row['email']) for _, row in rows])
+    return result
+
+
+def create_user_items_bulk(
+        db: Session, items: List[schemas.ItemCreate], user_id: int, chunk_size: int = 1000, cache=None
+):
+    result = schemas.BulkResult(created=0, ids=[] if _returning_supported(db) else None)
+    rows = [(index, {**item.dict(), 'owner_id': user_id}) for index, item in enumerate(items)]
+    _bulk_insert(db, models.Item, rows, chunk_size, result)
+    if cache is not None:
+        cache.delete(user_key(user_id))
+    return result
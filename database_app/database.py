@@ -1,13 +1,99 @@
-from sqlalchemy import create_engine
+import os
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool, AsyncAdaptedQueuePool
 
-DATABASE_URL = 'sqlite:///./db_app.db'
+# the mode is picked once at startup
+# DATABASE_MODE=sync  - def path operations on the threadpool with a blocking Session (default)
+# DATABASE_MODE=async - async def path operations with an AsyncSession, no worker thread per request
+DATABASE_MODE = os.getenv('DATABASE_MODE', 'sync')
+DATABASE_URL = os.getenv('DATABASE_URL', 'sqlite:///./db_app.db')
+# the async engine needs an async driver in the url, e.g. sqlite+aiosqlite:// or postgresql+asyncpg://
+ASYNC_DATABASE_URL = os.getenv('ASYNC_DATABASE_URL', 'sqlite+aiosqlite:///./db_app.db')
 
-engine = create_engine(
-    DATABASE_URL,
-    connect_args={'check_same_thread': False},  # only for sqlite
-)
+if DATABASE_MODE not in ('sync', 'async'):
+    raise ValueError(f'DATABASE_MODE must be sync or async, got {DATABASE_MODE!r}')
+
+# engine profile
+# connection pool, used for server databases and for file based sqlite
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '5'))  # connections kept open
+DB_MAX_OVERFLOW = int(os.getenv('DB_MAX_OVERFLOW', '10'))  # extra connections opened under load and closed after
+DB_POOL_TIMEOUT = float(os.getenv('DB_POOL_TIMEOUT', '30'))  # seconds to wait for a free connection
+DB_POOL_RECYCLE = int(os.getenv('DB_POOL_RECYCLE', '1800'))  # reopen connections older than this, servers drop idle ones
+DB_POOL_PRE_PING = os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true'  # test a connection before handing it out
+
+# pragmas run on every new sqlite connection
+# https://www.sqlite.org/pragma.html
+# WAL lets readers run while a writer writes (the default rollback journal locks the whole file for a write)
+# synchronous=NORMAL is safe with WAL, a commit only waits for the wal write instead of an fsync of the database
+# mmap_size reads pages through memory mapping instead of read() calls
+# cache_size is the page cache per connection, negative values are KiB
+# busy_timeout makes a writer wait for the lock instead of failing right away with 'database is locked'
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'WAL'),
+    'synchronous': os.getenv('SQLITE_SYNCHRONOUS', 'NORMAL'),
+    'mmap_size': int(os.getenv('SQLITE_MMAP_SIZE', str(256 * 1024 * 1024))),
+    'cache_size': int(os.getenv('SQLITE_CACHE_SIZE', '-64000')),
+    'busy_timeout': int(os.getenv('SQLITE_BUSY_TIMEOUT', '5000')),
+}
+
+
+def _connect_args(url: str):
+    if url.startswith('sqlite'):
+        return {'check_same_thread': False}  # only for sqlite
+    return {}
+
+
+def engine_options(url: str, is_async: bool = False):
+    options = {'connect_args': _connect_args(url)}
+    url = make_url(url)
+    if url.get_backend_name() == 'sqlite':
+        if url.database in (None, '', ':memory:'):
+            return options  # an in memory database lives in a single connection, keep sqlalchemy's default pool
+        # sqlalchemy opens a new connection per checkout for file sqlite by default
+        # pooling them keeps the page cache, the memory map and the applied pragmas between requests
+        options['poolclass'] = AsyncAdaptedQueuePool if is_async else QueuePool
+    else:
+        options['pool_pre_ping'] = DB_POOL_PRE_PING
+        options['pool_recycle'] = DB_POOL_RECYCLE
+    options['pool_size'] = DB_POOL_SIZE
+    options['max_overflow'] = DB_MAX_OVERFLOW
+    options['pool_timeout'] = DB_POOL_TIMEOUT
+    return options
+
+
+def apply_sqlite_pragmas(engine, pragmas=None):
+    pragmas = SQLITE_PRAGMAS if pragmas is None else pragmas
+    # the event is on the sync engine, for an AsyncEngine that is the engine it wraps
+    engine = getattr(engine, 'sync_engine', engine)
+    if engine.dialect.name != 'sqlite' or not pragmas:
+        return
+
+    @event.listens_for(engine, 'connect')
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+        cursor.close()
+
+
+def make_engine(url: str, pragmas=None):
+    engine = create_engine(url, **engine_options(url))
+    apply_sqlite_pragmas(engine, pragmas)
+    return engine
+
+
+def make_async_engine(url: str, pragmas=None):
+    engine = create_async_engine(url, **engine_options(url, is_async=True))
+    apply_sqlite_pragmas(engine, pragmas)
+    return engine
+
+
+engine = make_engine(DATABASE_URL)
 # for creating db session instances (the Session class will be needed too later)
 SessionLocal = sessionmaker(
     autocommit=False,
@@ -15,5 +101,18 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# the async engine is only created in async mode so the sync mode does not need an async driver installed
+async_engine = None
+AsyncSessionLocal = None
+if DATABASE_MODE == 'async':
+    async_engine = make_async_engine(ASYNC_DATABASE_URL)
+    AsyncSessionLocal = sessionmaker(
+        autocommit=False,
+        autoflush=False,
+        expire_on_commit=False,  # attributes can't be lazy loaded after commit in async, keep them loaded
+        bind=async_engine,
+        class_=AsyncSession,
+    )
+
 # base class for all orm table models
 Base = declarative_base()
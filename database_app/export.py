@@ -0,0 +1,69 @@
+# streaming export of all items
+# read_items loads a page of orm objects with .all(), builds pydantic models from them and serializes one big body
+# so memory grows with the page size
+# the export reads plain column rows from the cursor a batch at a time and yields each batch as soon as it is encoded,
+# nothing but the current batch is held in memory whether 1k or 10M rows are exported
+#
+# the generators open their own session: the response body is sent after the path operation function returned
+# and a session from a Depends(get_db) can already be closed by then
+
+import json
+from enum import Enum
+
+from sqlalchemy import select
+
+from . import models, schemas
+from .database import SessionLocal, AsyncSessionLocal
+
+
+class ExportFormat(str, Enum):
+    ndjson = 'ndjson'  # one json object per line
+    json = 'json'  # a single json array, sent in chunks
+
+
+EXPORT_MEDIA_TYPES = {
+    ExportFormat.ndjson: 'application/x-ndjson',
+    ExportFormat.json: 'application/json',
+}
+
+# the columns schemas.Item reads, selected as plain rows so no orm objects are created
+ITEM_EXPORT_FIELDS = list(schemas.Item.__fields__)
+_items_query = select(*[getattr(models.Item, name) for name in ITEM_EXPORT_FIELDS]).order_by(models.Item.id)
+
+
+def _encode_batch(rows, export_format: ExportFormat, first: bool) -> bytes:
+    objects = [json.dumps(dict(zip(ITEM_EXPORT_FIELDS, row)), separators=(',', ':')) for row in rows]
+    if export_format == ExportFormat.ndjson:
+        return ''.join(f'{obj}\n' for obj in objects).encode()
+    return (('' if first else ',') + ','.join(objects)).encode()
+
+
+def iter_items(export_format: ExportFormat, batch_size: int = 1000):
+    db = SessionLocal()
+    try:
+        if export_format == ExportFormat.json:
+            yield b'['
+        # yield_per makes the orm fetch batch_size rows at a time from a server side cursor (where the driver has one)
+        # instead of buffering the whole result before returning the first row
+        result = db.execute(_items_query.execution_options(yield_per=batch_size))
+        first = True
+        for rows in result.partitions(batch_size):
+            yield _encode_batch(rows, export_format, first)
+            first = False
+        if export_format == ExportFormat.json:
+            yield b']'
+    finally:
+        db.close()
+
+
+async def iter_items_async(export_format: ExportFormat, batch_size: int = 1000):
+    async with AsyncSessionLocal() as db:
+        if export_format == ExportFormat.json:
+            yield b'['
+        result = await db.stream(_items_query)  # stream() always uses a server side cursor
+        first = True
+        async for rows in result.partitions(batch_size):
+            yield _encode_batch(rows, export_format, first)
+            first = False
+        if export_format == ExportFormat.json:
+            yield b']'
@@ -0,0 +1,66 @@
+# eager loading of the relationships a response model reads
+# with orm_mode pydantic reads user.items attribute by attribute, and a lazy relationship runs one SELECT per user
+# so listing 100 users runs 1 + 100 queries (the N+1 problem)
+# loading the relationship together with the parent query turns that into 1 or 2 queries:
+#   selectin - a second query SELECT ... WHERE items.owner_id IN (...) for all parents at once, good for collections
+#   joined   - a LEFT OUTER JOIN in the parent query, good for many-to-one and small collections
+#
+# the strategy is picked per response model with an eager_loading attribute in its Config, e.g.
+#     class Config:
+#         orm_mode = True
+#         eager_loading = 'joined'
+# the default is selectin
+
+from functools import lru_cache
+from typing import Optional, Tuple, Type
+
+from pydantic import BaseModel
+from sqlalchemy import inspect
+from sqlalchemy.orm import selectinload, joinedload
+from sqlalchemy.orm.strategy_options import Load
+
+EAGER_LOADING_STRATEGIES = {
+    'selectin': selectinload,
+    'joined': joinedload,
+}
+DEFAULT_EAGER_LOADING = 'selectin'
+
+
+def _strategy_for(response_model: Type[BaseModel], strategy: Optional[str]):
+    name = strategy or getattr(response_model.__config__, 'eager_loading', DEFAULT_EAGER_LOADING)
+    try:
+        return EAGER_LOADING_STRATEGIES[name]
+    except KeyError:
+        raise ValueError(f'unknown eager loading strategy {name!r}, use one of {list(EAGER_LOADING_STRATEGIES)}')
+
+
+def _loader_paths(response_model: Type[BaseModel], orm_model, strategy: Optional[str], seen):
+    relationships = inspect(orm_model).relationships
+    for field in response_model.__fields__.values():
+        relationship = relationships.get(field.name)
+        nested_model = field.type_  # Item for List[Item]
+        if relationship is None or not (isinstance(nested_model, type) and issubclass(nested_model, BaseModel)):
+            continue
+        if (nested_model, relationship.mapper.class_) in seen:  # models that reference each other
+            continue
+        loader = _strategy_for(response_model, strategy)
+        nested = list(_loader_paths(
+            nested_model, relationship.mapper.class_, strategy, seen | {(response_model, orm_model)}
+        ))
+        yield [(loader, getattr(orm_model, field.name))]
+        for path in nested:
+            yield [(loader, getattr(orm_model, field.name))] + path
+
+
+@lru_cache(maxsize=None)
+def eager_load_options(response_model: Type[BaseModel], orm_model, strategy: Optional[str] = None) -> Tuple[Load, ...]:
+    """ loader options for every relationship reachable from the response model, pass them to query.options()
+    strategy overrides the eager_loading of the response models"""
+    options = []
+    for path in _loader_paths(response_model, orm_model, strategy, frozenset()):
+        loader, attribute = path[0]
+        option = loader(attribute)
+        for loader, attribute in path[1:]:
+            option = getattr(option, loader.__name__)(attribute)  # chained: selectinload(User.items).joinedload(Item.owner)
+        options.append(option)
+    return tuple(options)
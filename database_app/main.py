@@ -1,50 +1,128 @@
 # start app
 # uvicorn database_app.main:app --reload
+# in async mode
+# DATABASE_MODE=async uvicorn database_app.main:app --reload
 
-from typing import List
+import os
+from typing import List, Optional
 
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from starlette import status
 
-from . import models, crud_utils, schemas
-from .database import SessionLocal, engine
-from fastapi import FastAPI, Depends, HTTPException
-
-models.Base.metadata.create_all(bind=engine)
+from . import models, crud_utils, async_crud_utils, schemas
+from .cache import cache_from_env
+from .database import DATABASE_MODE, SessionLocal, AsyncSessionLocal, engine, async_engine
+from .export import ExportFormat, EXPORT_MEDIA_TYPES, iter_items, iter_items_async
+from .loading import eager_load_options
+from .pagination import NEXT_CURSOR_HEADER, decode_cursor, next_cursor
+from .unit_of_work import LazySession, AsyncLazySession, UnitOfWorkMiddleware
+from compression import CompressionMiddleware
+from fastapi import FastAPI, APIRouter, Depends, HTTPException, Response, Query, Request
+from fastapi.responses import StreamingResponse
+from fast_responses import FastJSONRoute
+from profiling import add_profiling_from_env
+from rate_limit import RateLimiter, RateLimitMiddleware, by_ip
 
 app = FastAPI()
+# PROFILE_DIR=profiles PROFILE_SECRET=... writes a sampled profile of the requests sent with X-Profile: <secret>,
+# see profiling.py
+# added first so it is the innermost middleware and runs in the same task as the path operation
+add_profiling_from_env(app)
+
+# relationships read by the response models are loaded with the parent query instead of one lazy SELECT per row
+USER_LOAD_OPTIONS = eager_load_options(schemas.User, models.User)
+ITEM_LOAD_OPTIONS = eager_load_options(schemas.Item, models.Item)
+
+# cache in front of the user lookups, see cache.py
+user_cache = cache_from_env()
+
+# both sets of path operations declare the same paths, only the one picked by DATABASE_MODE is included in the app
+sync_router = APIRouter()
+async_router = APIRouter()
+# hot list endpoints, serialized with orjson without the jsonable_encoder pass, see fast_responses.py
+sync_fast_router = APIRouter(route_class=FastJSONRoute)
+async_fast_router = APIRouter(route_class=FastJSONRoute)
 
 
 # Dependency
-def get_db():
-    db = SessionLocal()
+# each request gets its own unit of work, see unit_of_work.py
+# the session and its connection are only opened when the path operation first uses them
+# they are committed by UnitOfWorkMiddleware before the response is sent, rolled back if the request raises, and
+# closed here if the response was never started
+def get_db(request: Request):
+    db = LazySession(engine, SessionLocal)
+    request.state.unit_of_work = db
     try:
-        yield db  # each request must have a new db session(connection) and close it after the request is finished
-    finally:  # response has been sent, close the connection
-        db.close()
+        yield db
+    except Exception:
+        db.finish(rollback=True)
+        raise
+    db.finish()
+
+
+async def get_async_db(request: Request):
+    db = AsyncLazySession(async_engine, AsyncSessionLocal)
+    request.state.unit_of_work = db
+    try:
+        yield db
+    except Exception:
+        await db.finish(rollback=True)
+        raise
+    await db.finish()
+
+
+# a dependency so tests can swap the cache with app.dependency_overrides
+def get_cache():
+    return user_cache
+
+
+# the opaque cursor from the X-Next-Cursor header of the previous page, decoded to the last seen id
+# when it is given skip is ignored and the page is read with a keyset query
+def page_cursor(cursor: Optional[str] = None) -> Optional[int]:
+    if cursor is None:
+        return None
+    try:
+        return decode_cursor(cursor)
+    except ValueError:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='invalid cursor'
+        )
+
 
 # path operations are declared as synchronous functions
+# they run in the threadpool, so the number of concurrent requests is capped by the number of worker threads
 
-@app.post('/users/', response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = crud_utils.get_user_by_email(db, email=user.email)
+@sync_router.post('/users/', response_model=schemas.User)
+def create_user(user: schemas.UserCreate, db: Session = Depends(get_db), cache=Depends(get_cache)):
+    db_user = crud_utils.get_user_by_email_cached(db, cache, email=user.email, options=USER_LOAD_OPTIONS)
     if db_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail='email already registered'
         )
-    return crud_utils.create_user(db=db, user=user)
+    return crud_utils.create_user(db=db, user=user, cache=cache)
 
 
-@app.get('/users/', response_model=schemas.User)
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = crud_utils.get_users(db, skip, limit)
+@sync_router.get('/users/', response_model=List[schemas.User])
+def read_users(
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = Depends(page_cursor),
+        db: Session = Depends(get_db)
+):
+    users = crud_utils.get_users(db, skip, limit, after_id, USER_LOAD_OPTIONS)
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor  # the body stays a plain list for older clients
     return users
 
 
-@app.get('/uses/{user_id}', response_model=schemas.User)
-def read_user(user_id: int, db: Session = Depends(get_db)):
-    db_user = crud_utils.get_user(db, user_id)
+@sync_router.get('/uses/{user_id}', response_model=schemas.User)
+def read_user(user_id: int, db: Session = Depends(get_db), cache=Depends(get_cache)):
+    db_user = crud_utils.get_user_cached(db, cache, user_id, USER_LOAD_OPTIONS)
     if db_user is None:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
@@ -53,14 +131,198 @@ def read_user(user_id: int, db: Session = Depends(get_db)):
     return db_user
 
 
-@app.post('/users/{user_id}/items/', response_model=schemas.Item)
+@sync_router.post('/users/{user_id}/items/', response_model=schemas.Item)
 def create_item_for_user(
-        user_id: int, item: schemas.ItemCreate, db: Session = Depends(get_db)
+        user_id: int, item: schemas.ItemCreate, db: Session = Depends(get_db), cache=Depends(get_cache)
 ):
-    return crud_utils.create_user_item(db, item, user_id)
+    return crud_utils.create_user_item(db, item, user_id, cache)
+
 
+# bulk creation inserts the rows in chunks, each chunk is one executemany INSERT and one commit
+# rows that can't be inserted are reported in errors, the rest of the rows are still created
+@sync_router.post('/users/bulk', response_model=schemas.BulkResult)
+def create_users_bulk(
+        users: List[schemas.UserCreate],
+        chunk_size: int = Query(1000, gt=0, le=10000),
+        db: Session = Depends(get_db),
+        cache=Depends(get_cache)
+):
+    return crud_utils.create_users_bulk(db, users, chunk_size, cache)
 
-@app.get('/items/', response_model=List[schemas.Item])
-def read_items(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    items = crud_utils.get_items(db, skip, limit)
+
+@sync_router.post('/users/{user_id}/items/bulk', response_model=schemas.BulkResult)
+def create_items_for_user_bulk(
+        user_id: int,
+        items: List[schemas.ItemCreate],
+        chunk_size: int = Query(1000, gt=0, le=10000),
+        db: Session = Depends(get_db),
+        cache=Depends(get_cache)
+):
+    if crud_utils.get_user(db, user_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='user not found'
+        )
+    return crud_utils.create_user_items_bulk(db, items, user_id, chunk_size, cache)
+
+
+@sync_fast_router.get('/items/', response_model=List[schemas.Item])
+def read_items(
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = Depends(page_cursor),
+        db: Session = Depends(get_db)
+):
+    items = crud_utils.get_items(db, skip, limit, after_id, ITEM_LOAD_OPTIONS)
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
     return items # List of orm models will be passed to pydantic response model
+
+
+# exports all items without loading them into memory, the body is sent while rows are read from the database
+@sync_router.get('/items/export', response_class=StreamingResponse)
+def export_items(
+        format: ExportFormat = ExportFormat.ndjson,
+        batch_size: int = Query(1000, gt=0, le=10000)
+):
+    return StreamingResponse(iter_items(format, batch_size), media_type=EXPORT_MEDIA_TYPES[format])
+
+
+# the same path operations declared as async functions
+# they run on the event loop and wait for the database without holding a worker thread
+
+@async_router.post('/users/', response_model=schemas.User)
+async def create_user_async(
+        user: schemas.UserCreate, db: AsyncSession = Depends(get_async_db), cache=Depends(get_cache)
+):
+    db_user = await async_crud_utils.get_user_by_email_cached(db, cache, email=user.email, options=USER_LOAD_OPTIONS)
+    if db_user:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='email already registered'
+        )
+    return await async_crud_utils.create_user(db=db, user=user, options=USER_LOAD_OPTIONS, cache=cache)
+
+
+@async_router.get('/users/', response_model=List[schemas.User])
+async def read_users_async(
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = Depends(page_cursor),
+        db: AsyncSession = Depends(get_async_db)
+):
+    users = await async_crud_utils.get_users(db, skip, limit, after_id, USER_LOAD_OPTIONS)
+    cursor = next_cursor(users, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return users
+
+
+@async_router.get('/uses/{user_id}', response_model=schemas.User)
+async def read_user_async(user_id: int, db: AsyncSession = Depends(get_async_db), cache=Depends(get_cache)):
+    db_user = await async_crud_utils.get_user_cached(db, cache, user_id, USER_LOAD_OPTIONS)
+    if db_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='user not found'
+        )
+    return db_user
+
+
+@async_router.post('/users/{user_id}/items/', response_model=schemas.Item)
+async def create_item_for_user_async(
+        user_id: int, item: schemas.ItemCreate, db: AsyncSession = Depends(get_async_db), cache=Depends(get_cache)
+):
+    return await async_crud_utils.create_user_item(db, item, user_id, cache)
+
+
+@async_router.post('/users/bulk', response_model=schemas.BulkResult)
+async def create_users_bulk_async(
+        users: List[schemas.UserCreate],
+        chunk_size: int = Query(1000, gt=0, le=10000),
+        db: AsyncSession = Depends(get_async_db),
+        cache=Depends(get_cache)
+):
+    return await async_crud_utils.create_users_bulk(db, users, chunk_size, cache)
+
+
+@async_router.post('/users/{user_id}/items/bulk', response_model=schemas.BulkResult)
+async def create_items_for_user_bulk_async(
+        user_id: int,
+        items: List[schemas.ItemCreate],
+        chunk_size: int = Query(1000, gt=0, le=10000),
+        db: AsyncSession = Depends(get_async_db),
+        cache=Depends(get_cache)
+):
+    if await async_crud_utils.get_user(db, user_id) is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='user not found'
+        )
+    return await async_crud_utils.create_user_items_bulk(db, items, user_id, chunk_size, cache)
+
+
+@async_fast_router.get('/items/', response_model=List[schemas.Item])
+async def read_items_async(
+        response: Response,
+        skip: int = 0,
+        limit: int = 100,
+        after_id: Optional[int] = Depends(page_cursor),
+        db: AsyncSession = Depends(get_async_db)
+):
+    items = await async_crud_utils.get_items(db, skip, limit, after_id, ITEM_LOAD_OPTIONS)
+    cursor = next_cursor(items, limit)
+    if cursor:
+        response.headers[NEXT_CURSOR_HEADER] = cursor
+    return items
+
+
+@async_router.get('/items/export', response_class=StreamingResponse)
+async def export_items_async(
+        format: ExportFormat = ExportFormat.ndjson,
+        batch_size: int = Query(1000, gt=0, le=10000)
+):
+    return StreamingResponse(iter_items_async(format, batch_size), media_type=EXPORT_MEDIA_TYPES[format])
+
+
+# the lists of /items/ and /users/ and the exports are sent compressed with gzip, br or zstd, as the client accepts,
+# identical lists are compressed once, see compression.py
+app.add_middleware(CompressionMiddleware)
+
+
+# commits the unit of work of get_db before the response is sent and reports the connection checkout and query time
+# in a Server-Timing header, next to the one of compression.py, see unit_of_work.py
+app.add_middleware(UnitOfWorkMiddleware)
+
+
+# requests to /users/... per client IP, they all go to sqlite, see rate_limit.py
+# added last, it is the outermost middleware, a limited request is answered before anything else runs
+USERS_RATE = float(os.getenv('USERS_RATE', '50'))  # per second
+USERS_BURST = int(os.getenv('USERS_BURST', '100'))
+app.add_middleware(
+    RateLimitMiddleware, limiter=RateLimiter(rate=USERS_RATE, burst=USERS_BURST, name='users'), key=by_ip,
+    paths=['/users/'],
+)
+
+
+# hit/miss/eviction counters of the user cache, for monitoring
+@app.get('/cache/stats')
+async def read_cache_stats(cache=Depends(get_cache)):
+    return cache.stats.as_dict()
+
+
+if DATABASE_MODE == 'async':
+    @app.on_event('startup')
+    async def create_tables():
+        async with async_engine.begin() as conn:
+            await conn.run_sync(models.Base.metadata.create_all)
+
+    app.include_router(async_router)
+    app.include_router(async_fast_router)
+else:
+    models.Base.metadata.create_all(bind=engine)
+    app.include_router(sync_router)
+    app.include_router(sync_fast_router)
@@ -0,0 +1,38 @@
+# keyset (cursor) pagination
+# offset(skip) makes the database read and throw away skip rows, so deep pages get slower and slower
+# a keyset page continues after the last seen id instead: WHERE id > :last_id ORDER BY id LIMIT :limit
+# which is an index range scan on the primary key and costs the same on page 1 and page 10 000
+#
+# the cursor handed to clients is opaque (urlsafe base64 of a small json document)
+# so the key it is built from can change without breaking clients
+
+import base64
+import binascii
+import json
+from typing import Optional
+
+NEXT_CURSOR_HEADER = 'X-Next-Cursor'
+
+
+def encode_cursor(last_id: int) -> str:
+    raw = json.dumps({'id': last_id}, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor: str) -> int:
+    """ returns the last seen id, raises ValueError for a cursor that was not made by encode_cursor"""
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        last_id = json.loads(base64.urlsafe_b64decode(padded.encode()))['id']
+    except (binascii.Error, UnicodeDecodeError, ValueError, TypeError, KeyError) as e:
+        raise ValueError(f'invalid cursor {cursor!r}') from e
+    if not isinstance(last_id, int):
+        raise ValueError(f'invalid cursor {cursor!r}')
+    return last_id
+
+
+def next_cursor(rows, limit: int) -> Optional[str]:
+    # a short page is the last one
+    if limit <= 0 or len(rows) < limit:
+        return None
+    return encode_cursor(rows[-1].id)
@@ -0,0 +1,44 @@
+# counts the SQL statements an engine runs, so tests can pin the query budget of an endpoint
+#
+#     with assert_max_queries(engine, 2):
+#         client.get('/users/')
+#
+# fails with the list of statements when the endpoint goes over the budget, e.g. after an N+1 slips back in
+
+from contextlib import contextmanager
+from typing import List
+
+from sqlalchemy import event
+
+
+class QueryCounter:
+    def __init__(self):
+        self.statements: List[str] = []
+
+    @property
+    def count(self) -> int:
+        return len(self.statements)
+
+    def __call__(self, conn, cursor, statement, parameters, context, executemany):
+        self.statements.append(statement)
+
+
+@contextmanager
+def count_queries(engine):
+    # an AsyncEngine is a proxy, the events are on the sync engine it wraps
+    engine = getattr(engine, 'sync_engine', engine)
+    counter = QueryCounter()
+    event.listen(engine, 'before_cursor_execute', counter)
+    try:
+        yield counter
+    finally:
+        event.remove(engine, 'before_cursor_execute', counter)
+
+
+@contextmanager
+def assert_max_queries(engine, budget: int):
+    with count_queries(engine) as counter:
+        yield counter
+    if counter.count > budget:
+        statements = '\n'.join(f'{n}. {statement}' for n, statement in enumerate(counter.statements, 1))
+        raise AssertionError(f'expected at most {budget} queries, {counter.count} were run:\n{statements}')
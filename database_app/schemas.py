@@ -39,3 +39,16 @@ class User(UserBase):
 
     class Config:
         orm_mode = True
+        eager_loading = 'selectin' # how user.items is loaded for this response model, see loading.py
+
+
+# a row of a bulk request that was not inserted, index is the position of the row in the request body
+class BulkRowError(BaseModel):
+    index: int
+    detail: str
+
+
+class BulkResult(BaseModel):
+    created: int
+    ids: Optional[List[int]] = None # ids of the created rows, only when the database supports RETURNING for executemany
+    errors: List[BulkRowError] = []
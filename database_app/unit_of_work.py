@@ -0,0 +1,173 @@
+# request scoped unit of work
+# the session of a request is only created, and a connection only checked out of the pool, when the path operation
+# first uses it, a request answered from the cache or rejected before querying never touches the pool
+# the whole request runs on that one connection, it is committed when the request succeeds, rolled back when it
+# raises, and returned to the pool
+#
+# the exit code of a dependency with yield runs after the response is sent (fastapi < 0.106), a commit there could
+# fail after the client got a 200, so UnitOfWorkMiddleware commits when the path operation sends its
+# http.response.start, before it reaches the client, and a failing commit is answered with a 500
+# the dependency still finishes the unit of work when the response is never started
+#
+# the time spent waiting for the connection and running queries is kept per request in DbTiming and sent in the
+# Server-Timing header
+
+import inspect
+from time import perf_counter
+
+import anyio
+from sqlalchemy import event
+
+
+class DbTiming:
+    __slots__ = ('checkout', 'query', 'queries')
+
+    def __init__(self):
+        self.checkout = 0.0  # seconds to get a connection from the pool
+        self.query = 0.0  # seconds spent executing statements
+        self.queries = 0
+
+    def server_timing(self) -> str:
+        # https://developer.mozilla.org/en-US/docs/Web/HTTP/Headers/Server-Timing
+        return (
+            f'db-checkout;dur={self.checkout * 1000:.3f}, '
+            f'db-query;dur={self.query * 1000:.3f};desc="{self.queries} queries"'
+        )
+
+
+def _track_queries(connection, timing: DbTiming):
+    # listeners on the connection instance only see the statements of this request
+    starts = []
+
+    @event.listens_for(connection, 'before_cursor_execute')
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        starts.append(perf_counter())
+
+    @event.listens_for(connection, 'after_cursor_execute')
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        timing.query += perf_counter() - starts.pop()
+        timing.queries += 1
+
+
+class LazySession:
+    """ stands in for a Session, the session is created on first attribute access and bound to its own connection"""
+
+    def __init__(self, engine, session_factory):
+        self._engine = engine
+        self._session_factory = session_factory
+        self._session = None
+        self._connection = None
+        self.finished = False
+        self.timing = DbTiming()
+
+    @property
+    def started(self) -> bool:
+        return self._session is not None
+
+    def __getattr__(self, name):
+        if self._session is None:
+            start = perf_counter()
+            self._connection = self._engine.connect()
+            self.timing.checkout = perf_counter() - start
+            _track_queries(self._connection, self.timing)
+            self._session = self._session_factory(bind=self._connection)
+        return getattr(self._session, name)
+
+    def finish(self, rollback: bool = False):
+        if self._session is None or self.finished:
+            return
+        self.finished = True
+        try:
+            if rollback:
+                self._session.rollback()
+            else:
+                self._session.commit()
+        finally:
+            self._session.close()
+            self._connection.close()  # back to the pool
+
+
+class AsyncLazySession:
+    """ the async version, the connection is checked out before the first awaited session method runs
+    methods that don't need the database (add, expunge ...) only create the session"""
+
+    def __init__(self, engine, session_factory):
+        self._engine = engine
+        self._session_factory = session_factory
+        self._session = None
+        self._connection = None
+        self.finished = False
+        self.timing = DbTiming()
+
+    @property
+    def started(self) -> bool:
+        return self._connection is not None
+
+    async def _checkout(self):
+        start = perf_counter()
+        self._connection = await self._engine.connect()
+        self.timing.checkout = perf_counter() - start
+        _track_queries(self._connection.sync_connection, self.timing)
+        # no transaction has begun yet, so the session can still be moved to the connection
+        self._session.bind = self._connection
+        self._session.sync_session.bind = self._connection.sync_connection
+
+    def __getattr__(self, name):
+        if self._session is None:
+            self._session = self._session_factory()
+        attribute = getattr(self._session, name)
+        if self._connection is not None or not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        async def checkout_first(*args, **kwargs):
+            if self._connection is None:
+                await self._checkout()
+            return await attribute(*args, **kwargs)
+
+        return checkout_first
+
+    async def finish(self, rollback: bool = False):
+        if self._session is None or self.finished:
+            return
+        self.finished = True
+        try:
+            if self._connection is not None:
+                if rollback:
+                    await self._session.rollback()
+                else:
+                    await self._session.commit()
+        finally:
+            await self._session.close()
+            if self._connection is not None:
+                await self._connection.close()
+
+
+class UnitOfWorkMiddleware:
+    """ commits the unit of work the dependency put in request.state.unit_of_work when the response starts, and adds
+    its DbTiming to the http.response.start message as a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        # created here so the scopes copied by inner middlewares share it with the request of the path operation
+        state = scope.setdefault('state', {})
+
+        async def send_after_commit(message):
+            unit_of_work = state.get('unit_of_work')
+            if message['type'] == 'http.response.start' and unit_of_work is not None:
+                # raising here the response is not started, ServerErrorMiddleware answers with a 500
+                if inspect.iscoroutinefunction(unit_of_work.finish):
+                    await unit_of_work.finish()
+                elif unit_of_work.started:
+                    await anyio.to_thread.run_sync(unit_of_work.finish)  # blocking, out of the event loop
+                # the headers must not be mutated in place, the response may send the same list again
+                headers = list(message.get('headers', ()))
+                headers.append((b'server-timing', unit_of_work.timing.server_timing().encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        await self.app(scope, receive, send_after_commit)
@@ -2,12 +2,25 @@ from typing import Optional
 
 from fastapi import FastAPI, Depends
 
+from dependency_plan import PlannedRoute, app_scoped, inline
+from item_store import ItemStore
+
 dependencies_as_classes_app = FastAPI()
+# the dependencies of every route are compiled into a flat plan, see dependency_plan.py
+dependencies_as_classes_app.router.route_class = PlannedRoute
 
 fake_items_db = [{"item_name": "Foo"}, {"item_name": "Bar"}, {"item_name": "Baz"}]
 
 
+# built once, on the first request, and shared by all the requests after it
+@app_scoped
+def get_item_store() -> ItemStore:
+    return ItemStore(fake_items_db)  # indexed, see item_store.py
+
+
 # instead of a function that returns a dict we declare a class
+# a class is a sync dependency, inline calls it directly instead of in the threadpool
+@inline
 class CommonQueryParams:
     def __init__(self, q: Optional[str] = None, skip: int = 0, limit: int = 100):
         self.q = q
@@ -19,10 +32,12 @@ class CommonQueryParams:
 async def read_items(
         commons: CommonQueryParams = Depends(CommonQueryParams),
         # commons: CommonQueryParams = Depends() # shortcut same as above
+        item_store: ItemStore = Depends(get_item_store),
 ):
     response = {}
     if commons.q:
         response.update({'q': commons.q})
-    items = fake_items_db[commons.skip: commons.skip + commons.limit]  # make a slice
+    # q filters the items by name, the indexes find them without scanning every item
+    items = item_store.query(q=commons.q, skip=commons.skip, limit=commons.limit)
     response.update({'items': items})
     return response
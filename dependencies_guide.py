@@ -2,7 +2,11 @@ from typing import Optional
 
 from fastapi import FastAPI, Depends
 
+from dependency_plan import PlannedRoute
+
 dependencies_guide_app = FastAPI()
+# the dependencies of every route are compiled into a flat plan, see dependency_plan.py
+dependencies_guide_app.router.route_class = PlannedRoute
 
 
 # dependency is a function that can take all the same parameters that a path operation function can take
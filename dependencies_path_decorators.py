@@ -1,15 +1,29 @@
 from fastapi import FastAPI, Header, HTTPException, Depends
 
+from api_keys import API_KEYS_FILE, ApiKeyStore
+from dependency_plan import PlannedRoute, app_scoped
+
+
+# hashed keys checked in constant time, loaded from API_KEYS_FILE when it is set, see api_keys.py
+# built once for the app, the first request loads it
+@app_scoped
+def get_api_keys() -> ApiKeyStore:
+    return ApiKeyStore(
+        seed={'token': ['fake-super-secret-token'], 'key': ['fake-super-secret-key']} if API_KEYS_FILE is None else None,
+        path=API_KEYS_FILE,
+    )
+
+
 # when you don't need the return value of the dependency inside the path operation function but you still need it executed
 # you can add a list of dependencies to the path operation decorator
 
-async def verify_token(x_token: str = Header(...)):
-    if x_token != 'fake-super-secret-token':
+async def verify_token(x_token: str = Header(...), api_keys: ApiKeyStore = Depends(get_api_keys)):
+    if api_keys.verify(x_token, 'token') is None:
         raise HTTPException(status_code=400, detail='X-Token header invalid')
 
 
-async def verify_key(x_key: str = Header(...)):
-    if x_key != 'fake-super-secret-key':
+async def verify_key(x_key: str = Header(...), api_keys: ApiKeyStore = Depends(get_api_keys)):
+    if api_keys.verify(x_key, 'key') is None:
         raise HTTPException(status_code=400, detail='X-Key header invalid')
     return x_key
 
@@ -17,6 +31,8 @@ async def verify_key(x_key: str = Header(...)):
 dependencies_path_decorators = FastAPI(
     # dependencies=[Depends(verify_token), Depends(verify_key)] # declare global dependency if needed
 )
+# the dependencies of every route are compiled into a flat plan, see dependency_plan.py
+dependencies_path_decorators.router.route_class = PlannedRoute
 
 
 @dependencies_path_decorators.get(
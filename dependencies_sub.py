@@ -2,14 +2,21 @@ from typing import Optional
 
 from fastapi import FastAPI, Depends, Cookie
 
+from dependency_plan import PlannedRoute, inline
+
 dependencies_sub_app = FastAPI()
+# the dependencies of every route are compiled into a flat plan, see dependency_plan.py
+dependencies_sub_app.router.route_class = PlannedRoute
 
 
 # first dependency
+# sync dependencies run in the threadpool, inline ones that don't block are called directly
+@inline
 def query_extractor(q: Optional[str] = None):
     return q
 
 
+@inline
 def query_or_cookie_extractor(
         q: str = Depends(query_extractor), # may use_cache=False to call it only once per request
         last_query: Optional[str] = Cookie(None)
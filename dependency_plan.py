@@ -0,0 +1,323 @@
+# precompiled dependency plans
+# for every request FastAPI walks the dependency tree of the route recursively: it resolves the parameters of every
+# dependency, even of those already in the request's cache, and calls every sync dependency (classes like
+# dependences_as_classes.CommonQueryParams included) in the threadpool, one thread hop each
+#
+# PlannedRoute compiles the tree once, when the route is created, into
+#   - a single flat list of the request parameters of the whole tree, resolved and validated in one pass
+#   - the dependencies in the order they must run, each once per request (as FastAPI's cache does, use_cache=False
+#     ones as often as they are declared), with where each of their arguments comes from
+# and runs it as a straight loop, sync dependencies marked with inline() are called on the event loop
+#
+# app_scoped(call) computes a dependency once for the lifetime of the app instead of once per request, the planned
+# routes don't even look at its parameters once it is computed; it can only depend on other app scoped dependencies
+#
+# the response gets a Server-Timing header with the time spent
+#   params        reading the body and validating the request parameters
+#   dependencies  running the dependencies
+#   handler       running the path operation
+#
+# routes whose tree can't be planned (body parameters in more than one dependency) and requests made while
+# app.dependency_overrides is set go through FastAPI's own resolution
+#
+# the plans run on internals of FastAPI < 0.106: solve_generator and the AsyncExitStack of scope['fastapi_astack']
+# the generator dependencies are torn down with (0.106 tears them down before the response is sent and removed it),
+# with other versions every route goes through FastAPI's own resolution
+#
+# opt in per app or router:
+#   app.router.route_class = PlannedRoute
+
+import asyncio
+import copy
+import functools
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import fastapi
+from fastapi.dependencies.models import Dependant
+from fastapi.dependencies.utils import is_async_gen_callable, is_coroutine_callable, is_gen_callable
+from fastapi.routing import APIRoute
+from fastapi.security import SecurityScopes
+from starlette.concurrency import run_in_threadpool
+from starlette.requests import Request
+from starlette.responses import Response
+
+try:
+    from fastapi.dependencies.utils import solve_generator
+except ImportError:  # removed in later versions
+    solve_generator = None
+
+
+def _version(version: str) -> Tuple[int, ...]:
+    return tuple(int(part) for part in version.split('.')[:2] if part.isdigit())
+
+
+PLANS_SUPPORTED = solve_generator is not None and _version(fastapi.__version__) < (0, 106)
+
+_inline_calls = set()
+
+# the names the planned call receives the request and its objects under
+REQUEST = '_plan_request'
+RESPONSE = '_plan_response'
+BACKGROUND_TASKS = '_plan_background_tasks'
+STARTED = 'dependency_plan.started'  # scope key, when the route started handling the request
+
+
+def inline(call: Callable) -> Callable:
+    """ marks a sync dependency as cheap enough to be called on the event loop instead of in the threadpool,
+    it must not block"""
+    _inline_calls.add(call)
+    return call
+
+
+class _AppScope:
+    def __init__(self, call: Callable):
+        self.call = call
+        self.computed = False
+        self.value = None
+        self._thread_lock = threading.Lock()
+        self._lock: Optional[asyncio.Lock] = None
+
+    def clear(self):
+        self.computed = False
+        self.value = None
+
+    def get_sync(self, values: dict) -> Any:
+        with self._thread_lock:
+            if not self.computed:
+                self.value = self.call(**values)
+                self.computed = True
+        return self.value
+
+    async def get(self, values: dict) -> Any:
+        if self.computed:
+            return self.value
+        if not is_coroutine_callable(self.call):
+            return await run_in_threadpool(self.get_sync, values)
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            if not self.computed:
+                self.value = await self.call(**values)
+                self.computed = True
+        return self.value
+
+
+def app_scoped(call: Callable) -> Callable:
+    """ the dependency call computed once and reused by every request, cache_clear() computes it again"""
+    if is_gen_callable(call) or is_async_gen_callable(call):
+        raise ValueError(f'{call.__name__} is a generator, app scoped dependencies have no teardown')
+    scope = _AppScope(call)
+    if is_coroutine_callable(call):
+        @functools.wraps(call)
+        async def dependency(**values):
+            return await scope.get(values)
+    else:
+        @functools.wraps(call)
+        def dependency(**values):
+            return scope.get_sync(values)
+    dependency.app_scope = scope
+    dependency.cache_clear = scope.clear
+    return dependency
+
+
+async def _solve_app_scoped(dependant: Dependant) -> Any:
+    scope = dependant.call.app_scope
+    if scope.computed:
+        return scope.value
+    values = {sub.name: await _solve_app_scoped(sub) for sub in dependant.dependencies}
+    return await scope.get(values)
+
+
+def _check_app_scoped(dependant: Dependant):
+    name = getattr(dependant.call, '__name__', dependant.call)
+    if (
+            dependant.path_params or dependant.query_params or dependant.header_params or dependant.cookie_params
+            or dependant.body_params or dependant.request_param_name or dependant.websocket_param_name
+            or dependant.http_connection_param_name or dependant.response_param_name
+            or dependant.background_tasks_param_name or dependant.security_scopes_param_name
+    ):
+        raise ValueError(f'{name} is app scoped, it can\'t depend on the request')
+    for sub in dependant.dependencies:
+        if not hasattr(sub.call, 'app_scope'):
+            raise ValueError(f'{name} is app scoped, it can only depend on other app scoped dependencies')
+        _check_app_scoped(sub)
+
+
+class _NotPlannable(Exception):
+    pass
+
+
+class Step:
+    """ one call of the plan"""
+    __slots__ = ('dependant', 'call', 'kind', 'params', 'arguments', 'special')
+
+    def __init__(self, dependant: Dependant, kind: str):
+        self.dependant = dependant
+        self.call = dependant.call
+        self.kind = kind  # app, async, sync, inline, generator, inline_generator
+        self.params: List[Tuple[str, str]] = []  # (argument, name in the flat values)
+        self.arguments: List[Tuple[str, int]] = []  # (argument, index of the step computing it)
+        self.special: List[Tuple[str, str]] = []  # (argument, request, response, background_tasks or scopes)
+
+
+def _kind(dependant: Dependant) -> str:
+    call = dependant.call
+    if hasattr(call, 'app_scope'):
+        return 'app'
+    if is_gen_callable(call):
+        return 'inline_generator' if call in _inline_calls else 'generator'
+    if is_async_gen_callable(call):
+        return 'generator'
+    if is_coroutine_callable(call):
+        return 'async'
+    return 'inline' if call in _inline_calls else 'sync'
+
+
+class DependencyPlan:
+    """ the dependencies of a route in the order they run, and the flat dependant resolving all their parameters"""
+
+    def __init__(self, dependant: Dependant):
+        self.steps: List[Step] = []
+        self._cached: Dict[Any, int] = {}  # cache_key: index of the step
+        self.flat = Dependant(call=self.run, path=dependant.path, request_param_name=REQUEST,
+                              response_param_name=RESPONSE)
+        self._body_owner = None
+        self._add(dependant)
+        self.handler = self.steps.pop()  # the path operation, the root of the tree
+
+    def _add(self, dependant: Dependant) -> int:
+        if dependant.use_cache and dependant.cache_key in self._cached:
+            return self._cached[dependant.cache_key]
+        kind = _kind(dependant)
+        if kind == 'app':
+            _check_app_scoped(dependant)
+            step = Step(dependant, kind)
+        else:
+            step = Step(dependant, kind)
+            for sub in dependant.dependencies:
+                index = self._add(sub)
+                if sub.name is not None:
+                    step.arguments.append((sub.name, index))
+            self._add_params(step, dependant)
+        self.steps.append(step)
+        index = len(self.steps) - 1
+        if dependant.use_cache:
+            self._cached[dependant.cache_key] = index
+        return index
+
+    def _add_params(self, step: Step, dependant: Dependant):
+        if dependant.body_params:
+            if self._body_owner is not None:
+                raise _NotPlannable('body parameters in more than one dependency')
+            self._body_owner = dependant
+        flat = self.flat
+        prefix = f'{len(self.steps)}.'
+        for params, flat_params in (
+                (dependant.path_params, flat.path_params),
+                (dependant.query_params, flat.query_params),
+                (dependant.header_params, flat.header_params),
+                (dependant.cookie_params, flat.cookie_params),
+                (dependant.body_params, flat.body_params),
+        ):
+            for field in params:
+                # the values are returned under field.name and looked up by field.alias, errors report the alias
+                flat_field = copy.copy(field)
+                flat_field.name = prefix + field.name
+                flat_params.append(flat_field)
+                step.params.append((field.name, flat_field.name))
+        for name, special in (
+                (dependant.request_param_name, 'request'),
+                (dependant.http_connection_param_name, 'request'),
+                (dependant.response_param_name, 'response'),
+                (dependant.background_tasks_param_name, 'background_tasks'),
+                (dependant.security_scopes_param_name, 'scopes'),
+        ):
+            if name is not None:
+                step.special.append((name, special))
+                if special == 'background_tasks':
+                    flat.background_tasks_param_name = BACKGROUND_TASKS
+
+    @staticmethod
+    def _values(step: Step, flat_values: dict, results: list) -> dict:
+        values = {argument: flat_values[name] for argument, name in step.params}
+        for argument, index in step.arguments:
+            values[argument] = results[index]
+        for argument, special in step.special:
+            if special == 'request':
+                values[argument] = flat_values[REQUEST]
+            elif special == 'response':
+                values[argument] = flat_values[RESPONSE]
+            elif special == 'background_tasks':
+                values[argument] = flat_values[BACKGROUND_TASKS]
+            else:
+                values[argument] = SecurityScopes(scopes=step.dependant.security_scopes)
+        return values
+
+    async def _call(self, step: Step, values: dict, request: Request) -> Any:
+        kind = step.kind
+        if kind == 'app':
+            return await _solve_app_scoped(step.dependant)
+        if kind == 'async':
+            return await step.call(**values)
+        if kind == 'inline':
+            return step.call(**values)
+        if kind == 'sync':
+            return await run_in_threadpool(step.call, **values)
+        stack = request.scope['fastapi_astack']
+        if kind == 'inline_generator':
+            return stack.enter_context(contextmanager(step.call)(**values))
+        return await solve_generator(call=step.call, stack=stack, sub_values=values)
+
+    async def run(self, **flat_values) -> Any:
+        request = flat_values[REQUEST]
+        started = time.perf_counter()
+        results = []
+        for step in self.steps:
+            results.append(await self._call(step, self._values(step, flat_values, results), request))
+        resolved = time.perf_counter()
+        content = await self._call(self.handler, self._values(self.handler, flat_values, results), request)
+        done = time.perf_counter()
+        params = started - request.scope.get(STARTED, started)
+        flat_values[RESPONSE].headers.append(
+            'Server-Timing',
+            f'params;dur={params * 1e3:.3f}, dependencies;dur={(resolved - started) * 1e3:.3f}, '
+            f'handler;dur={(done - resolved) * 1e3:.3f}',
+        )
+        return content
+
+
+class PlannedRoute(APIRoute):
+    """ resolves the dependencies of the route with a precompiled DependencyPlan, see the top of the file"""
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        self.plan: Optional[DependencyPlan] = None
+        super().__init__(path, endpoint, **kwargs)
+
+    def get_route_handler(self) -> Callable:
+        fallback = super().get_route_handler()
+        if not PLANS_SUPPORTED:
+            return fallback
+        try:
+            self.plan = DependencyPlan(self.dependant)
+        except _NotPlannable:
+            self.plan = None
+            return fallback
+        # the handler of the flat dependant, the original stays for the openapi schema
+        original = self.dependant
+        self.dependant = self.plan.flat
+        try:
+            planned = super().get_route_handler()
+        finally:
+            self.dependant = original
+        overrides_provider = self.dependency_overrides_provider
+
+        async def handler(request: Request) -> Response:
+            if overrides_provider is not None and getattr(overrides_provider, 'dependency_overrides', None):
+                return await fallback(request)
+            request.scope[STARTED] = time.perf_counter()
+            return await planned(request)
+
+        return handler
@@ -0,0 +1,159 @@
+# faster JSON responses for hot path operations
+# FastAPI serializes a return value in three passes: the response_model validates it, jsonable_encoder walks the
+# validated models and copies them into dicts and lists of json types, and JSONResponse encodes that with json
+#
+# FastJSONResponse encodes with orjson or msgspec when one is installed (JSON_BACKEND=auto, orjson, msgspec or
+# json), they handle datetime, UUID, Enum ... natively, other types go through jsonable_encoder one by one
+# FastJSONRoute keeps the response_model validation and its include/exclude/exclude_unset... filtering
+# (.dict() of the validated models) and skips jsonable_encoder, the result goes straight to FastJSONResponse
+# returned models that already fit the response model skip the validation too, see response_projection.py
+# headers and status code set on the Response parameter of the path operation are kept
+#
+# opt in per router:
+#   fast_router = APIRouter(route_class=FastJSONRoute)
+
+import asyncio
+import copy
+import functools
+import json
+import os
+from decimal import Decimal
+from typing import Any, Callable
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import APIRoute, _prepare_response_content
+from fastapi.utils import is_body_allowed_for_status_code
+from pydantic import ValidationError
+from pydantic.error_wrappers import ErrorWrapper
+from starlette.responses import JSONResponse, Response
+
+from response_projection import NOT_PROJECTED, ResponseProjection, to_builtin
+
+JSON_BACKEND = os.getenv('JSON_BACKEND', 'auto')
+JSON_BACKENDS = ('auto', 'orjson', 'msgspec', 'json')
+
+if JSON_BACKEND not in JSON_BACKENDS:
+    raise ValueError(f'JSON_BACKEND must be one of {JSON_BACKENDS}, got {JSON_BACKEND!r}')
+
+
+def _default(value: Any) -> Any:
+    # types the encoders don't know, sets have no order so they are not encoded natively by all backends
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if isinstance(value, Decimal):
+        return float(value)  # as jsonable_encoder does
+    return jsonable_encoder(value)
+
+
+def _json_dumps(content: Any) -> bytes:
+    return json.dumps(
+        content, ensure_ascii=False, allow_nan=False, separators=(',', ':'), default=_default
+    ).encode('utf-8')
+
+
+def _load_backend(name: str):
+    if name in ('auto', 'orjson'):
+        try:
+            import orjson
+        except ImportError:
+            if name == 'orjson':
+                raise
+        else:
+            # non str keys: Dict[int, float] bodies as in main.create_index_weights
+            return 'orjson', functools.partial(orjson.dumps, default=_default, option=orjson.OPT_NON_STR_KEYS)
+    if name in ('auto', 'msgspec'):
+        try:
+            import msgspec
+        except ImportError:
+            if name == 'msgspec':
+                raise
+        else:
+            return 'msgspec', msgspec.json.Encoder(enc_hook=_default).encode
+    return 'json', _json_dumps
+
+
+backend_name, dumps = _load_backend(JSON_BACKEND)
+
+
+class FastJSONResponse(JSONResponse):
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
+
+
+class FastJSONRoute(APIRoute):
+    """ serializes the return value of the path operation with FastJSONResponse, see the top of the file"""
+
+    # where the Response parameter is passed to the wrapped path operation when it doesn't declare one
+    response_param = '_fast_json_sub_response'
+
+    def __init__(self, path: str, endpoint: Callable[..., Any], **kwargs):
+        kwargs.setdefault('response_class', FastJSONResponse)
+        super().__init__(path, endpoint, **kwargs)
+        self.serialize_options = dict(
+            include=self.response_model_include,
+            exclude=self.response_model_exclude,
+            by_alias=self.response_model_by_alias,
+            exclude_unset=self.response_model_exclude_unset,
+            exclude_defaults=self.response_model_exclude_defaults,
+            exclude_none=self.response_model_exclude_none,
+        )
+        # returned models compatible with the response model are projected without validation,
+        # see response_projection.py
+        self.projection = (
+            ResponseProjection(self.response_field, **self.serialize_options) if self.response_field else None
+        )
+
+    def get_route_handler(self):
+        original = self.dependant
+        dependant = copy.copy(original)  # the original stays for the openapi schema
+        response_param = original.response_param_name or self.response_param
+        dependant.response_param_name = response_param
+        call = original.call
+        declared = original.response_param_name is not None
+
+        if asyncio.iscoroutinefunction(call):
+            async def serialized_call(**values):
+                sub_response = values[response_param] if declared else values.pop(response_param)
+                return self.serialize(await call(**values), sub_response)
+        else:
+            # runs in the threadpool with the path operation, like FastAPI's validation of sync path operations
+            def serialized_call(**values):
+                sub_response = values[response_param] if declared else values.pop(response_param)
+                return self.serialize(call(**values), sub_response)
+
+        dependant.call = serialized_call
+        self.dependant = dependant
+        try:
+            return super().get_route_handler()
+        finally:
+            self.dependant = original
+
+    def serialize(self, content: Any, sub_response: Response) -> Response:
+        if isinstance(content, Response):
+            return content
+        if self.response_field is None:
+            content = to_builtin(content, by_alias=True)
+        else:
+            projected = self.projection.project(content)
+            content = self.validate(content) if projected is NOT_PROJECTED else projected
+        response = FastJSONResponse(content, status_code=sub_response.status_code or self.status_code or 200)
+        if not is_body_allowed_for_status_code(response.status_code):
+            response.body = b''
+        response.headers.raw.extend(sub_response.headers.raw)
+        return response
+
+    def validate(self, content: Any) -> Any:
+        # what serialize_response does, without jsonable_encoder
+        field = self.secure_cloned_response_field
+        content = _prepare_response_content(
+            content,
+            exclude_unset=self.response_model_exclude_unset,
+            exclude_defaults=self.response_model_exclude_defaults,
+            exclude_none=self.response_model_exclude_none,
+        )
+        value, errors = field.validate(content, {}, loc=('response',))
+        if isinstance(errors, ErrorWrapper):
+            errors = [errors]
+        if errors:
+            raise ValidationError(errors, field.type_)
+        return to_builtin(value, **self.serialize_options)
@@ -0,0 +1,204 @@
+# serving files from a directory for main.read_file
+#   - paths are resolved under FILES_ROOT, .. and symlinks leading outside of it are answered with 404, files that
+#     can't be read with 403
+#   - resolving and stat'ing a path are blocking calls, serve_file is called from the threadpool
+#   - the result of os.stat (size, mtime, etag, media type) is cached for FILES_STAT_TTL seconds
+#   - If-None-Match with the current ETag is answered with 304 and no body
+#   - a single Range (bytes=0-99, bytes=100-, bytes=-100) is answered with 206 or 416, If-Range is respected,
+#     requests for several ranges get the whole file
+#
+# the body is sent without copying it through python when the server supports one of the ASGI extensions
+#   http.response.pathsend     the server sends the whole file from its path
+#   http.response.zerocopysend the server sends count bytes from offset of an open file, with sendfile(2)
+# (ASGI gives the app no access to the socket, so os.sendfile can't be called here directly)
+# other servers, uvicorn included, get the file in chunks read in a worker thread
+
+import mimetypes
+import os
+import stat
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate
+from typing import Optional, Tuple
+
+import anyio
+from fastapi import HTTPException
+from starlette.responses import Response
+
+FILES_ROOT = os.getenv('FILES_ROOT', 'files')
+FILES_STAT_TTL = float(os.getenv('FILES_STAT_TTL', '1'))
+FILES_STAT_CACHE_SIZE = int(os.getenv('FILES_STAT_CACHE_SIZE', '1024'))
+CHUNK_SIZE = 64 * 1024
+
+
+class FileInfo:
+    __slots__ = ('path', 'size', 'etag', 'last_modified', 'media_type', 'checked_at')
+
+    def __init__(self, path: str, stat_result: os.stat_result):
+        self.path = path
+        self.size = stat_result.st_size
+        # changes whenever the file is replaced or modified
+        self.etag = f'"{stat_result.st_ino:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+        self.last_modified = formatdate(stat_result.st_mtime, usegmt=True)
+        self.media_type = mimetypes.guess_type(path)[0] or 'application/octet-stream'
+        self.checked_at = time.monotonic()
+
+
+class StatCache:
+    """ the FileInfo of recently served paths, a file changed on disk is seen after at most ttl seconds"""
+
+    def __init__(self, maxsize: int = FILES_STAT_CACHE_SIZE, ttl: float = FILES_STAT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path: str) -> Optional[FileInfo]:
+        with self._lock:
+            info = self._entries.get(path)
+            if info is None:
+                return None
+            if time.monotonic() - info.checked_at > self.ttl:
+                del self._entries[path]
+                return None
+            self._entries.move_to_end(path)
+            return info
+
+    def set(self, info: FileInfo):
+        with self._lock:
+            self._entries[info.path] = info
+            self._entries.move_to_end(info.path)
+            if len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+
+stat_cache = StatCache()
+
+
+def resolve(root: str, file_path: str) -> str:
+    """ the real path of file_path under root, raises 404 when it is outside of root"""
+    if '\x00' in file_path:
+        raise HTTPException(status_code=404, detail='File not found')
+    real_root = os.path.realpath(root)
+    path = os.path.realpath(os.path.join(real_root, file_path.lstrip('/')))
+    if os.path.commonpath([real_root, path]) != real_root:
+        raise HTTPException(status_code=404, detail='File not found')
+    return path
+
+
+def file_info(path: str, cache: StatCache = stat_cache) -> FileInfo:
+    info = cache.get(path)
+    if info is None:
+        try:
+            stat_result = os.stat(path)
+        except PermissionError:
+            raise HTTPException(status_code=403, detail='Forbidden')
+        except OSError:  # missing, a file in the middle of the path, a name too long ...
+            raise HTTPException(status_code=404, detail='File not found')
+        if not stat.S_ISREG(stat_result.st_mode):
+            raise HTTPException(status_code=404, detail='File not found')
+        if not os.access(path, os.R_OK):  # would only fail once the response has started
+            raise HTTPException(status_code=403, detail='Forbidden')
+        info = FileInfo(path, stat_result)
+        cache.set(info)
+    return info
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+    if header.strip() == '*':
+        return True
+    # weak comparison, W/"x" matches "x"
+    return any(tag.strip().removeprefix('W/') == etag for tag in header.split(','))
+
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """ (start, end inclusive) of a single byte range, None to send the whole file
+    raises 416 when the range can't be satisfied"""
+    unit, _, ranges = header.partition('=')
+    if unit.strip() != 'bytes' or ',' in ranges:
+        return None  # unknown units and multiple ranges are ignored, the whole file is sent
+    first, _, last = ranges.strip().partition('-')
+    try:
+        if first == '':  # the last n bytes
+            length = int(last)
+            if length <= 0:
+                raise ValueError
+            start, end = max(size - length, 0), size - 1
+        else:
+            start = int(first)
+            if last and int(last) < start:
+                return None  # syntactically invalid, ignored
+            end = min(int(last), size - 1) if last else size - 1
+    except ValueError:
+        return None
+    if start >= size or size == 0:
+        raise HTTPException(
+            status_code=416, detail='Range Not Satisfiable', headers={'Content-Range': f'bytes */{size}'}
+        )
+    return start, end
+
+
+class RangeFileResponse(Response):
+    """ count bytes of a file from offset"""
+
+    def __init__(self, info: FileInfo, status_code: int = 200, offset: int = 0, count: Optional[int] = None,
+                 send_body: bool = True):
+        self.info = info
+        self.offset = offset
+        self.count = info.size - offset if count is None else count
+        self.send_body = send_body
+        super().__init__(status_code=status_code, media_type=info.media_type, headers={
+            'accept-ranges': 'bytes',
+            'etag': info.etag,
+            'last-modified': info.last_modified,
+            'content-length': str(self.count),
+        })
+        if status_code == 206:
+            self.headers['content-range'] = f'bytes {offset}-{offset + self.count - 1}/{info.size}'
+
+    async def __call__(self, scope, receive, send):
+        await send({'type': 'http.response.start', 'status': self.status_code, 'headers': self.raw_headers})
+        if not self.send_body or self.count == 0:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+            return
+        extensions = scope.get('extensions') or {}
+        if 'http.response.pathsend' in extensions and self.offset == 0 and self.count == self.info.size:
+            await send({'type': 'http.response.pathsend', 'path': self.info.path})
+            return
+        if 'http.response.zerocopysend' in extensions:
+            with open(self.info.path, 'rb') as file:
+                await send({
+                    'type': 'http.response.zerocopysend', 'file': file, 'offset': self.offset, 'count': self.count,
+                    'more_body': False,
+                })
+            return
+        async with await anyio.open_file(self.info.path, mode='rb') as file:
+            await file.seek(self.offset)
+            remaining = self.count
+            while remaining:
+                chunk = await file.read(min(CHUNK_SIZE, remaining))
+                if not chunk:  # the file was truncated since it was stat'ed
+                    raise RuntimeError(f'{self.info.path} is shorter than expected')
+                remaining -= len(chunk)
+                await send({'type': 'http.response.body', 'body': chunk, 'more_body': remaining > 0})
+
+
+def serve_file(
+        file_path: str,
+        root: str = FILES_ROOT,
+        if_none_match: Optional[str] = None,
+        range_header: Optional[str] = None,
+        if_range: Optional[str] = None,
+        send_body: bool = True,
+) -> Response:
+    info = file_info(resolve(root, file_path))
+    if if_none_match is not None and _etag_matches(if_none_match, info.etag):
+        return Response(status_code=304, headers={'etag': info.etag, 'last-modified': info.last_modified})
+    # If-Range: the range only applies if the client's copy is still the current one
+    if range_header is not None and (if_range is None or if_range.strip() == info.etag):
+        byte_range = parse_range(range_header, info.size)
+        if byte_range is not None:
+            start, end = byte_range
+            return RangeFileResponse(info, status_code=206, offset=start, count=end - start + 1, send_body=send_body)
+    return RangeFileResponse(info, send_body=send_body)
@@ -1,8 +1,11 @@
+import hashlib
 from typing import Optional, List
 
-from fastapi import FastAPI, Form, File, UploadFile
+from fastapi import FastAPI, Form, File, UploadFile, Depends
 from starlette.responses import HTMLResponse
 
+from uploads import SpooledUpload, SpooledUploadOut, spooled_upload
+
 form_data_app = FastAPI()
 
 
@@ -30,6 +33,9 @@ async def create_file(
     return {'file_size': len(file)}
 
 
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+
 @form_data_app.post('/uploadfile')
 async def create_upload_file(
         file: UploadFile,  # will store file on disk, good for large files
@@ -37,8 +43,21 @@ async def create_upload_file(
         files: List[UploadFile],  # multiple files associated with the same form field
         description='A file read as UploadFile',  # additional metadata for docs
 ):
-    contents = await file.read()
-    return {'filenames': [file.filename for file in files]}
+    # read in chunks, await file.read() would load the whole file into memory
+    sha256 = hashlib.sha256()
+    while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+        sha256.update(chunk)
+    return {'filenames': [file.filename for file in files], 'sha256': sha256.hexdigest()}
+
+
+# streaming upload for large files, see uploads.py
+# the body is parsed as it arrives and the files are written to the spool directory with their size and sha256,
+# memory stays bounded whatever the size of the files and the size limits answer 413 before the rest is received
+# the response leaves out where the files were spooled, they are deleted once it is sent
+# curl -F description=report -F file=@big.iso http://127.0.0.1:8000/files/stream
+@form_data_app.post('/files/stream', response_model=SpooledUploadOut)
+async def create_file_streaming(upload: SpooledUpload = Depends(spooled_upload)):
+    return upload
 
 
 @form_data_app.get("/")
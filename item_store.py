@@ -0,0 +1,144 @@
+# in-memory item repository with indexes
+# slicing a list only pages, any filter on it would scan every item
+# here the items are kept by id with secondary indexes, each a posting list of the ids having a value:
+#   name     lower-cased item_name, exact match
+#   tag      each of the item's tags
+#   prefix   the first one and two characters of the name, for q shorter than three characters
+#   trigram  every three character substring of the name, for q of three characters or more, the items having
+#            the rarest trigram of q are then checked for containing q
+# q is case insensitive, a short q matches names starting with it, a longer one names containing it
+#
+# the posting lists are arrays of ids in ascending order, 8 bytes per entry, results come in id order
+# a query walks the shortest list and looks the ids up in the others by bisection, stopping once it has
+# skip + limit results, so its cost depends on the page and the rarest filter, not on the number of items
+
+import threading
+from array import array
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, Optional
+
+EMPTY = array('q')
+
+
+def trigrams(text: str) -> set:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def _contains(ids: array, item_id: int) -> bool:
+    i = bisect_left(ids, item_id)
+    return i < len(ids) and ids[i] == item_id
+
+
+def _add(index: Dict[str, array], key: str, item_id: int):
+    ids = index.get(key)
+    if ids is None:
+        index[key] = array('q', [item_id])
+    elif not ids or ids[-1] < item_id:
+        ids.append(item_id)  # new ids are the largest, the common case
+    else:
+        insort(ids, item_id)
+
+
+def _remove(index: Dict[str, array], key: str, item_id: int):
+    ids = index[key]
+    del ids[bisect_left(ids, item_id)]
+    if not ids:
+        del index[key]
+
+
+class ItemStore:
+    def __init__(self, items: Iterable[dict] = ()):
+        self._items: Dict[int, dict] = {}
+        self._names: Dict[int, str] = {}  # lower-cased names, for checking q
+        self._ids = array('q')
+        self._by_name: Dict[str, array] = {}
+        self._by_tag: Dict[str, array] = {}
+        self._by_prefix: Dict[str, array] = {}
+        self._by_trigram: Dict[str, array] = {}
+        self._next_id = 0
+        self._lock = threading.Lock()
+        for item in items:
+            self.add(item)
+
+    def __len__(self):
+        return len(self._items)
+
+    def _keys(self, item: dict):
+        name = item.get('item_name', '').lower()
+        yield self._by_name, name
+        for tag in set(item.get('tags', ())):
+            yield self._by_tag, tag
+        for prefix in {name[:1], name[:2]} - {''}:
+            yield self._by_prefix, prefix
+        for trigram in trigrams(name):
+            yield self._by_trigram, trigram
+
+    def add(self, item: dict) -> int:
+        with self._lock:
+            item_id = self._next_id
+            self._next_id += 1
+            self._items[item_id] = item
+            self._names[item_id] = item.get('item_name', '').lower()
+            self._ids.append(item_id)
+            for index, key in self._keys(item):
+                _add(index, key, item_id)
+            return item_id
+
+    def get(self, item_id: int) -> Optional[dict]:
+        return self._items.get(item_id)
+
+    def remove(self, item_id: int):
+        with self._lock:
+            item = self._items.pop(item_id)  # KeyError for an unknown id
+            del self._names[item_id]
+            del self._ids[bisect_left(self._ids, item_id)]
+            for index, key in self._keys(item):
+                _remove(index, key, item_id)
+
+    def query(
+            self,
+            q: Optional[str] = None,
+            name: Optional[str] = None,
+            tag: Optional[str] = None,
+            skip: int = 0,
+            limit: int = 100,
+    ) -> List[dict]:
+        postings = []
+        needle = None
+        if name is not None:
+            postings.append(self._by_name.get(name.lower(), EMPTY))
+        if tag is not None:
+            postings.append(self._by_tag.get(tag, EMPTY))
+        if q:
+            q = q.lower()
+            if len(q) < 3:
+                postings.append(self._by_prefix.get(q, EMPTY))
+            else:
+                # checking that the name contains q implies all its trigrams, only the rarest one is needed to
+                # find the candidates
+                needle = q
+                postings.append(min((self._by_trigram.get(trigram, EMPTY) for trigram in trigrams(q)), key=len))
+        with self._lock:
+            if not postings:
+                return [self._items[item_id] for item_id in self._ids[skip:skip + limit]]
+            postings.sort(key=len)
+            shortest, others = postings[0], postings[1:]
+            # a negative skip or limit counts from the end of the matches, as the slice of the unfiltered path does,
+            # they are all collected and sliced
+            sliced = skip < 0 or limit <= 0
+            results = []
+            for item_id in shortest:
+                if needle is not None and needle not in self._names[item_id]:
+                    continue
+                if others and not all(_contains(ids, item_id) for ids in others):
+                    continue
+                if sliced:
+                    results.append(self._items[item_id])
+                    continue
+                if skip:
+                    skip -= 1
+                    continue
+                results.append(self._items[item_id])
+                if len(results) >= limit:
+                    break
+            return results[skip:skip + limit] if sliced else results
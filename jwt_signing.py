@@ -0,0 +1,241 @@
+# pluggable signing of access tokens
+# python-jose parses the key and picks the algorithm implementation on every encode/decode, and with a single shared
+# HS256 secret every service verifying tokens must hold the secret and keys can't be rotated without downtime
+#
+# here a Signer holds ready to use key objects (built once), a KeyRing holds the signers by key id (kid)
+# tokens are signed with the current signer and carry its kid in the header, verification picks the key by kid
+# rotating adds a new current signer and keeps the old ones until they are retired, so tokens signed before the
+# rotation stay valid until they expire
+# tokens without a kid (issued before kids were added) are verified with the first signer of the keyring, the default
+# one, until it is retired
+# the public keys of the asymmetric signers are published as a JWKS (https://www.rfc-editor.org/rfc/rfc7517)
+#
+# the header comes from the client: a kid or alg that is not a string is a malformed token; exp and nbf are checked
+# and iat must be a number, as jose.jwt.decode did
+#
+# only compact JWS with the algorithms below is supported
+#   HS256 - HMAC with SHA-256, symmetric
+#   EdDSA - Ed25519
+#   ES256 - ECDSA on P-256 with SHA-256
+
+import abc
+import base64
+import calendar
+import hashlib
+import hmac
+import json
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Optional
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.asymmetric import ec
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+from cryptography.hazmat.primitives.asymmetric.utils import decode_dss_signature, encode_dss_signature
+from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+
+class InvalidTokenError(Exception):
+    pass
+
+
+def b64url_encode(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def b64url_decode(data: str) -> bytes:
+    return base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+
+
+def new_kid() -> str:
+    return secrets.token_hex(8)
+
+
+class Signer(abc.ABC):
+    alg: str = ''
+
+    def __init__(self, kid: Optional[str] = None):
+        self.kid = kid or new_kid()
+
+    @abc.abstractmethod
+    def sign(self, message: bytes) -> bytes:
+        pass
+
+    @abc.abstractmethod
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        pass
+
+    def public_jwk(self) -> Optional[dict]:
+        return None  # symmetric keys are never published
+
+
+class HS256Signer(Signer):
+    alg = 'HS256'
+
+    def __init__(self, secret, kid: Optional[str] = None):
+        super().__init__(kid)
+        self._secret = secret.encode() if isinstance(secret, str) else secret
+
+    def sign(self, message: bytes) -> bytes:
+        return hmac.new(self._secret, message, hashlib.sha256).digest()
+
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        return hmac.compare_digest(self.sign(message), signature)
+
+
+class EdDSASigner(Signer):
+    alg = 'EdDSA'
+
+    def __init__(self, private_key: Optional[Ed25519PrivateKey] = None, kid: Optional[str] = None):
+        super().__init__(kid)
+        self._private_key = private_key or Ed25519PrivateKey.generate()
+        self._public_key = self._private_key.public_key()
+
+    def sign(self, message: bytes) -> bytes:
+        return self._private_key.sign(message)
+
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        try:
+            self._public_key.verify(signature, message)
+        except InvalidSignature:
+            return False
+        return True
+
+    def public_jwk(self) -> dict:
+        raw = self._public_key.public_bytes(Encoding.Raw, PublicFormat.Raw)
+        return {'kty': 'OKP', 'crv': 'Ed25519', 'x': b64url_encode(raw), 'kid': self.kid, 'alg': self.alg, 'use': 'sig'}
+
+
+class ES256Signer(Signer):
+    alg = 'ES256'
+
+    def __init__(self, private_key: Optional[ec.EllipticCurvePrivateKey] = None, kid: Optional[str] = None):
+        super().__init__(kid)
+        self._private_key = private_key or ec.generate_private_key(ec.SECP256R1())
+        self._public_key = self._private_key.public_key()
+
+    def sign(self, message: bytes) -> bytes:
+        # cryptography returns a DER sequence, JWS wants r and s as two 32 byte big endian integers
+        r, s = decode_dss_signature(self._private_key.sign(message, ec.ECDSA(hashes.SHA256())))
+        return r.to_bytes(32, 'big') + s.to_bytes(32, 'big')
+
+    def verify(self, message: bytes, signature: bytes) -> bool:
+        if len(signature) != 64:
+            return False
+        r, s = int.from_bytes(signature[:32], 'big'), int.from_bytes(signature[32:], 'big')
+        try:
+            self._public_key.verify(encode_dss_signature(r, s), message, ec.ECDSA(hashes.SHA256()))
+        except InvalidSignature:
+            return False
+        return True
+
+    def public_jwk(self) -> dict:
+        numbers = self._public_key.public_numbers()
+        return {
+            'kty': 'EC', 'crv': 'P-256',
+            'x': b64url_encode(numbers.x.to_bytes(32, 'big')),
+            'y': b64url_encode(numbers.y.to_bytes(32, 'big')),
+            'kid': self.kid, 'alg': self.alg, 'use': 'sig',
+        }
+
+
+SIGNERS = {signer.alg: signer for signer in (HS256Signer, EdDSASigner, ES256Signer)}
+
+
+def _json_default(value):
+    if isinstance(value, datetime):
+        return calendar.timegm(value.utctimetuple())  # NumericDate, naive datetimes are utc as in jose
+    raise TypeError(f'{type(value).__name__} is not JSON serializable')
+
+
+class KeyRing:
+    def __init__(self, signer: Signer):
+        self._signers: Dict[str, Signer] = {signer.kid: signer}
+        self.current = signer
+        self.default_kid = signer.kid  # verifies the tokens without a kid
+        self._lock = threading.Lock()
+
+    def get(self, kid: str) -> Optional[Signer]:
+        return self._signers.get(kid)
+
+    def rotate(self, signer: Signer) -> Signer:
+        """ signs new tokens with signer, the previous keys keep verifying until retired"""
+        with self._lock:
+            signers = dict(self._signers)
+            signers[signer.kid] = signer
+            self._signers = signers  # replaced, not mutated, readers never lock
+            self.current = signer
+        return signer
+
+    def retire(self, kid: str):
+        with self._lock:
+            if kid == self.current.kid:
+                raise ValueError('the current key can not be retired, rotate first')
+            self._signers = {key: signer for key, signer in self._signers.items() if key != kid}
+
+    def jwks(self) -> dict:
+        return {'keys': [jwk for jwk in (signer.public_jwk() for signer in self._signers.values()) if jwk]}
+
+    def encode(self, claims: dict) -> str:
+        signer = self.current
+        header = {'alg': signer.alg, 'typ': 'JWT', 'kid': signer.kid}
+        signing_input = (
+            b64url_encode(json.dumps(header, separators=(',', ':')).encode())
+            + '.'
+            + b64url_encode(json.dumps(claims, separators=(',', ':'), default=_json_default).encode())
+        )
+        return signing_input + '.' + b64url_encode(signer.sign(signing_input.encode()))
+
+    def decode(self, token: str, leeway: float = 0) -> dict:
+        """ verifies the signature and the exp, nbf and iat claims and returns the claims, raises InvalidTokenError"""
+        try:
+            signing_input, _, signature = token.rpartition('.')
+            encoded_header, _, encoded_claims = signing_input.partition('.')
+            header = json.loads(b64url_decode(encoded_header))
+            claims = json.loads(b64url_decode(encoded_claims))
+            signature = b64url_decode(signature)
+        except (ValueError, TypeError) as e:  # binascii.Error and JSONDecodeError are ValueErrors
+            raise InvalidTokenError('malformed token') from e
+        if not isinstance(header, dict) or not isinstance(claims, dict):
+            raise InvalidTokenError('malformed token')
+        kid = header.get('kid')
+        alg = header.get('alg')
+        # the header comes from the client, only strings are looked up and compared
+        if not isinstance(kid, (str, type(None))) or not isinstance(alg, str):
+            raise InvalidTokenError('malformed token header')
+        # tokens issued before kids were added are checked against the default key, whatever the current one is
+        signer = self._signers.get(self.default_kid if kid is None else kid)
+        if signer is None:
+            raise InvalidTokenError('unknown key id')
+        if alg != signer.alg:  # never let the token pick the algorithm
+            raise InvalidTokenError('algorithm does not match the key')
+        if not signer.verify(signing_input.encode(), signature):
+            raise InvalidTokenError('invalid signature')
+        # the registered time claims, checked as jose.jwt.decode did
+        now = time.time()
+        exp, nbf = _time_claim(claims, 'exp'), _time_claim(claims, 'nbf')
+        _time_claim(claims, 'iat')  # only its type, a token may be issued by a server whose clock is ahead
+        if exp is not None and exp + leeway < now:
+            raise InvalidTokenError('token has expired')
+        if nbf is not None and nbf - leeway > now:
+            raise InvalidTokenError('token is not yet valid')
+        return claims
+
+
+def _time_claim(claims: dict, name: str) -> Optional[float]:
+    value = claims.get(name)
+    if value is not None and (isinstance(value, bool) or not isinstance(value, (int, float))):
+        raise InvalidTokenError(f'invalid {name} claim')
+    return value
+
+
+def signer_for(alg: str, secret: Optional[str] = None, kid: Optional[str] = None) -> Signer:
+    """ a new signer for alg, asymmetric signers get a freshly generated key pair"""
+    if alg not in SIGNERS:
+        raise ValueError(f'unsupported algorithm {alg!r}, use one of {list(SIGNERS)}')
+    if alg == HS256Signer.alg:
+        return HS256Signer(secret or secrets.token_hex(32), kid=kid)
+    return SIGNERS[alg](kid=kid)
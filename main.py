@@ -17,10 +17,25 @@ import http
 from enum import Enum, unique  # https://docs.python.org/3/library/enum.html
 from typing import Optional, List, Set, Dict
 
-from fastapi import FastAPI, Query, Path, Body, Cookie, Header, HTTPException
+from fastapi import FastAPI, APIRouter, Query, Path, Body, Cookie, Header, HTTPException
 from pydantic import BaseModel, Field, HttpUrl, EmailStr
 
+from compression import CompressionMiddleware
+from fast_responses import FastJSONRoute
+from file_serving import serve_file
+from item_store import ItemStore
+from profiling import add_profiling_from_env
+
 app = FastAPI()
+# PROFILE_DIR=profiles PROFILE_SECRET=... writes a sampled profile of the requests sent with X-Profile: <secret>,
+# see profiling.py
+add_profiling_from_env(app)
+# JSON bodies of 1 KB and more (the lists of /images/multiple ...) are sent compressed with gzip, br or zstd, as the
+# client accepts, see compression.py
+app.add_middleware(CompressionMiddleware)
+# routes of this router encode their response with orjson and skip jsonable_encoder, see fast_responses.py
+# it is included at the end of the file, once all its routes are declared
+fast_router = APIRouter(route_class=FastJSONRoute)
 
 
 @app.get('/')  # operation(endpoint)
@@ -57,8 +72,9 @@ class UserOut(BaseModel):
     full_name: Optional[str] = None
 
 
-@app.post('/user', response_model=UserOut)  # Pydantic model for output
+@fast_router.post('/user', response_model=UserOut)  # Pydantic model for output
 async def create_user(user: UserIn):  # Pydantic model for input
+    # UserIn has all the fields of UserOut, fast_router copies them without validating user again
     return user  # user in response_model has no password so pydantic will filter this field out and it will not appear in the response
 
 
@@ -86,20 +102,29 @@ async def get_model(model_name: ModelName):
 
 # path parameter can be /home/myfile.txt
 # the url will look as /files//home/myfile.txt
+# the file is served from FILES_ROOT with ETag and Range support, see file_serving.py
+# a def, the path is resolved and stat'ed with blocking calls in the threadpool
 @app.get('/files/{file_path:path}')  # declare parameter of type path
-async def read_file(file_path: str):
-    return {'file_path': file_path}
+def read_file(
+        file_path: str,
+        if_none_match: Optional[str] = Header(None),
+        range_header: Optional[str] = Header(None, alias='range'),
+        if_range: Optional[str] = Header(None),
+):
+    return serve_file(file_path, if_none_match=if_none_match, range_header=range_header, if_range=if_range)
 
 
 #  when you declare other function parameters that are not part of path parameters, they are interpreted as query parameters
 fake_items_db = [{'item_name': 'foo'}, {'item_name': 'bar'}, {'item_name': 'baz'}]
+# indexed by name and by the substrings of the name, so q doesn't scan the list, see item_store.py
+item_store = ItemStore(fake_items_db)
 
 
 # query is a set of key=value
-# http://127.0.0.1:8000/items/?skip=0&limit=10
+# http://127.0.0.1:8000/items/?skip=0&limit=10&q=ba
 @app.get('/items/')
-async def read_item(skip: int = 0, limit: int = 10):  # skip, limit are query parameters
-    return fake_items_db[skip:(skip + limit)]
+async def read_item(skip: int = 0, limit: int = 10, q: Optional[str] = None):  # skip, limit, q are query parameters
+    return item_store.query(q=q, skip=skip, limit=limit)
 
 
 @app.get('/items/')
@@ -222,7 +247,7 @@ class Item(BaseModel):
 # }
 
 # @app.post('/items/')
-@app.post('/items/',
+@fast_router.post('/items/',
           response_model=Item,  # declare the Pydantic model (or list) that will be used
           status_code=http.HTTPStatus.CREATED  # alternatively a number 201
           )
@@ -235,9 +260,9 @@ async def create_item(item: Item):  # request.body variable
 
 
 ## request.body and path parameters
-@app.put('/items1/{item_id}',
-         response_model=Item,
-         response_model_exclude_unset=True)  # the default values won't be included in the response, only the values that are actually set
+@fast_router.put('/items1/{item_id}',
+                 response_model=Item,
+                 response_model_exclude_unset=True)  # the default values won't be included in the response, only the values that are actually set
 async def update_item(
         item_id: int,  # recognizes path parameter by name
         item: Item,  # Pydantic model is recognized as the request.body
@@ -313,3 +338,6 @@ async def create_index_weights(
         weights: Dict[int, float]  # bc it is not a primitive type, interpreted as body
 ):
     return weights
+
+
+app.include_router(fast_router)
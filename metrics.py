@@ -0,0 +1,136 @@
+# request metrics in the prometheus text format
+# https://prometheus.io/docs/instrumenting/exposition_formats/
+#
+#   http_request_duration_seconds  histogram per method, route and status
+#   http_requests_in_progress      gauge
+#   http_request_size_bytes_total  counter of request body bytes per method and route
+#   http_response_size_bytes_total counter of response body bytes per method, route and status
+#
+# the route label is the path template of the matched route (/items/{item_id}), not the requested path,
+# so the number of series stays bounded, requests that match no route are counted under 'unmatched'
+#
+# recording takes no locks: the middleware only runs on the event loop thread, so the updates of plain ints and
+# lists can't interleave, durations come from the monotonic perf_counter clock
+# render must run on that thread as well, the /metrics path operation is an async def
+
+from bisect import bisect_left
+from time import perf_counter
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+CONTENT_TYPE = 'text/plain; version=0.0.4'  # starlette appends the utf-8 charset
+
+
+class Histogram:
+    __slots__ = ('buckets', 'counts', 'sum', 'count')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(**labels) -> str:
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels.items()) + '}'
+
+
+class MetricsRegistry:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.durations = {}  # (method, route, status) -> Histogram
+        self.in_progress = 0
+        self.request_bytes = {}  # (method, route) -> int
+        self.response_bytes = {}  # (method, route, status) -> int
+
+    def record(self, method: str, route: str, status: int, duration: float, request_bytes: int, response_bytes: int):
+        key = (method, route, status)
+        histogram = self.durations.get(key)
+        if histogram is None:
+            histogram = self.durations[key] = Histogram(self.buckets)
+        histogram.observe(duration)
+        self.request_bytes[key[:2]] = self.request_bytes.get(key[:2], 0) + request_bytes
+        self.response_bytes[key] = self.response_bytes.get(key, 0) + response_bytes
+
+    def render(self) -> str:
+        lines = [
+            '# HELP http_request_duration_seconds Time spent processing a request.',
+            '# TYPE http_request_duration_seconds histogram',
+        ]
+        for (method, route, status), histogram in sorted(self.durations.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + ('+Inf',), histogram.counts):
+                cumulative += count
+                labels = _labels(method=method, route=route, status=status, le=bound)
+                lines.append(f'http_request_duration_seconds_bucket{labels} {cumulative}')
+            labels = _labels(method=method, route=route, status=status)
+            lines.append(f'http_request_duration_seconds_sum{labels} {histogram.sum}')
+            lines.append(f'http_request_duration_seconds_count{labels} {histogram.count}')
+        lines += [
+            '# HELP http_requests_in_progress Requests being processed.',
+            '# TYPE http_requests_in_progress gauge',
+            f'http_requests_in_progress {self.in_progress}',
+            '# HELP http_request_size_bytes_total Bytes received in request bodies.',
+            '# TYPE http_request_size_bytes_total counter',
+        ]
+        for (method, route), total in sorted(self.request_bytes.items()):
+            lines.append(f'http_request_size_bytes_total{_labels(method=method, route=route)} {total}')
+        lines += [
+            '# HELP http_response_size_bytes_total Bytes sent in response bodies.',
+            '# TYPE http_response_size_bytes_total counter',
+        ]
+        for (method, route, status), total in sorted(self.response_bytes.items()):
+            lines.append(f'http_response_size_bytes_total{_labels(method=method, route=route, status=status)} {total}')
+        return '\n'.join(lines) + '\n'
+
+
+registry = MetricsRegistry()
+
+
+class MetricsMiddleware:
+    """ pure ASGI middleware, it only watches the messages passing through and never buffers a body"""
+
+    def __init__(self, app, registry: MetricsRegistry = registry):
+        self.app = app
+        self.registry = registry
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        registry = self.registry
+        # status, request body bytes, response body bytes
+        # 500 stays when the app raises before it starts a response
+        state = [500, 0, 0]
+
+        async def receive_counting():
+            message = await receive()
+            if message['type'] == 'http.request':
+                state[1] += len(message.get('body', b''))
+            return message
+
+        async def send_counting(message):
+            if message['type'] == 'http.response.start':
+                state[0] = message['status']
+            elif message['type'] == 'http.response.body':
+                state[2] += len(message.get('body', b''))
+            await send(message)
+
+        registry.in_progress += 1
+        start = perf_counter()
+        try:
+            await self.app(scope, receive_counting, send_counting)
+        finally:
+            duration = perf_counter() - start
+            registry.in_progress -= 1
+            # the router stores the matched route in the scope
+            route = getattr(scope.get('route'), 'path', 'unmatched')
+            registry.record(scope['method'], route, state[0], duration, state[1], state[2])
@@ -1,14 +1,65 @@
+import os
 import time
 from fastapi import FastAPI
 from starlette.requests import Request
+from starlette.responses import Response
 
-middleware_app = FastAPI()
+import metrics
+
+# asgi (default) adds the X-process-time header with ProcessTimeMiddleware
+# decorator uses @app.middleware('http'), starlette runs it in a BaseHTTPMiddleware, which starts a task and a
+# memory stream per request and has to wait for call_next, so the app is no longer paced by the client reading
+MIDDLEWARE_MODE = os.getenv('MIDDLEWARE_MODE', 'asgi')
+
+if MIDDLEWARE_MODE not in ('asgi', 'decorator'):
+    raise ValueError(f'MIDDLEWARE_MODE must be asgi or decorator, got {MIDDLEWARE_MODE!r}')
 
 
-@middleware_app.middleware('http')
 async def add_process_time_header(request: Request, call_next):
-    start_time = time.time()
+    start_time = time.perf_counter()  # monotonic, time.time() jumps when the system clock is adjusted
     response = await call_next(request)
-    process_time = time.time() - start_time
+    process_time = time.perf_counter() - start_time
     response.headers['X-process-time'] = str(process_time)
     return response
+
+
+class ProcessTimeMiddleware:
+    """ the same header as add_process_time_header, added to the http.response.start message as it passes
+    the body messages go straight through"""
+
+    def __init__(self, app, header: str = 'X-process-time'):
+        self.app = app
+        self.header = header.lower().encode('latin-1')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        start_time = time.perf_counter()
+
+        async def send_with_process_time(message):
+            if message['type'] == 'http.response.start':
+                process_time = time.perf_counter() - start_time
+                # the headers must not be mutated in place, the response may send the same list again
+                headers = list(message.get('headers', ()))
+                headers.append((self.header, str(process_time).encode('latin-1')))
+                message = {**message, 'headers': headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_process_time)
+
+
+middleware_app = FastAPI()
+if MIDDLEWARE_MODE == 'asgi':
+    middleware_app.add_middleware(ProcessTimeMiddleware)
+else:
+    middleware_app.middleware('http')(add_process_time_header)
+# latency histograms, in flight requests and body sizes of every request, exposed on /metrics
+middleware_app.add_middleware(metrics.MetricsMiddleware)
+
+
+# async def, rendered on the event loop thread like the updates of metrics.py, in the threadpool it could read the
+# histograms while a request is recorded
+@middleware_app.get('/metrics', include_in_schema=False)
+async def read_metrics():
+    return Response(metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
@@ -0,0 +1,87 @@
+# password hashing for security_jwt
+# bcrypt and argon2 are slow on purpose (about 250 ms for bcrypt with cost 12)
+# called directly from an async def path operation they block the event loop, so no other request runs meanwhile
+# the async functions here run them in a bounded pool of worker threads (bcrypt and argon2 release the GIL)
+# or of worker processes, and the event loop keeps serving other requests
+#
+# configuration
+#   PASSWORD_HASH_SCHEME   bcrypt (default) or argon2, used for new hashes
+#   BCRYPT_ROUNDS          bcrypt cost factor, 12 by default
+#   ARGON2_TIME_COST, ARGON2_MEMORY_COST (KiB), ARGON2_PARALLELISM
+#   PASSWORD_HASH_EXECUTOR thread (default) or process
+#   PASSWORD_HASH_WORKERS  number of hashes computed at the same time, the number of cpus by default
+# hashes made with another scheme or other parameters still verify, and verify_and_update returns a new hash for them
+
+import asyncio
+import os
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional, Tuple
+
+import anyio
+from passlib.context import CryptContext
+
+PASSWORD_HASH_SCHEME = os.getenv('PASSWORD_HASH_SCHEME', 'bcrypt')
+BCRYPT_ROUNDS = int(os.getenv('BCRYPT_ROUNDS', '12'))
+ARGON2_TIME_COST = int(os.getenv('ARGON2_TIME_COST', '3'))
+ARGON2_MEMORY_COST = int(os.getenv('ARGON2_MEMORY_COST', '65536'))
+ARGON2_PARALLELISM = int(os.getenv('ARGON2_PARALLELISM', '4'))
+PASSWORD_HASH_EXECUTOR = os.getenv('PASSWORD_HASH_EXECUTOR', 'thread')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(os.cpu_count() or 1)))
+
+SCHEMES = ('bcrypt', 'argon2')
+
+if PASSWORD_HASH_SCHEME not in SCHEMES:
+    raise ValueError(f'PASSWORD_HASH_SCHEME must be one of {SCHEMES}, got {PASSWORD_HASH_SCHEME!r}')
+if PASSWORD_HASH_EXECUTOR not in ('thread', 'process'):
+    raise ValueError(f'PASSWORD_HASH_EXECUTOR must be thread or process, got {PASSWORD_HASH_EXECUTOR!r}')
+
+
+def make_context(scheme: str = PASSWORD_HASH_SCHEME, bcrypt_rounds: int = BCRYPT_ROUNDS) -> CryptContext:
+    return CryptContext(
+        # the first scheme hashes new passwords, deprecated='auto' marks the others as needing an update
+        schemes=[scheme] + [other for other in SCHEMES if other != scheme],
+        deprecated='auto',
+        # a bcrypt hash with another cost than the current one needs an update too
+        bcrypt__default_rounds=bcrypt_rounds,
+        bcrypt__min_rounds=bcrypt_rounds,
+        bcrypt__max_rounds=bcrypt_rounds,
+        argon2__time_cost=ARGON2_TIME_COST,
+        argon2__memory_cost=ARGON2_MEMORY_COST,
+        argon2__parallelism=ARGON2_PARALLELISM,
+    )
+
+
+pwd_context = make_context()
+
+
+# the blocking functions, module level so a process pool can pickle them
+def hash_password(password: str) -> str:
+    return pwd_context.hash(password)
+
+
+def verify_and_update(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """ returns (verified, new hash or None), a new hash is only returned for a verified hash with outdated parameters"""
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+_thread_limiter: Optional[anyio.CapacityLimiter] = None
+_process_pool: Optional[ProcessPoolExecutor] = None
+
+
+async def _run_in_pool(func, *args):
+    global _thread_limiter, _process_pool
+    if PASSWORD_HASH_EXECUTOR == 'process':
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PASSWORD_HASH_WORKERS)
+        return await asyncio.get_running_loop().run_in_executor(_process_pool, func, *args)
+    if _thread_limiter is None:  # created lazily, a limiter belongs to the running event loop
+        _thread_limiter = anyio.CapacityLimiter(PASSWORD_HASH_WORKERS)
+    return await anyio.to_thread.run_sync(func, *args, limiter=_thread_limiter)
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_in_pool(hash_password, password)
+
+
+async def verify_and_update_async(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    return await _run_in_pool(verify_and_update, plain_password, hashed_password)
@@ -0,0 +1,271 @@
+# opt-in sampling profiler for single requests
+# a profiled request gets its stacks sampled every few milliseconds by a background thread (sys._current_frames),
+# the samples are written as collapsed stacks ("frame;frame;frame count" per line) to PROFILE_DIR when it finishes
+# render them with flamegraph.pl, speedscope (https://www.speedscope.app) or inferno
+#
+# a request is profiled when it sends the trigger header with the secret of PROFILE_SECRET (X-Profile: <secret>),
+# the name of its profile is returned in X-Profile-File, or when it is picked by PROFILE_SAMPLE_RATE
+# without PROFILE_SECRET the header is ignored, anyone could otherwise make the app profile and write files
+# requests that are not profiled only pay for the header check
+# only the last PROFILE_MAX_FILES profiles written by the process are kept, the older ones are deleted
+#
+# attributing samples to a request
+#   event loop thread - the sample belongs to the request whose ProfilingMiddleware frame is on the stack, that is
+#                       its handler, dependencies and serialization, frames of other requests and the idle loop are
+#                       skipped
+#   other threads     - sync endpoints and dependencies run in the threadpool, a sample belongs to the request when
+#                       the stack runs the endpoint or a dependency of its route
+#                       (two requests to the same route at the same time can't be told apart there)
+# bodies of StreamingResponse run in a separate task and are not sampled
+#
+# overhead
+#   the sampler holds the GIL while it walks the stacks, so its cost is taken from the app, the interval grows so
+#   that sampling stays under PROFILE_MAX_OVERHEAD (fraction of the time), and at most PROFILE_MAX_CONCURRENT
+#   requests are profiled at the same time, others are served unprofiled
+#
+# configuration
+#   PROFILE_DIR             directory for the profiles, profiling is off when it isn't set
+#   PROFILE_SECRET          value of X-Profile that triggers a profile, the header is ignored when it isn't set
+#   PROFILE_SAMPLE_RATE     fraction of requests profiled without the header, 0 by default
+#   PROFILE_MAX_FILES       100 by default
+#   PROFILE_INTERVAL        seconds between samples, 0.005 by default
+#   PROFILE_MAX_OVERHEAD    0.05 by default
+#   PROFILE_MAX_CONCURRENT  2 by default
+
+import hmac
+import itertools
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from time import perf_counter
+from typing import Optional
+
+import anyio
+
+PROFILE_HEADER = b'x-profile'
+PROFILE_FILE_HEADER = b'x-profile-file'
+
+
+def _code_of(call) -> Optional[object]:
+    # functions, methods and classes used as dependencies (dependences_as_classes.py)
+    if isinstance(call, type):
+        call = call.__init__
+    elif not hasattr(call, '__code__') and hasattr(call, '__call__'):
+        call = call.__call__
+    return getattr(call, '__code__', None)
+
+
+def _route_codes(route) -> frozenset:
+    codes = set()
+    dependants = [getattr(route, 'dependant', None)]
+    while dependants:
+        dependant = dependants.pop()
+        if dependant is None:
+            continue
+        code = _code_of(dependant.call)
+        if code is not None:
+            codes.add(code)
+        dependants.extend(dependant.dependencies)
+    return frozenset(codes)
+
+
+def _label(code) -> str:
+    # ; separates the frames and the count follows the last space in the collapsed format
+    return f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})'.replace(';', ':')
+
+
+class Profile:
+    __slots__ = ('scope', 'marker', 'stacks', 'samples', 'started', '_codes')
+
+    def __init__(self, scope, marker):
+        self.scope = scope
+        self.marker = marker  # frame of ProfilingMiddleware.__call__ for this request
+        self.stacks = Counter()
+        self.samples = 0
+        self.started = perf_counter()
+        self._codes = None
+
+    def route_codes(self) -> frozenset:
+        if self._codes is None:
+            route = self.scope.get('route')
+            if route is None:  # not routed yet
+                return frozenset()
+            self._codes = _route_codes(route)
+        return self._codes
+
+    def collapsed(self) -> str:
+        return ''.join(f'{stack} {count}\n' for stack, count in self.stacks.most_common())
+
+
+class Sampler:
+    """ one background thread sampling the stacks for all profiled requests, it only runs while there are some"""
+
+    def __init__(self, interval: float = 0.005, max_overhead: float = 0.05):
+        self.interval = interval
+        self.max_overhead = max_overhead
+        self.current_interval = interval
+        self._profiles = {}  # marker frame -> Profile, replaced on change so the sampler reads it without locking
+        self._lock = threading.Lock()
+        self._active = threading.Event()
+        self._thread = None
+
+    def __len__(self):
+        return len(self._profiles)
+
+    def add(self, profile: Profile):
+        with self._lock:
+            self._profiles = {**self._profiles, profile.marker: profile}
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='request-profiler', daemon=True)
+                self._thread.start()
+            self._active.set()
+
+    def remove(self, profile: Profile):
+        with self._lock:
+            self._profiles = {marker: p for marker, p in self._profiles.items() if p is not profile}
+            if not self._profiles:
+                self._active.clear()
+
+    def _run(self):
+        while True:
+            self._active.wait()
+            start = perf_counter()
+            self.sample()
+            cost = perf_counter() - start
+            # keep cost / interval under the budget, smoothed so one slow pass doesn't stall sampling
+            target = max(self.interval, cost / self.max_overhead)
+            self.current_interval = 0.8 * self.current_interval + 0.2 * target
+            time.sleep(self.current_interval)
+
+    def sample(self):
+        profiles = self._profiles
+        if not profiles:
+            return
+        own = threading.get_ident()
+        for thread_id, frame in sys._current_frames().items():
+            if thread_id == own:
+                continue
+            codes = []
+            owner = None
+            while frame is not None:
+                owner = profiles.get(frame)
+                if owner is not None:
+                    break
+                codes.append(frame.f_code)
+                frame = frame.f_back
+            if owner is None:
+                self._sample_thread(profiles, codes)
+                continue
+            if codes:  # nothing above the middleware means the request is suspended
+                owner.stacks[';'.join(_label(code) for code in reversed(codes))] += 1
+                owner.samples += 1
+
+    @staticmethod
+    def _sample_thread(profiles, codes):
+        # codes run from the top of the stack to the bottom, idle threads never run route code and are skipped
+        for profile in profiles.values():
+            route_codes = profile.route_codes()
+            if not route_codes:
+                continue
+            for depth in range(len(codes) - 1, -1, -1):  # from the bottom, keeps the outermost route frame
+                if codes[depth] in route_codes:
+                    stack = ';'.join(_label(code) for code in reversed(codes[:depth + 1]))
+                    profile.stacks['threadpool;' + stack] += 1
+                    profile.samples += 1
+                    return
+
+
+class ProfilingMiddleware:
+    """ pure ASGI middleware profiling the requests picked by the trigger header or the sample rate"""
+
+    def __init__(
+            self,
+            app,
+            directory: str,
+            secret: Optional[str] = None,
+            sample_rate: float = 0.0,
+            interval: float = 0.005,
+            max_overhead: float = 0.05,
+            max_concurrent: int = 2,
+            max_files: int = 100,
+    ):
+        self.app = app
+        self.directory = directory
+        self.secret = secret.encode() if secret else None
+        self.sample_rate = sample_rate
+        self.max_concurrent = max_concurrent
+        self.sampler = Sampler(interval, max_overhead)
+        self._ids = itertools.count(1)
+        self._files = deque()  # names of the profiles written, oldest first
+        self._files_lock = threading.Lock()  # written from worker threads
+        self.max_files = max_files
+        os.makedirs(directory, exist_ok=True)
+
+    def _triggered(self, scope) -> bool:
+        if self.secret is None:
+            return False
+        for name, value in scope['headers']:
+            if name == PROFILE_HEADER:
+                return hmac.compare_digest(value, self.secret)  # the time doesn't tell how much of a guess was right
+        return False
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or len(self.sampler) >= self.max_concurrent:
+            await self.app(scope, receive, send)
+            return
+        triggered = self._triggered(scope)
+        if not triggered and not (self.sample_rate > 0 and random.random() < self.sample_rate):
+            await self.app(scope, receive, send)
+            return
+        profile = Profile(scope, sys._getframe())
+        name = self._file_name(scope)
+
+        async def send_with_profile_name(message):
+            if message['type'] == 'http.response.start':
+                message = {**message, 'headers': [*message.get('headers', ()), (PROFILE_FILE_HEADER, name.encode())]}
+            await send(message)
+
+        self.sampler.add(profile)
+        try:
+            # only the client holding the secret learns where its profile is
+            await self.app(scope, receive, send_with_profile_name if triggered else send)
+        finally:
+            self.sampler.remove(profile)
+            await anyio.to_thread.run_sync(self._write, name, profile)  # blocking disk i/o, off the event loop
+
+    def _file_name(self, scope) -> str:
+        path = re.sub(r'[^A-Za-z0-9_.-]+', '_', scope['path']).strip('_') or 'root'
+        return f'{time.strftime("%Y%m%dT%H%M%S")}-{next(self._ids)}-{scope["method"]}-{path[:80]}.folded'
+
+    def _write(self, name: str, profile: Profile):
+        with open(os.path.join(self.directory, name), 'w') as f:
+            f.write(profile.collapsed())
+        with self._files_lock:
+            self._files.append(name)
+            expired = [self._files.popleft() for _ in range(len(self._files) - self.max_files)]
+        for old in expired:
+            try:
+                os.remove(os.path.join(self.directory, old))
+            except FileNotFoundError:  # removed by someone else
+                pass
+
+
+def add_profiling_from_env(app):
+    """ adds ProfilingMiddleware to app when PROFILE_DIR is set"""
+    directory = os.getenv('PROFILE_DIR')
+    if not directory:
+        return
+    app.add_middleware(
+        ProfilingMiddleware,
+        directory=directory,
+        secret=os.getenv('PROFILE_SECRET'),
+        sample_rate=float(os.getenv('PROFILE_SAMPLE_RATE', '0')),
+        interval=float(os.getenv('PROFILE_INTERVAL', '0.005')),
+        max_overhead=float(os.getenv('PROFILE_MAX_OVERHEAD', '0.05')),
+        max_concurrent=int(os.getenv('PROFILE_MAX_CONCURRENT', '2')),
+        max_files=int(os.getenv('PROFILE_MAX_FILES', '100')),
+    )
@@ -0,0 +1,237 @@
+# token bucket rate limiting
+# every key (a client IP, user or API key) has a bucket of burst tokens refilled at rate tokens per second, a
+# request takes one, a request finding the bucket empty is answered 429 with Retry-After, the seconds until a token
+# is back
+#
+# backends
+#   memory - buckets of this process (default), each worker limits on its own
+#   redis  - buckets shared by all the workers, updated by a Lua script in one round trip, with redis' clock
+#            (redis.asyncio.Redis, or fakeredis.aioredis.FakeRedis in tests, which needs lupa for scripts)
+# picked with RATE_LIMIT_BACKEND and RATE_LIMIT_REDIS_URL
+#
+# the memory buckets are kept in shards, dicts of key -> [tokens, updated_at, full_at], only touched from the
+# event loop so no lock is taken; every RATE_LIMIT_SWEEP_EVERY hits one shard is swept of the buckets that have
+# refilled, a full bucket is the same as no bucket, so memory follows the number of active clients
+#
+# use it per path operation:
+#   login_limiter = RateLimiter(rate=1, burst=10)
+#   @app.post('/token', dependencies=[Depends(RateLimit(login_limiter, key=by_ip))])
+# or for a whole app:
+#   app.add_middleware(RateLimitMiddleware, limiter=RateLimiter(rate=50, burst=100), key=by_ip)
+
+import hashlib
+import math
+import os
+import time
+from typing import Awaitable, Callable, Iterable, List, NamedTuple, Optional, Union
+
+from fastapi import HTTPException, Request
+from starlette import status
+from starlette.responses import JSONResponse
+
+RATE_LIMIT_SHARDS = int(os.getenv('RATE_LIMIT_SHARDS', '16'))
+RATE_LIMIT_SWEEP_EVERY = int(os.getenv('RATE_LIMIT_SWEEP_EVERY', '1024'))
+
+
+class Decision(NamedTuple):
+    allowed: bool
+    retry_after: float  # seconds until the request would be allowed, 0 when it is
+    remaining: float  # tokens left in the bucket
+
+
+class MemoryBackend:
+    def __init__(self, shards: int = RATE_LIMIT_SHARDS, sweep_every: int = RATE_LIMIT_SWEEP_EVERY):
+        self._shards: List[dict] = [{} for _ in range(shards)]
+        self._sweep_every = sweep_every
+        self._hits = 0
+        self._next_sweep = 0  # index of the next shard to sweep
+
+    def __len__(self):
+        return sum(len(shard) for shard in self._shards)
+
+    def take(self, key: str, rate: float, burst: float, cost: float = 1, now: Optional[float] = None) -> Decision:
+        now = time.monotonic() if now is None else now
+        shard = self._shards[hash(key) % len(self._shards)]
+        bucket = shard.get(key)
+        if bucket is None:
+            bucket = shard[key] = [burst, now, now]
+            tokens = burst
+        else:
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+        allowed = tokens >= cost
+        if allowed:
+            tokens -= cost
+        bucket[0], bucket[1], bucket[2] = tokens, now, now + (burst - tokens) / rate  # when it is full again
+        self._hits += 1
+        if self._hits % self._sweep_every == 0:
+            self.sweep(now)  # after the update, the bucket taken from is not swept with its old state
+        if allowed:
+            return Decision(True, 0.0, tokens)
+        return Decision(False, (cost - tokens) / rate, tokens)
+
+    def sweep(self, now: float):
+        """ drops the buckets of one shard that are full by now"""
+        shard = self._shards[self._next_sweep]
+        self._next_sweep = (self._next_sweep + 1) % len(self._shards)
+        for key in [key for key, bucket in shard.items() if bucket[2] <= now]:
+            del shard[key]
+
+    async def hit(self, key: str, rate: float, burst: float, cost: float = 1) -> Decision:
+        return self.take(key, rate, burst, cost)
+
+
+# KEYS[1] the bucket, ARGV rate, burst, cost
+TOKEN_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+now = tonumber(now[1]) + tonumber(now[2]) / 1000000
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated_at')
+local tokens = tonumber(state[1])
+if tokens == nil then
+    tokens = burst
+else
+    tokens = math.min(burst, tokens + math.max(0, now - tonumber(state[2])) * rate)
+end
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated_at', tostring(now))
+-- the bucket is full again after burst / rate seconds, it can go
+redis.call('PEXPIRE', KEYS[1], math.ceil(burst / rate * 1000) + 1000)
+return {allowed, tostring(retry_after), tostring(tokens)}
+"""
+
+
+class RedisBackend:
+    # numbers go through the script as strings, redis would truncate lua floats to integers
+    def __init__(self, client, prefix: str = 'rate_limit:'):
+        self.client = client
+        self.prefix = prefix
+        self._script = client.register_script(TOKEN_BUCKET_SCRIPT)
+
+    async def hit(self, key: str, rate: float, burst: float, cost: float = 1) -> Decision:
+        allowed, retry_after, remaining = await self._script(keys=[self.prefix + key], args=[rate, burst, cost])
+        return Decision(bool(allowed), float(retry_after), float(remaining))
+
+
+def backend_from_env():
+    backend = os.getenv('RATE_LIMIT_BACKEND', 'memory')
+    if backend == 'memory':
+        return MemoryBackend()
+    if backend == 'redis':
+        import redis.asyncio  # only needed for this backend
+        return RedisBackend(redis.asyncio.Redis.from_url(os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost:6379/0')))
+    raise ValueError(f'RATE_LIMIT_BACKEND must be memory or redis, got {backend!r}')
+
+
+class RateLimited(HTTPException):
+    def __init__(self, retry_after: float):
+        super().__init__(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail='Too Many Requests',
+            headers={'Retry-After': str(max(1, math.ceil(retry_after)))},  # whole seconds
+        )
+
+
+class RateLimiter:
+    """ rate tokens per second and burst at most, per key"""
+
+    def __init__(self, rate: float, burst: float, backend=None, name: str = ''):
+        if rate <= 0 or burst < 1:
+            raise ValueError('rate must be > 0 and burst >= 1')
+        self.rate = rate
+        self.burst = burst
+        self.name = name  # prefix of the keys, limiters sharing a backend don't share buckets
+        self.backend = backend if backend is not None else backend_from_env()
+
+    async def hit(self, key: str, cost: float = 1) -> Decision:
+        return await self.backend.hit(f'{self.name}:{key}', self.rate, self.burst, cost)
+
+    async def check(self, key: str, cost: float = 1):
+        """ raises RateLimited when key is over the limit"""
+        decision = await self.hit(key, cost)
+        if not decision.allowed:
+            raise RateLimited(decision.retry_after)
+
+
+# key functions, from the request to the key of its bucket, None when the request is not limited
+KeyFunction = Callable[[Request], Union[Optional[str], Awaitable[Optional[str]]]]
+
+
+def by_ip(request: Request) -> Optional[str]:
+    # behind a proxy run uvicorn with --proxy-headers so the client is the one of X-Forwarded-For
+    return f'ip:{request.client.host}' if request.client else None
+
+
+def by_header(name: str) -> KeyFunction:
+    """ the value of a header, hashed so secrets (API keys) are not kept in the buckets' keys"""
+    def key(request: Request) -> Optional[str]:
+        value = request.headers.get(name)
+        if value is None:
+            return by_ip(request)
+        return f'{name}:{hashlib.sha256(value.encode()).hexdigest()[:32]}'
+    return key
+
+
+by_api_key = by_header('x-key')
+
+
+def by_user(request: Request) -> Optional[str]:
+    """ the user authenticated by starlette's AuthenticationMiddleware, the IP for anonymous requests"""
+    user = request.scope.get('user')
+    if user is not None and getattr(user, 'is_authenticated', False):
+        return f'user:{user.identity}'
+    return by_ip(request)
+
+
+async def _key(key: KeyFunction, request: Request) -> Optional[str]:
+    value = key(request)
+    if value is not None and not isinstance(value, str):
+        value = await value
+    return value
+
+
+class RateLimit:
+    """ dependency answering 429 when the key of the request is over the limit"""
+
+    def __init__(self, limiter: RateLimiter, key: KeyFunction = by_ip, cost: float = 1):
+        self.limiter = limiter
+        self.key = key
+        self.cost = cost
+
+    async def __call__(self, request: Request):
+        key = await _key(self.key, request)
+        if key is not None:
+            await self.limiter.check(key, self.cost)
+
+
+class RateLimitMiddleware:
+    """ limits every http request of the app, or those under the given path prefixes"""
+
+    def __init__(self, app, limiter: RateLimiter, key: KeyFunction = by_ip, paths: Optional[Iterable[str]] = None):
+        self.app = app
+        self.limiter = limiter
+        self.key = key
+        self.paths = tuple(paths) if paths is not None else None
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http' or (self.paths is not None and not scope['path'].startswith(self.paths)):
+            await self.app(scope, receive, send)
+            return
+        key = await _key(self.key, Request(scope))
+        if key is not None:
+            decision = await self.limiter.hit(key)
+            if not decision.allowed:
+                limited = RateLimited(decision.retry_after)
+                response = JSONResponse({'detail': limited.detail}, status_code=limited.status_code,
+                                        headers=limited.headers)
+                await response(scope, receive, send)
+                return
+        await self.app(scope, receive, send)
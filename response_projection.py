@@ -0,0 +1,251 @@
+# compiled response_model projection
+# FastAPI turns a returned model into a dict, validates the dict into a new response_model instance and walks that
+# with jsonable_encoder to apply include/exclude/exclude_unset..., for every response
+# when the returned object is an instance of the response model, or of a model with the same fields
+# (UserIn for UserOut), the validation can't fail and can't change a value, only picking the fields is left
+#
+# ResponseProjection compiles, once per route and returned model class, the list of fields to copy with the
+# route's options applied, and projects the instance with it
+# returned dicts are validated as FastAPI validates them, with pydantic's validate_model, only the instance of the
+# response model and the walk of its .dict() are skipped
+# models it can't prove compatible (a field missing or typed differently, validators on the response model, json
+# encoders, extra=forbid ...), dicts for models with json encoders or extra=allow and other objects (ORM objects)
+# return NOT_PROJECTED and take the validating path
+
+from typing import Any, Callable, Dict, Optional
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.routing import _prepare_response_content
+from pydantic import BaseModel, Extra, validate_model
+from pydantic.fields import SHAPE_LIST, SHAPE_SINGLETON
+
+NOT_PROJECTED = object()
+_REQUIRED = object()
+
+
+class _NotProjectable(Exception):
+    pass
+
+
+def to_builtin(value: Any, **options) -> Any:
+    """ what jsonable_encoder(value, **options) returns, without converting the leaves that the encoders handle"""
+    if isinstance(value, BaseModel):
+        if value.__config__.json_encoders:  # custom encoders only jsonable_encoder knows
+            return jsonable_encoder(value, **options)
+        return value.dict(**options)
+    if isinstance(value, (list, tuple)):
+        return [to_builtin(item, **options) for item in value]
+    if isinstance(value, dict):
+        include, exclude = options.get('include'), options.get('exclude')
+        if include is None and exclude is None:
+            return {key: to_builtin(item, **options) for key, item in value.items()}
+        keys = set(value) & set(include) if include is not None else set(value)
+        keys -= set(exclude or ())
+        return {key: to_builtin(item, **options) for key, item in value.items() if key in keys}
+    return value
+
+
+def _has_validators(field) -> bool:
+    return bool(field.class_validators or field.pre_validators or field.post_validators)
+
+
+def _exactly(value: Any, model) -> bool:
+    # validation would rebuild a nested instance of a subclass as model and drop the fields model doesn't have
+    if isinstance(value, BaseModel):
+        return type(value) is model
+    if isinstance(value, (list, tuple, set, frozenset)):
+        return all(_exactly(item, model) for item in value)
+    if isinstance(value, dict):
+        return all(_exactly(item, model) for item in value.values())
+    return True
+
+
+def _default_valid(field) -> bool:
+    # defaults are not validated when an instance is created, an unset field holds the default as written
+    if field.required or field.default_factory is not None:
+        return True
+    value, errors = field.validate(field.default, {}, loc='default')
+    return not errors and value == field.default
+
+
+def compatible(target, source) -> bool:
+    """ True when every instance of source validates into target with the same field values"""
+    if not (isinstance(source, type) and issubclass(source, BaseModel)):
+        return False
+    config = target.__config__
+    if target.__pre_root_validators__ or target.__post_root_validators__ or config.json_encoders:
+        return False
+    if config.extra == Extra.forbid and set(source.__fields__) - set(target.__fields__):
+        return False
+    for name, field in target.__fields__.items():
+        source_field = source.__fields__.get(name)
+        if source_field is None or _has_validators(field):
+            return False
+        if source_field is field:  # the same class or an inherited field
+            continue
+        if (
+                source_field.outer_type_ != field.outer_type_
+                or source_field.alias != field.alias
+                or source_field.allow_none != field.allow_none
+                or source_field.required != field.required
+                or source_field.default != field.default
+                or source_field.default_factory is not field.default_factory
+        ):
+            return False
+    return True
+
+
+def compile_projector(
+        target,
+        source,
+        include=None,
+        exclude=None,
+        by_alias: bool = True,
+        exclude_unset: bool = False,
+        exclude_defaults: bool = False,
+        exclude_none: bool = False,
+) -> Optional[Callable[[BaseModel], dict]]:
+    """ a function projecting instances of source as the response model target, None if it can't be done"""
+    # include/exclude given as dicts reach into nested models, only field sets are compiled
+    if not isinstance(include, (set, frozenset, type(None))) or not isinstance(exclude, (set, frozenset, type(None))):
+        return None
+    if not compatible(target, source):
+        return None
+    fields = [
+        (
+            name,
+            field.alias if by_alias else name,
+            # what pydantic compares with for exclude_defaults, required fields are never excluded
+            _REQUIRED if field.required else field.default,
+            field.type_ if isinstance(field.type_, type) and issubclass(field.type_, BaseModel) else None,
+            _default_valid(field),
+            field.default_factory is not None,
+        )
+        for name, field in target.__fields__.items()
+        if (include is None or name in include) and (exclude is None or name not in exclude)
+    ]
+    nested_options = dict(
+        by_alias=by_alias, exclude_unset=exclude_unset, exclude_defaults=exclude_defaults, exclude_none=exclude_none
+    )
+
+    def project(instance: BaseModel) -> dict:
+        values = instance.__dict__
+        fields_set = instance.__fields_set__
+        result = {}
+        for name, key, default, nested_model, default_valid, factory in fields:
+            if name not in fields_set:
+                if exclude_unset:
+                    continue
+                if not default_valid:  # validation of the response fails, let it report it
+                    raise _NotProjectable(name)
+            value = values[name]
+            if exclude_none and value is None or exclude_defaults and value == default:
+                # FastAPI drops it before validating, the validation sets the default again, which is then
+                # excluded again unless it is a different value
+                if exclude_unset:
+                    continue
+                if default is _REQUIRED or factory:
+                    raise _NotProjectable(name)
+                if default is None or exclude_defaults:
+                    continue
+                value = default
+            if nested_model is not None and not _exactly(value, nested_model):
+                raise _NotProjectable(name)
+            if isinstance(value, (BaseModel, list, tuple, dict)):
+                value = to_builtin(value, **nested_options)
+            result[key] = value
+        return result
+
+    return project
+
+
+def compile_dict_projector(
+        target,
+        include=None,
+        exclude=None,
+        by_alias: bool = True,
+        exclude_unset: bool = False,
+        exclude_defaults: bool = False,
+        exclude_none: bool = False,
+) -> Optional[Callable[[dict], dict]]:
+    """ a function projecting dicts as the response model target, None if it can't be done"""
+    if not isinstance(include, (set, frozenset, type(None))) or not isinstance(exclude, (set, frozenset, type(None))):
+        return None
+    config = target.__config__
+    # extra keys would be in .dict() of the instance, json encoders only apply through jsonable_encoder
+    if config.extra == Extra.allow or config.json_encoders or target.__custom_root_type__:
+        return None
+    fields = [
+        (name, field.alias if by_alias else name, field.default)  # .dict() compares with field.default
+        for name, field in target.__fields__.items()
+        if (include is None or name in include) and (exclude is None or name not in exclude)
+    ]
+    nested_options = dict(
+        by_alias=by_alias, exclude_unset=exclude_unset, exclude_defaults=exclude_defaults, exclude_none=exclude_none
+    )
+
+    def project(content: dict) -> dict:
+        # as FastAPI, models in the dict are turned into dicts first, the keys of the dict itself are all kept
+        content = _prepare_response_content(
+            content, exclude_unset=exclude_unset, exclude_defaults=exclude_defaults, exclude_none=exclude_none
+        )
+        values, fields_set, errors = validate_model(target, content)
+        if errors is not None:  # the validating path reports them
+            raise _NotProjectable()
+        result = {}
+        for name, key, default in fields:
+            if exclude_unset and name not in fields_set:
+                continue
+            value = values[name]
+            if exclude_none and value is None or exclude_defaults and value == default:
+                continue
+            if isinstance(value, (BaseModel, list, tuple, dict)):
+                value = to_builtin(value, **nested_options)
+            result[key] = value
+        return result
+
+    return project
+
+
+class ResponseProjection:
+    """ projects the return values of one route, the compiled projectors are kept by returned class"""
+
+    def __init__(self, field, **options):
+        self.options = options
+        self.shape = field.shape
+        target = field.type_
+        self.target = target if isinstance(target, type) and issubclass(target, BaseModel) else None
+        self._projectors: Dict[type, Optional[Callable]] = {}
+
+    def _projector(self, source: type) -> Optional[Callable]:
+        try:
+            return self._projectors[source]
+        except KeyError:
+            if source is dict:
+                projector = compile_dict_projector(self.target, **self.options)
+            else:
+                projector = compile_projector(self.target, source, **self.options)
+            self._projectors[source] = projector
+            return projector
+
+    def project(self, content: Any) -> Any:
+        if self.target is None:
+            return NOT_PROJECTED
+        try:
+            return self._project(content)
+        except _NotProjectable:
+            return NOT_PROJECTED
+
+    def _project(self, content: Any) -> Any:
+        if self.shape == SHAPE_SINGLETON:
+            projector = self._projector(type(content))
+            return NOT_PROJECTED if projector is None else projector(content)
+        if self.shape == SHAPE_LIST and isinstance(content, list):
+            result = []
+            for item in content:
+                projector = self._projector(type(item))
+                if projector is None:
+                    return NOT_PROJECTED
+                result.append(projector(item))
+            return result
+        return NOT_PROJECTED
@@ -6,19 +6,29 @@
 
 # to get a sting run
 # openssl rand -hex 32
+import os
 from datetime import timedelta, datetime
 from typing import Optional
 
 from fastapi import FastAPI, Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from jose import jwt, JWTError
 from pydantic import BaseModel
-from passlib.context import CryptContext
 from starlette import status
 
+import auth_cache
+import jwt_signing
+import passwords
+from rate_limit import RateLimit, RateLimiter, by_ip
+
 SECRET_KEY = 'f9739e470ee4d039995f7b5fd7789816fdbbb3d93b1b3bbe3c7cac11c3df1f55'
-ALGORITHM = 'HS256'
+# HS256 signs with SECRET_KEY, EdDSA and ES256 with a key pair generated at startup, see jwt_signing.py
+ALGORITHM = os.getenv('JWT_ALGORITHM', 'HS256')
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
+TOKEN_CACHE_SIZE = 10000  # verified tokens remembered by get_current_user
+USER_CACHE_SIZE = 10000
+# logins per client IP, every attempt costs a password hash, one client can't take all the CPU with them
+LOGIN_RATE = float(os.getenv('LOGIN_RATE', '1'))  # per second
+LOGIN_BURST = int(os.getenv('LOGIN_BURST', '10'))
 
 fake_users_db = {
     "johndoe": {
@@ -52,11 +62,25 @@ class UserInDb(User):
     hashed_password: str
 
 
-pwd_context = CryptContext(schemes=['bcrypt'], deprecated='auto')
+pwd_context = passwords.pwd_context  # bcrypt or argon2, configured in passwords.py
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl='token')
 
 security_jwt_app = FastAPI()
 
+# tokens are signed with the current key of the keyring and verified with the key named by their kid header
+keyring = jwt_signing.KeyRing(jwt_signing.signer_for(ALGORITHM, SECRET_KEY, kid='default'))
+
+
+# new tokens are signed with a new key, tokens signed with the previous keys stay valid until they expire
+def rotate_signing_key(algorithm: str = ALGORITHM):
+    return keyring.rotate(jwt_signing.signer_for(algorithm))
+
+
+# tokens signed with a retired key are rejected, including the ones already in the token cache
+def retire_signing_key(kid: str):
+    keyring.retire(kid)
+    token_cache.clear()
+
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -72,12 +96,38 @@ def get_user(db, username: str):
         return UserInDb(**user_dict)
 
 
-def authenticate_user(fake_db, username: str, password: str):
+# see auth_cache.py
+token_cache = auth_cache.TokenCache(TOKEN_CACHE_SIZE)
+user_cache = auth_cache.UserCache(USER_CACHE_SIZE)
+
+
+def get_cached_user(db, username: str):
+    user = user_cache.get(username)
+    if user is None:
+        user = get_user(db, username)
+        if user is not None:
+            user_cache.set(username, user)
+    return user  # shared between requests, don't modify it
+
+
+# call it whenever the stored record of a user changes
+def invalidate_user(username: str):
+    user_cache.invalidate(username)
+
+
+# verification runs in a worker pool (see passwords.py) so the event loop is not blocked for the duration of the hash
+async def authenticate_user(fake_db, username: str, password: str):
     user = get_user(fake_db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    verified, new_hash = await passwords.verify_and_update_async(password, user.hashed_password)
+    if not verified:
         return False
+    if new_hash:
+        # the hash was made with an older scheme or cost factor, store it again with the current parameters
+        fake_db[username]['hashed_password'] = new_hash
+        user.hashed_password = new_hash
+        invalidate_user(username)
     return user
 
 
@@ -89,26 +139,31 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     else:
         expire = datetime.utcnow() + timedelta(minutes=15)
     to_encode.update({'exp': expire})
-    encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
+    encoded_jwt = keyring.encode(to_encode)
     return encoded_jwt
 
 
-def get_current_user(token: str = Depends(oauth2_scheme)):
+# async def: with the caches it is cheap enough for the event loop and saves a hop to the threadpool per request
+async def get_current_user(token: str = Depends(oauth2_scheme)):
     """ decode token verify it and return current user"""
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail='could not validate credentials',
         headers={'WWW-Authenticate': 'Bearer'}
     )
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        username: str = payload.get('sub')
-        if username is None:
+    username = token_cache.get(token)  # the signature of a cached token was already verified
+    if username is None:
+        try:
+            payload = keyring.decode(token)
+            username: str = payload.get('sub')
+            if username is None:
+                raise credentials_exception
+            token_data = TokenData(username=username)
+        except jwt_signing.InvalidTokenError:
             raise credentials_exception
-        token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = get_user(fake_users_db, username=token_data.username)
+        username = token_data.username
+        token_cache.set(token, username, payload.get('exp'))
+    user = get_cached_user(fake_users_db, username=username)
     if user is None:
         raise credentials_exception
     return user
@@ -128,9 +183,13 @@ async def get_current_active_user(current_user: User = Depends(get_current_user)
 # Content-Type: application/x-www-form-urlencoded
 #
 # username=johndoe&password=secret
-@security_jwt_app.post('/token', response_model=Token)
+# token buckets per client IP, 429 with Retry-After once the burst is spent, see rate_limit.py
+login_limiter = RateLimiter(rate=LOGIN_RATE, burst=LOGIN_BURST, name='login')
+
+
+@security_jwt_app.post('/token', response_model=Token, dependencies=[Depends(RateLimit(login_limiter, key=by_ip))])
 async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(OAuth2PasswordRequestForm)):
-    user = authenticate_user(fake_users_db, form_data.username, form_data.password)
+    user = await authenticate_user(fake_users_db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -159,3 +218,10 @@ async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(
 @security_jwt_app.get('/users/me/items')
 async def read_own_items(current_user: User = Depends(get_current_active_user)):
     return [{'item_id': 'Foo', 'owner': current_user.username}]
+
+
+# public keys of the keyring, for services that verify tokens without sharing a secret
+# (empty with HS256, symmetric keys are never published)
+@security_jwt_app.get('/.well-known/jwks.json')
+async def read_jwks():
+    return keyring.jwks()
@@ -0,0 +1,37 @@
+import importlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+USERS = 5
+ITEMS_PER_USER = 4
+
+
+@pytest.fixture(params=['sync', 'async'])
+def database_app(request, tmp_path, monkeypatch):
+    """ database_app imported in the mode of the test, on a fresh database, with users and their items"""
+    monkeypatch.setenv('DATABASE_MODE', request.param)
+    monkeypatch.setenv('DATABASE_URL', f'sqlite:///{tmp_path}/db_app.db')
+    monkeypatch.setenv('ASYNC_DATABASE_URL', f'sqlite+aiosqlite:///{tmp_path}/db_app.db')
+    monkeypatch.setenv('CACHE_BACKEND', 'none')  # every lookup goes to the database
+    monkeypatch.setenv('BCRYPT_ROUNDS', '4')
+    # the mode and the engines are picked when the modules are imported
+    for name in [name for name in sys.modules if name == 'database_app' or name.startswith('database_app.')]:
+        monkeypatch.delitem(sys.modules, name)
+    main = importlib.import_module('database_app.main')
+    engine = main.async_engine if request.param == 'async' else main.engine
+    with TestClient(main.app) as client:
+        user_ids = []
+        for n in range(USERS):
+            user = client.post('/users/', json={'email': f'user{n}@example.com', 'password': 'secret'}).json()
+            user_ids.append(user['id'])
+            response = client.post(f'/users/{user["id"]}/items/bulk', json=[
+                {'title': f'item {n}.{i}'} for i in range(ITEMS_PER_USER)
+            ])
+            assert response.status_code == 200
+        yield client, engine, user_ids
+    if request.param == 'async':
+        import asyncio
+        asyncio.run(main.async_engine.dispose())
+    main.engine.dispose()
@@ -0,0 +1,50 @@
+import json
+
+from api_keys import ApiKeyStore, NegativeCache, digest
+
+SEED = {'token': ['the-token'], 'key': ['the-key']}
+
+
+def test_verify_checks_the_key_and_its_scope():
+    store = ApiKeyStore(seed=SEED)
+    assert store.verify('the-token', 'token').scopes == {'token'}
+    assert store.verify('the-token', 'key') is None
+    assert store.verify('wrong', 'token') is None
+    assert store.stats.as_dict()['accepted'] == 1
+    assert store.stats.as_dict()['rejected'] == 2
+
+
+def test_the_negative_cache_is_off_by_default():
+    store = ApiKeyStore(seed=SEED)
+    for _ in range(3):
+        assert store.verify('wrong', 'token') is None
+    assert store.stats.negative_hits == 0
+    assert len(store.negative._entries) == 0
+
+
+def test_the_negative_cache_keeps_digests_not_keys():
+    store = ApiKeyStore(seed=SEED, negative_cache=NegativeCache(maxsize=10))
+    for _ in range(3):
+        assert store.verify('wrong', 'token') is None
+    assert store.stats.negative_hits == 2
+    assert list(store.negative._entries) == [('token', digest('wrong'))]
+
+
+def test_the_negative_cache_drops_the_least_recent_and_expired():
+    cache = NegativeCache(maxsize=2, ttl=60)
+    for key in ('a', 'b', 'c'):
+        cache.add(('token', digest(key)))
+    assert ('token', digest('a')) not in cache
+    assert ('token', digest('c')) in cache
+    expired = NegativeCache(maxsize=2, ttl=0)
+    expired.add(('token', digest('a')))
+    assert ('token', digest('a')) not in expired
+
+
+def test_a_reload_forgets_the_keys_that_failed(tmp_path):
+    path = tmp_path / 'keys.json'
+    path.write_text(json.dumps({'keys': []}))
+    store = ApiKeyStore(path=str(path), reload_interval=0, negative_cache=NegativeCache(maxsize=10))
+    assert store.verify('new-key', 'token') is None
+    path.write_text(json.dumps({'keys': [{'name': 'ci', 'scopes': ['token'], 'sha256': digest('new-key').hex()}]}))
+    assert store.verify('new-key', 'token').name == 'ci'
@@ -0,0 +1,101 @@
+import threading
+
+import pytest
+from fastapi.testclient import TestClient
+
+import body_updates
+from versioned_store import VersionConflict, VersionedStore, etag_matches
+
+
+@pytest.fixture
+def client(monkeypatch):
+    monkeypatch.setattr(body_updates, 'items', VersionedStore({
+        'foo': {'name': 'Foo', 'price': 50.2},
+        'bar': {'name': 'Bar', 'description': 'The bartenders', 'price': 62, 'tax': 20.2},
+    }))
+    return TestClient(body_updates.body_updates_app)
+
+
+def test_read_sends_the_etag(client):
+    response = client.get('/items/foo')
+    assert response.headers['etag'] == '"1"'
+    assert response.json()['name'] == 'Foo'
+
+
+def test_put_with_the_current_etag_bumps_the_version(client):
+    response = client.put('/items/foo', json={'name': 'Foo 2', 'price': 1}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['etag'] == '"2"'
+    assert client.get('/items/foo').json()['name'] == 'Foo 2'
+
+
+def test_a_stale_if_match_is_a_412_with_the_current_etag(client):
+    client.put('/items/foo', json={'name': 'someone else'}, headers={'If-Match': '"1"'})
+    for method in (client.put, client.patch):
+        response = method('/items/foo', json={'name': 'mine'}, headers={'If-Match': '"1"'})
+        assert response.status_code == 412
+        assert response.headers['etag'] == '"2"'
+    assert client.get('/items/foo').json()['name'] == 'someone else'
+    assert client.get('/items/foo').headers['etag'] == '"2"'
+
+
+def test_weak_etags_never_match(client):
+    assert client.put('/items/foo', json={'name': 'x'}, headers={'If-Match': 'W/"1"'}).status_code == 412
+    assert client.put('/items/foo', json={'name': 'x'}, headers={'If-Match': '"0", "1"'}).status_code == 200
+
+
+def test_if_match_star_needs_an_existing_key(client):
+    response = client.put('/items/new', json={'name': 'New'}, headers={'If-Match': '*'})
+    assert response.status_code == 412
+    assert 'etag' not in response.headers
+    assert client.get('/items/new').status_code == 404
+    assert client.put('/items/foo', json={'name': 'Foo'}, headers={'If-Match': '*'}).status_code == 200
+    # without If-Match a PUT creates the key
+    created = client.put('/items/new', json={'name': 'New'})
+    assert created.headers['etag'] == '"1"'
+
+
+def test_patch_merges_the_set_fields_and_bumps_the_version(client):
+    response = client.patch('/items/bar', json={'price': 70, 'tags': ['drinks']}, headers={'If-Match': '"1"'})
+    assert response.status_code == 200
+    assert response.headers['etag'] == '"2"'
+    assert response.json() == {
+        'name': 'Bar', 'description': 'The bartenders', 'price': 70, 'tax': 20.2, 'tags': ['drinks'],
+    }
+    # the defaults of the fields that were not sent are not written over the stored values
+    assert body_updates.items.get('bar') == (
+        {'name': 'Bar', 'description': 'The bartenders', 'price': 70, 'tax': 20.2, 'tags': ['drinks']}, '"2"',
+    )
+    assert client.patch('/items/bar', json={'name': 'Bar 3'}).headers['etag'] == '"3"'
+
+
+def test_patch_of_a_missing_item_is_a_404(client):
+    assert client.patch('/items/missing', json={'name': 'x'}).status_code == 404
+    assert client.patch('/items/missing', json={'name': 'x'}, headers={'If-Match': '*'}).status_code == 404
+
+
+def test_concurrent_patches_are_all_applied():
+    store = VersionedStore({'counter': {}})
+
+    def patch(n: int):
+        store.patch('counter', {f'field{n}': n})
+
+    threads = [threading.Thread(target=patch, args=(n,)) for n in range(50)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    value, etag = store.get('counter')
+    assert etag == '"51"'
+    assert len(value) == 50
+
+
+def test_a_conflict_reports_the_current_etag():
+    store = VersionedStore({'a': {}})
+    with pytest.raises(VersionConflict) as conflict:
+        store.put('a', {}, if_match='"2"')
+    assert conflict.value.etag == '"1"'
+    with pytest.raises(VersionConflict) as conflict:
+        store.put('b', {}, if_match='*')
+    assert conflict.value.etag is None
+    assert not etag_matches('*', None)
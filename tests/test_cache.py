@@ -0,0 +1,90 @@
+import sys
+import time
+
+import pytest
+
+from database_app.cache import LRUCache, NullCache, RedisCache, email_key, user_key
+
+
+def fake_redis():
+    return pytest.importorskip('fakeredis').FakeRedis()
+
+
+@pytest.fixture
+def redis_cache():
+    return RedisCache(fake_redis(), ttl=30)
+
+
+def test_redis_get_set_delete(redis_cache):
+    assert redis_cache.get(user_key(1)) is None
+    redis_cache.set(user_key(1), {'id': 1, 'email': 'a@example.com', 'items': []})
+    redis_cache.set(email_key('a@example.com'), 1)
+    assert redis_cache.get(user_key(1)) == {'id': 1, 'email': 'a@example.com', 'items': []}
+    assert redis_cache.get(email_key('a@example.com')) == 1
+    redis_cache.delete(user_key(1), email_key('a@example.com'))
+    assert redis_cache.get(user_key(1)) is None
+    assert redis_cache.get(email_key('a@example.com')) is None
+    redis_cache.delete()  # nothing to delete, no call to redis
+
+
+def test_redis_keys_are_prefixed_and_json(redis_cache):
+    redis_cache.set(user_key(1), {'id': 1})
+    assert redis_cache.client.get('database_app:user:1') == b'{"id": 1}'
+    other = RedisCache(redis_cache.client, prefix='other:')
+    assert other.get(user_key(1)) is None
+
+
+def test_redis_entries_expire_after_the_ttl(redis_cache):
+    redis_cache.set(user_key(1), {'id': 1})
+    assert 29 <= redis_cache.client.ttl('database_app:user:1') <= 30
+    short = RedisCache(redis_cache.client, ttl=0.2)
+    short.set(user_key(2), {'id': 2})
+    assert redis_cache.client.ttl('database_app:user:2') == 1  # redis expiries are whole seconds, at least 1
+    redis_cache.client.pexpire('database_app:user:2', 1)
+    time.sleep(0.01)
+    assert short.get(user_key(2)) is None
+
+
+def test_redis_stats(redis_cache):
+    redis_cache.get(user_key(1))
+    redis_cache.set(user_key(1), {'id': 1})
+    redis_cache.get(user_key(1))
+    redis_cache.get(user_key(1))
+    assert redis_cache.stats.as_dict() == {'hits': 2, 'misses': 1, 'evictions': 0, 'expirations': 0}
+
+
+def test_memory_cache_evicts_and_expires():
+    cache = LRUCache(maxsize=2, ttl=60)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    cache.get('a')
+    cache.set('c', 3)  # b is the least recently used
+    assert cache.get('b') is None
+    assert cache.get('a') == 1
+    expiring = LRUCache(ttl=0)
+    expiring.set('a', 1)
+    assert expiring.get('a') is None
+    assert cache.stats.evictions == 1
+    assert expiring.stats.expirations == 1
+
+
+def test_null_cache_never_hits():
+    cache = NullCache()
+    cache.set('a', 1)
+    assert cache.get('a') is None
+    assert cache.stats.misses == 1
+
+
+def test_the_app_reads_through_and_invalidates_redis(database_app):
+    client, _, user_ids = database_app
+    main = sys.modules['database_app.main']
+    cache = RedisCache(fake_redis())
+    client.app.dependency_overrides[main.get_cache] = lambda: cache
+    first = client.get(f'/uses/{user_ids[0]}').json()
+    assert client.get(f'/uses/{user_ids[0]}').json() == first
+    assert cache.stats.as_dict()['hits'] == 1
+    # adding an item deletes the cached user, the next read sees the item
+    client.post(f'/users/{user_ids[0]}/items/', json={'title': 'new'})
+    items = client.get(f'/uses/{user_ids[0]}').json()['items']
+    assert len(items) == len(first['items']) + 1
+    assert client.get('/cache/stats').json() == cache.stats.as_dict()
@@ -0,0 +1,109 @@
+import asyncio
+import gzip
+import os
+
+from compression import CompressionMiddleware
+from file_serving import FileInfo, RangeFileResponse
+
+
+def run_asgi(app, headers, extensions=None, path: str = '/') -> list:
+    """ the messages the app sends for a GET"""
+    scope = {
+        'type': 'http', 'method': 'GET', 'path': path, 'raw_path': path.encode(), 'query_string': b'', 'root_path': '',
+        'headers': headers, 'extensions': extensions or {},
+    }
+    messages = []
+
+    async def receive():
+        return {'type': 'http.request', 'body': b'', 'more_body': False}
+
+    async def send(message):
+        messages.append(message)
+
+    asyncio.run(app(scope, receive, send))
+    return messages
+
+
+def file_app(path: str):
+    async def app(scope, receive, send):
+        await RangeFileResponse(FileInfo(path, os.stat(path)))(scope, receive, send)
+    return app
+
+
+def text_file(tmp_path) -> str:
+    path = tmp_path / 'report.json'
+    path.write_bytes(b'{"value": "%s"}' % (b'x' * 4096))
+    return str(path)
+
+
+def body_of(messages) -> bytes:
+    assert all(message['type'] == 'http.response.body' for message in messages[1:])
+    return b''.join(message.get('body', b'') for message in messages[1:])
+
+
+def test_a_compressible_file_sent_with_pathsend_is_compressed(tmp_path):
+    path = text_file(tmp_path)
+    app = CompressionMiddleware(file_app(path), encodings=('gzip',))
+    extensions = {'http.response.pathsend': {}, 'http.response.zerocopysend': {}}
+    messages = run_asgi(app, [(b'accept-encoding', b'gzip')], extensions)
+    assert messages[0]['type'] == 'http.response.start'
+    headers = dict(messages[0]['headers'])
+    assert headers[b'content-encoding'] == b'gzip'
+    assert b'accept-ranges' not in headers
+    with open(path, 'rb') as file:
+        assert gzip.decompress(body_of(messages)) == file.read()
+
+
+def test_a_compressible_file_sent_with_zerocopysend_is_compressed(tmp_path):
+    path = text_file(tmp_path)
+    app = CompressionMiddleware(file_app(path), encodings=('gzip',))
+    messages = run_asgi(app, [(b'accept-encoding', b'gzip')], {'http.response.zerocopysend': {}})
+    assert dict(messages[0]['headers'])[b'content-encoding'] == b'gzip'
+    with open(path, 'rb') as file:
+        assert gzip.decompress(body_of(messages)) == file.read()
+
+
+def test_a_binary_file_is_still_sent_by_the_server(tmp_path):
+    path = tmp_path / 'blob.bin'
+    path.write_bytes(os.urandom(100 * 1024))
+    app = CompressionMiddleware(file_app(str(path)), encodings=('gzip',))
+    messages = run_asgi(app, [(b'accept-encoding', b'gzip, deflate, br')], {'http.response.pathsend': {}})
+    assert [message['type'] for message in messages] == ['http.response.start', 'http.response.pathsend']
+    headers = dict(messages[0]['headers'])
+    assert b'content-encoding' not in headers
+    assert headers[b'accept-ranges'] == b'bytes'
+
+
+def test_sendfile_extensions_are_kept_without_an_encoding(tmp_path):
+    path = text_file(tmp_path)
+    app = CompressionMiddleware(file_app(path), encodings=('gzip',))
+    messages = run_asgi(app, [(b'accept-encoding', b'identity')], {'http.response.pathsend': {}})
+    assert [message['type'] for message in messages] == ['http.response.start', 'http.response.pathsend']
+
+
+def test_start_is_sent_before_a_message_that_is_not_a_body():
+    async def app(scope, receive, send):
+        # as a response using an extension the middleware doesn't know about
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [(b'content-type', b'text/plain')]})
+        await send({'type': 'http.response.unknown'})
+
+    messages = run_asgi(CompressionMiddleware(app, encodings=('gzip',)), [(b'accept-encoding', b'gzip')])
+    assert [message['type'] for message in messages] == ['http.response.start', 'http.response.unknown']
+    assert b'content-encoding' not in dict(messages[0]['headers'])
+
+
+def test_responses_with_the_same_etag_are_not_mixed_up():
+    # versioned_store.py gives the ETag "1" to the first version of every key
+    bodies = {'/a': b'{"a": "%s"}' % (b'a' * 2048), '/b': b'{"b": "%s"}' % (b'b' * 2048)}
+
+    async def app(scope, receive, send):
+        await send({'type': 'http.response.start', 'status': 200, 'headers': [
+            (b'content-type', b'application/json'), (b'etag', b'"1"'),
+        ]})
+        await send({'type': 'http.response.body', 'body': bodies[scope['path']]})
+
+    middleware = CompressionMiddleware(app, encodings=('gzip',))
+    for path, body in [*bodies.items(), *bodies.items()]:  # the second time from the cache
+        messages = run_asgi(middleware, [(b'accept-encoding', b'gzip')], path=path)
+        assert gzip.decompress(body_of(messages)) == body
+    assert middleware.cache.hits == 2
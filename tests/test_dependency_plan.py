@@ -0,0 +1,191 @@
+from contextlib import contextmanager
+from typing import Optional
+
+import pytest
+from fastapi import Body, Depends, FastAPI, Header
+from fastapi.testclient import TestClient
+
+import dependency_plan
+from api_keys import ApiKeyStore
+from dependences_as_classes import dependencies_as_classes_app
+from dependencies_guide import dependencies_guide_app
+from dependencies_path_decorators import dependencies_path_decorators, get_api_keys
+from dependencies_sub import dependencies_sub_app
+from dependency_plan import PlannedRoute, app_scoped, inline
+
+TOKENS = {'X-Token': 'fake-super-secret-token', 'X-Key': 'fake-super-secret-key'}
+
+# app, path, request options; the 4xx ones check the errors report the same names
+REQUESTS = [
+    (dependencies_guide_app, '/items/', {}),
+    (dependencies_guide_app, '/users/', {'params': {'q': 'foo', 'skip': '1', 'limit': '5'}}),
+    (dependencies_guide_app, '/items/', {'params': {'skip': 'one', 'limit': 'x'}}),
+    (dependencies_path_decorators, '/items/', {'headers': TOKENS}),
+    (dependencies_path_decorators, '/items/', {'headers': {**TOKENS, 'X-Token': 'wrong'}}),
+    (dependencies_path_decorators, '/items/', {'headers': {'X-Key': TOKENS['X-Key']}}),
+    (dependencies_path_decorators, '/items/', {}),
+    (dependencies_sub_app, '/items', {'params': {'q': 'foo'}}),
+    (dependencies_sub_app, '/items', {'cookies': {'last_query': 'bar'}}),
+    (dependencies_sub_app, '/items', {}),
+    (dependencies_as_classes_app, '/items', {}),
+    (dependencies_as_classes_app, '/items', {'params': {'q': 'ba', 'skip': '1'}}),
+    (dependencies_as_classes_app, '/items', {'params': {'limit': 'many'}}),
+]
+
+
+def _unused():
+    pass
+
+
+@contextmanager
+def fallback(app: FastAPI):
+    """ requests made meanwhile go through FastAPI's own resolution, as when any override is set"""
+    app.dependency_overrides[_unused] = _unused
+    try:
+        yield
+    finally:
+        app.dependency_overrides.pop(_unused)
+
+
+@pytest.mark.parametrize('app, path, options', REQUESTS)
+def test_planned_and_fastapi_resolution_answer_the_same(app, path, options):
+    assert all(route.plan is not None for route in app.routes if isinstance(route, PlannedRoute))
+    client = TestClient(app)
+    planned = client.get(path, **options)
+    with fallback(app):
+        resolved = client.get(path, **options)
+    assert planned.status_code == resolved.status_code
+    assert planned.json() == resolved.json()
+
+
+def test_the_planned_route_reports_its_timing():
+    client = TestClient(dependencies_guide_app)
+    timing = client.get('/items/').headers['server-timing']
+    assert [entry.split(';')[0].strip() for entry in timing.split(',')] == ['params', 'dependencies', 'handler']
+    with fallback(dependencies_guide_app):
+        assert 'server-timing' not in client.get('/items/').headers
+
+
+def test_app_scoped_is_computed_once():
+    calls = []
+
+    @app_scoped
+    def get_store():
+        calls.append(1)
+        return {'store': len(calls)}
+
+    @app_scoped
+    async def get_client(store: dict = Depends(get_store)):
+        return {'client': store['store']}
+
+    app = FastAPI()
+    app.router.route_class = PlannedRoute
+
+    @app.get('/')
+    async def read(store: dict = Depends(get_store), client: dict = Depends(get_client)):
+        return {**store, **client}
+
+    client = TestClient(app)
+    for _ in range(3):
+        assert client.get('/').json() == {'store': 1, 'client': 1}
+    with fallback(app):
+        assert client.get('/').json() == {'store': 1, 'client': 1}
+    assert len(calls) == 1
+    get_store.cache_clear()
+    get_client.cache_clear()
+    assert client.get('/').json() == {'store': 2, 'client': 2}
+
+
+def test_app_scoped_can_not_depend_on_the_request():
+    @app_scoped
+    def get_token(x_token: str = Header(...)):
+        return x_token
+
+    app = FastAPI()
+    app.router.route_class = PlannedRoute
+    with pytest.raises(ValueError, match='app scoped'):
+        @app.get('/')
+        async def read(token: str = Depends(get_token)):
+            return token
+
+
+def test_overrides_are_resolved_by_fastapi():
+    other_keys = ApiKeyStore(seed={'token': ['other-token'], 'key': ['other-key']})
+    client = TestClient(dependencies_path_decorators)
+    dependencies_path_decorators.dependency_overrides[get_api_keys] = lambda: other_keys
+    try:
+        assert client.get('/items/', headers=TOKENS).status_code == 400
+        assert client.get('/items/', headers={'X-Token': 'other-token', 'X-Key': 'other-key'}).status_code == 200
+    finally:
+        dependencies_path_decorators.dependency_overrides.clear()
+    assert client.get('/items/', headers=TOKENS).status_code == 200
+
+
+def test_generator_dependencies_are_torn_down():
+    events = []
+
+    def sync_resource():
+        events.append('sync open')
+        yield 'sync'
+        events.append('sync close')
+
+    @inline
+    def inline_resource():
+        events.append('inline open')
+        yield 'inline'
+        events.append('inline close')
+
+    async def async_resource(first: str = Depends(sync_resource)):
+        events.append('async open')
+        yield first + ' async'
+        events.append('async close')
+
+    app = FastAPI()
+    app.router.route_class = PlannedRoute
+
+    @app.get('/')
+    async def read(a: str = Depends(async_resource), b: str = Depends(inline_resource), c: str = Depends(sync_resource)):
+        return [a, b, c]
+
+    assert app.routes[-1].plan is not None
+    client = TestClient(app)
+    assert client.get('/').json() == ['sync async', 'inline', 'sync']
+    planned = list(events)
+    events.clear()
+    with fallback(app):
+        assert client.get('/').json() == ['sync async', 'inline', 'sync']
+    assert planned == events
+    assert planned.count('sync open') == 1  # cached within the request, as FastAPI does
+
+
+def test_body_parameters_in_two_dependencies_are_not_planned():
+    def first(a: int = Body(...)):
+        return a
+
+    def second(b: int = Body(...)):
+        return b
+
+    app = FastAPI()
+    app.router.route_class = PlannedRoute
+
+    @app.post('/')
+    async def create(a: int = Depends(first), b: int = Depends(second)):
+        return a + b
+
+    assert app.routes[-1].plan is None
+    assert TestClient(app).post('/', json={'a': 1, 'b': 2}).json() == 3
+
+
+def test_unsupported_fastapi_versions_fall_back(monkeypatch):
+    monkeypatch.setattr(dependency_plan, 'PLANS_SUPPORTED', False)
+    app = FastAPI()
+    app.router.route_class = PlannedRoute
+
+    @app.get('/')
+    async def read(q: Optional[str] = None):
+        return {'q': q}
+
+    assert app.routes[-1].plan is None
+    response = TestClient(app).get('/', params={'q': 'foo'})
+    assert response.json() == {'q': 'foo'}
+    assert 'server-timing' not in response.headers
@@ -0,0 +1,129 @@
+import functools
+import os
+
+import pytest
+from fastapi import HTTPException
+from fastapi.testclient import TestClient
+
+import file_serving
+import main
+from file_serving import StatCache, file_info, parse_range, resolve
+
+CONTENT = bytes(range(256)) * 40  # 10240 bytes
+
+
+@pytest.fixture
+def files(tmp_path, monkeypatch):
+    """ a client of main.app serving tmp_path/root, with a secret next to the root"""
+    root = tmp_path / 'root'
+    root.mkdir()
+    (root / 'data.bin').write_bytes(CONTENT)
+    (root / 'sub').mkdir()
+    (tmp_path / 'secret.txt').write_text('secret')
+    os.symlink(tmp_path / 'secret.txt', root / 'escape.txt')
+    os.symlink(root / 'data.bin', root / 'inside.bin')
+    monkeypatch.setattr(main, 'serve_file', functools.partial(file_serving.serve_file, root=str(root)))
+    monkeypatch.setattr(file_serving, 'stat_cache', StatCache())
+    return TestClient(main.app), root
+
+
+def test_a_file_is_served_with_its_etag(files):
+    client, _ = files
+    response = client.get('/files/data.bin')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert response.headers['etag'].startswith('"')
+
+
+# encoded, the client would remove a literal .. from the url before sending it
+@pytest.mark.parametrize('path', ['%2e%2e/secret.txt', 'sub/%2e%2e/%2e%2e/secret.txt', '%2e%2e%2fsecret.txt'])
+def test_dot_dot_can_not_leave_the_root(files, path):
+    client, _ = files
+    assert client.get(f'/files/{path}').status_code == 404
+    assert client.get('/files/sub/%2e%2e/data.bin').content == CONTENT  # .. inside the root is fine
+
+
+def test_dot_dot_is_resolved_before_checking(tmp_path):
+    with pytest.raises(HTTPException) as error:
+        resolve(str(tmp_path / 'root'), '../secret.txt')
+    assert error.value.status_code == 404
+    assert resolve(str(tmp_path), 'a/../b') == os.path.join(os.path.realpath(tmp_path), 'b')
+
+
+def test_symlinks_can_not_leave_the_root(files):
+    client, _ = files
+    assert client.get('/files/escape.txt').status_code == 404
+    assert client.get('/files/inside.bin').content == CONTENT
+
+
+def test_a_nul_byte_is_not_found(files):
+    client, _ = files
+    assert client.get('/files/data.bin%00.txt').status_code == 404
+
+
+def test_directories_and_missing_files_are_not_found(files):
+    client, _ = files
+    assert client.get('/files/sub').status_code == 404
+    assert client.get('/files/missing.bin').status_code == 404
+    assert client.get('/files/data.bin/child').status_code == 404
+
+
+def test_a_file_that_can_not_be_read_is_forbidden(tmp_path, monkeypatch):
+    def denied(path, *args, **kwargs):
+        raise PermissionError(13, 'Permission denied', path)
+
+    monkeypatch.setattr(file_serving.os, 'stat', denied)
+    with pytest.raises(HTTPException) as error:
+        file_info(str(tmp_path / 'locked.bin'), cache=StatCache())
+    assert error.value.status_code == 403
+
+
+def test_if_none_match_with_the_current_etag_is_a_304(files):
+    client, _ = files
+    etag = client.get('/files/data.bin').headers['etag']
+    response = client.get('/files/data.bin', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.content == b''
+    assert response.headers['etag'] == etag
+    assert client.get('/files/data.bin', headers={'If-None-Match': 'W/' + etag}).status_code == 304
+    assert client.get('/files/data.bin', headers={'If-None-Match': '"other"'}).status_code == 200
+
+
+@pytest.mark.parametrize('header, start, end', [
+    ('bytes=0-99', 0, 99),
+    ('bytes=100-', 100, len(CONTENT) - 1),
+    ('bytes=-100', len(CONTENT) - 100, len(CONTENT) - 1),
+    ('bytes=10000-99999', 10000, len(CONTENT) - 1),
+])
+def test_a_range_is_a_206(files, header, start, end):
+    client, _ = files
+    response = client.get('/files/data.bin', headers={'Range': header})
+    assert response.status_code == 206
+    assert response.content == CONTENT[start:end + 1]
+    assert response.headers['content-range'] == f'bytes {start}-{end}/{len(CONTENT)}'
+    assert response.headers['content-length'] == str(end - start + 1)
+
+
+@pytest.mark.parametrize('header', ['bytes=20000-', 'bytes=10240-10250'])
+def test_a_range_after_the_end_is_a_416(files, header):
+    client, _ = files
+    response = client.get('/files/data.bin', headers={'Range': header})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == f'bytes */{len(CONTENT)}'
+
+
+@pytest.mark.parametrize('header', ['bytes=0-1,5-6', 'items=0-1', 'bytes=5-1', 'bytes=x-'])
+def test_ranges_that_are_not_understood_get_the_whole_file(header):
+    assert parse_range(header, len(CONTENT)) is None
+
+
+def test_if_range_applies_the_range_only_to_the_current_version(files):
+    client, _ = files
+    etag = client.get('/files/data.bin').headers['etag']
+    current = client.get('/files/data.bin', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert current.status_code == 206
+    assert current.content == CONTENT[:10]
+    stale = client.get('/files/data.bin', headers={'Range': 'bytes=0-9', 'If-Range': '"stale"'})
+    assert stale.status_code == 200
+    assert stale.content == CONTENT
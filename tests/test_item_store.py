@@ -0,0 +1,33 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from item_store import ItemStore
+from main import app, fake_items_db
+
+NAMES = ['Foo', 'Bar', 'Baz', 'foobar', 'barbaz', 'bazaar', 'qux']
+
+
+def scan(items: list, q=None, skip: int = 0, limit: int = 100) -> list:
+    """ the filter and the slice of the list, what the store replaces"""
+    if q:
+        q = q.lower()
+        items = [item for item in items if (
+            item['item_name'].lower().startswith(q) if len(q) < 3 else q in item['item_name'].lower()
+        )]
+    return items[skip:skip + limit]
+
+
+@pytest.mark.parametrize('q', [None, '', 'b', 'ba', 'bar', 'baz', 'zzz'])
+@pytest.mark.parametrize('skip', [-10, -2, -1, 0, 1, 3, 10])
+@pytest.mark.parametrize('limit', [-1, 0, 1, 2, 100])
+def test_query_pages_as_a_slice(q, skip, limit):
+    items = [{'item_name': name} for name in NAMES]
+    store = ItemStore(items)
+    assert store.query(q=q, skip=skip, limit=limit) == scan(items, q, skip, limit)
+
+
+def test_read_item_with_a_negative_skip():
+    client = TestClient(app)
+    response = client.get('/items/', params={'q': 'ba', 'skip': -1})
+    assert response.json() == scan(fake_items_db, 'ba', -1, 10)
+    assert response.json() == [{'item_name': 'baz'}]
@@ -0,0 +1,113 @@
+import json
+import time
+
+import pytest
+
+from jwt_signing import (
+    EdDSASigner, HS256Signer, InvalidTokenError, KeyRing, Signer, b64url_encode, signer_for,
+)
+
+SECRET = 'a secret'
+
+
+def kidless_token(claims: dict, secret: str = SECRET) -> str:
+    """ an HS256 token as signed before the tokens carried a kid"""
+    signing_input = (
+        b64url_encode(json.dumps({'alg': 'HS256', 'typ': 'JWT'}).encode())
+        + '.' + b64url_encode(json.dumps(claims).encode())
+    )
+    return signing_input + '.' + b64url_encode(HS256Signer(secret).sign(signing_input.encode()))
+
+
+def test_tokens_signed_before_a_rotation_still_verify():
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    token = keyring.encode({'sub': 'johndoe'})
+    keyring.rotate(signer_for('EdDSA'))
+    assert keyring.decode(token) == {'sub': 'johndoe'}
+    assert keyring.decode(keyring.encode({'sub': 'janedoe'})) == {'sub': 'janedoe'}
+
+
+def test_tokens_without_kid_verify_with_the_default_key_after_rotations():
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    token = kidless_token({'sub': 'johndoe', 'exp': time.time() + 60})
+    assert keyring.decode(token)['sub'] == 'johndoe'
+    keyring.rotate(signer_for('HS256'))
+    keyring.rotate(signer_for('ES256'))
+    assert keyring.decode(token)['sub'] == 'johndoe'
+
+
+def test_tokens_without_kid_are_rejected_once_the_default_key_is_retired():
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    keyring.rotate(signer_for('HS256'))
+    keyring.retire('default')
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(kidless_token({'sub': 'johndoe'}))
+
+
+def test_tokens_without_kid_are_not_checked_against_the_current_key():
+    current = HS256Signer('another secret')
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    keyring.rotate(current)
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(kidless_token({'sub': 'johndoe'}, secret='another secret'))
+
+
+def test_the_algorithm_comes_from_the_key():
+    keyring = KeyRing(EdDSASigner(kid='default'))
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(kidless_token({'sub': 'johndoe'}))
+
+
+def test_signer_is_abstract():
+    with pytest.raises(TypeError):
+        Signer()
+
+
+def signed_token(header: dict, claims: dict, secret: str = SECRET) -> str:
+    signing_input = b64url_encode(json.dumps(header).encode()) + '.' + b64url_encode(json.dumps(claims).encode())
+    return signing_input + '.' + b64url_encode(HS256Signer(secret).sign(signing_input.encode()))
+
+
+@pytest.mark.parametrize('header', [
+    {'alg': 'HS256', 'kid': ['default']},
+    {'alg': 'HS256', 'kid': {'a': 1}},
+    {'alg': 'HS256', 'kid': 1},
+    {'alg': ['HS256'], 'kid': 'default'},
+    {'alg': None, 'kid': 'default'},
+    {'kid': 'default'},
+])
+def test_malformed_headers_are_invalid_tokens(header):
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(signed_token(header, {'sub': 'johndoe'}))
+
+
+@pytest.mark.parametrize('token', ['', 'abc', 'a.b.c', '.' * 5, b64url_encode(b'[]') + '.e30.'])
+def test_malformed_tokens_are_invalid_tokens(token):
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    with pytest.raises(InvalidTokenError):
+        keyring.decode(token)
+
+
+def test_the_time_claims_are_checked():
+    keyring = KeyRing(signer_for('HS256', SECRET, kid='default'))
+    now = time.time()
+    assert keyring.decode(keyring.encode({'sub': 'a', 'exp': now + 60, 'nbf': now - 1, 'iat': int(now)}))['sub'] == 'a'
+    for claims, message in [
+        ({'exp': now - 10}, 'expired'),
+        ({'nbf': now + 60}, 'not yet valid'),
+        ({'exp': 'tomorrow'}, 'invalid exp'),
+        ({'nbf': True}, 'invalid nbf'),
+        ({'iat': 'now'}, 'invalid iat'),
+    ]:
+        with pytest.raises(InvalidTokenError, match=message):
+            keyring.decode(keyring.encode(claims))
+    assert keyring.decode(keyring.encode({'nbf': now + 5}), leeway=10) == {'nbf': now + 5}
+
+
+def test_a_malformed_header_is_a_401_not_a_500():
+    from fastapi.testclient import TestClient
+    from security_jwt import security_jwt_app, SECRET_KEY
+    token = signed_token({'alg': 'HS256', 'kid': ['x']}, {'sub': 'johndoe'}, secret=SECRET_KEY)
+    response = TestClient(security_jwt_app).get('/users/me/items', headers={'Authorization': f'Bearer {token}'})
+    assert response.status_code == 401
@@ -0,0 +1,76 @@
+import re
+
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from metrics import MetricsMiddleware, MetricsRegistry
+
+
+def metrics_app(registry: MetricsRegistry) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/items/{item_id}')
+    def read_item(item_id: int):
+        return {'item_id': item_id}
+
+    @app.post('/echo')
+    async def echo(request: Request):
+        return {'size': len(await request.body())}
+
+    @app.get('/fail')
+    def fail():
+        raise RuntimeError('failed')
+
+    app.add_middleware(MetricsMiddleware, registry=registry)
+    return app
+
+
+def sample(text: str, name: str, **labels) -> float:
+    """ the value of the sample of name with exactly these labels in the rendered text"""
+    wanted = ','.join(f'{label}="{value}"' for label, value in labels.items())
+    match = re.search(rf'^{name}\{{{re.escape(wanted)}\}} (\S+)$', text, re.MULTILINE)
+    assert match is not None, f'no {name}{{{wanted}}} in\n{text}'
+    return float(match.group(1))
+
+
+def test_the_route_label_is_the_path_template():
+    registry = MetricsRegistry()
+    client = TestClient(metrics_app(registry))
+    for item_id in (1, 2, 3):
+        client.get(f'/items/{item_id}')
+    client.get('/items/not-a-number')
+    assert sorted(registry.durations) == [('GET', '/items/{item_id}', 200), ('GET', '/items/{item_id}', 422)]
+    text = registry.render()
+    assert sample(text, 'http_request_duration_seconds_count', method='GET', route='/items/{item_id}', status=200) == 3
+    assert sample(
+        text, 'http_request_duration_seconds_bucket', method='GET', route='/items/{item_id}', status=200, le='+Inf',
+    ) == 3
+    assert '/items/1' not in text
+
+
+def test_requests_matching_no_route_are_unmatched():
+    registry = MetricsRegistry()
+    client = TestClient(metrics_app(registry))
+    for path in ('/missing', '/other/missing', '/items'):
+        assert client.get(path).status_code == 404
+    assert list(registry.durations) == [('GET', 'unmatched', 404)]
+    assert registry.durations['GET', 'unmatched', 404].count == 3
+
+
+def test_the_byte_counters_count_the_bodies():
+    registry = MetricsRegistry()
+    client = TestClient(metrics_app(registry))
+    sent = sum(len(client.post('/echo', content=body).content) for body in (b'x' * 1000, b'y' * 234))
+    assert registry.request_bytes == {('POST', '/echo'): 1234}
+    assert registry.response_bytes == {('POST', '/echo', 200): sent}
+    text = registry.render()
+    assert sample(text, 'http_request_size_bytes_total', method='POST', route='/echo') == 1234
+    assert sample(text, 'http_response_size_bytes_total', method='POST', route='/echo', status=200) == sent
+
+
+def test_an_exception_is_recorded_as_a_500():
+    registry = MetricsRegistry()
+    client = TestClient(metrics_app(registry), raise_server_exceptions=False)
+    assert client.get('/fail').status_code == 500
+    assert list(registry.durations) == [('GET', '/fail', 500)]
+    assert registry.in_progress == 0
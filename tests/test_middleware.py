@@ -0,0 +1,44 @@
+import importlib
+import sys
+
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture(params=['asgi', 'decorator'])
+def middleware(request, monkeypatch):
+    """ middleware.py imported again with MIDDLEWARE_MODE set, it is read at import"""
+    monkeypatch.setenv('MIDDLEWARE_MODE', request.param)
+    monkeypatch.delitem(sys.modules, 'middleware', raising=False)
+    module = importlib.import_module('middleware')
+    yield module
+    sys.modules.pop('middleware', None)
+
+
+def test_the_process_time_header_is_sent_in_both_modes(middleware):
+    app = middleware.middleware_app
+
+    @app.get('/ping')
+    def ping():
+        return {'ping': 'pong'}
+
+    response = TestClient(app).get('/ping')
+    assert response.json() == {'ping': 'pong'}
+    assert float(response.headers['x-process-time']) >= 0
+    assert response.headers.get_list('x-process-time') == [response.headers['x-process-time']]
+    assert TestClient(app).get('/missing').headers['x-process-time']
+
+
+def test_the_mode_picks_the_middleware(middleware):
+    classes = [entry.cls.__name__ for entry in middleware.middleware_app.user_middleware]
+    if middleware.MIDDLEWARE_MODE == 'asgi':
+        assert 'ProcessTimeMiddleware' in classes and 'BaseHTTPMiddleware' not in classes
+    else:
+        assert 'BaseHTTPMiddleware' in classes and 'ProcessTimeMiddleware' not in classes
+
+
+def test_an_unknown_mode_is_rejected(monkeypatch):
+    monkeypatch.setenv('MIDDLEWARE_MODE', 'threads')
+    monkeypatch.delitem(sys.modules, 'middleware', raising=False)
+    with pytest.raises(ValueError, match='MIDDLEWARE_MODE must be asgi or decorator'):
+        importlib.import_module('middleware')
@@ -0,0 +1,69 @@
+import base64
+
+import pytest
+
+from database_app.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor
+from tests.conftest import USERS
+
+
+def pages(client, limit: int, **params) -> list:
+    """ the ids of every page, following X-Next-Cursor until a page comes without it"""
+    result = []
+    response = client.get('/users/', params={'limit': limit, **params})
+    while True:
+        result.append([user['id'] for user in response.json()])
+        cursor = response.headers.get(NEXT_CURSOR_HEADER)
+        if cursor is None:
+            return result
+        response = client.get('/users/', params={'limit': limit, 'cursor': cursor})
+
+
+@pytest.mark.parametrize('last_id', [0, 1, 42, 2 ** 40])
+def test_a_cursor_round_trips(last_id):
+    cursor = encode_cursor(last_id)
+    assert '=' not in cursor  # no padding to escape in a url
+    assert decode_cursor(cursor) == last_id
+
+
+@pytest.mark.parametrize('cursor', [
+    'not a cursor',
+    base64.urlsafe_b64encode(b'[1]').decode(),
+    base64.urlsafe_b64encode(b'{"id": "1"}').decode(),
+    base64.urlsafe_b64encode(b'{"last": 1}').decode(),
+    base64.urlsafe_b64encode(b'\xff\xfe').decode(),
+])
+def test_cursors_not_made_by_encode_cursor_are_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor)
+
+
+def test_the_cursor_walks_every_user_once(database_app):
+    client, _, user_ids = database_app
+    assert pages(client, limit=2) == [user_ids[0:2], user_ids[2:4], user_ids[4:5]]
+
+
+def test_the_last_page_has_no_cursor(database_app):
+    client, _, user_ids = database_app
+    # a full last page can't tell it is the last, the page after it is empty and has no cursor
+    assert pages(client, limit=USERS) == [user_ids, []]
+    response = client.get('/users/', params={'limit': USERS + 1})
+    assert NEXT_CURSOR_HEADER not in response.headers
+    assert [user['id'] for user in response.json()] == user_ids
+
+
+def test_skip_is_ignored_with_a_cursor(database_app):
+    client, _, user_ids = database_app
+    cursor = client.get('/users/', params={'limit': 2}).headers[NEXT_CURSOR_HEADER]
+    response = client.get('/users/', params={'limit': 2, 'skip': 3, 'cursor': cursor})
+    assert [user['id'] for user in response.json()] == user_ids[2:4]
+    # without a cursor skip is an offset
+    response = client.get('/users/', params={'limit': 2, 'skip': 3})
+    assert [user['id'] for user in response.json()] == user_ids[3:5]
+
+
+@pytest.mark.parametrize('cursor', ['not a cursor', base64.urlsafe_b64encode(b'{"id": "1"}').decode()])
+def test_a_bad_cursor_is_a_400(database_app, cursor):
+    client, _, _ = database_app
+    response = client.get('/users/', params={'cursor': cursor})
+    assert response.status_code == 400
+    assert response.json() == {'detail': 'invalid cursor'}
@@ -0,0 +1,57 @@
+import os
+import time
+
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from profiling import ProfilingMiddleware
+
+SECRET = 'profile-secret'
+
+
+def profiled_app(directory, **options) -> FastAPI:
+    app = FastAPI()
+
+    @app.get('/work')
+    def work():
+        end = time.perf_counter() + 0.02
+        while time.perf_counter() < end:
+            pass
+        return {'done': True}
+
+    app.add_middleware(ProfilingMiddleware, directory=str(directory), interval=0.001, **options)
+    return app
+
+
+def test_the_header_is_ignored_without_a_secret(tmp_path):
+    client = TestClient(profiled_app(tmp_path))
+    response = client.get('/work', headers={'X-Profile': '1'})
+    assert 'x-profile-file' not in response.headers
+    assert os.listdir(tmp_path) == []
+
+
+def test_the_header_must_carry_the_secret(tmp_path):
+    client = TestClient(profiled_app(tmp_path, secret=SECRET))
+    for value in ('1', 'profile-secre', SECRET + 'x', ''):
+        assert 'x-profile-file' not in client.get('/work', headers={'X-Profile': value}).headers
+    assert os.listdir(tmp_path) == []
+    response = client.get('/work', headers={'X-Profile': SECRET})
+    assert response.json() == {'done': True}
+    name = response.headers['x-profile-file']
+    assert os.listdir(tmp_path) == [name]
+    assert name.endswith('-GET-work.folded')
+    with open(tmp_path / name) as file:
+        assert 'work (test_profiling.py:' in file.read()  # the endpoint, sampled in the threadpool
+
+
+def test_sampled_requests_do_not_reveal_the_file(tmp_path):
+    client = TestClient(profiled_app(tmp_path, sample_rate=1.0))
+    response = client.get('/work')
+    assert 'x-profile-file' not in response.headers
+    assert len(os.listdir(tmp_path)) == 1
+
+
+def test_only_the_last_profiles_are_kept(tmp_path):
+    client = TestClient(profiled_app(tmp_path, secret=SECRET, max_files=3))
+    names = [client.get('/work', headers={'X-Profile': SECRET}).headers['x-profile-file'] for _ in range(5)]
+    assert sorted(os.listdir(tmp_path)) == sorted(names[2:])
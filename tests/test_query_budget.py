@@ -0,0 +1,54 @@
+import pytest
+
+from database_app.query_counter import assert_max_queries, count_queries
+from tests.conftest import ITEMS_PER_USER, USERS
+
+
+def test_read_users_loads_the_items_with_one_more_query(database_app):
+    client, engine, _ = database_app
+    with assert_max_queries(engine, 2):  # the users, their items with selectinload
+        response = client.get('/users/')
+    assert len(response.json()) == USERS
+    assert all(len(user['items']) == ITEMS_PER_USER for user in response.json())
+
+
+def test_read_items_is_one_query(database_app):
+    client, engine, _ = database_app
+    with assert_max_queries(engine, 1):
+        response = client.get('/items/')
+    assert len(response.json()) == USERS * ITEMS_PER_USER
+
+
+def test_read_user_loads_its_items_with_one_more_query(database_app):
+    client, engine, user_ids = database_app
+    with assert_max_queries(engine, 2):
+        response = client.get(f'/uses/{user_ids[0]}')
+    assert len(response.json()['items']) == ITEMS_PER_USER
+
+
+def test_the_budget_fails_with_the_statements(database_app):
+    client, engine, _ = database_app
+    with pytest.raises(AssertionError, match='expected at most 1 queries, 2 were run'):
+        with assert_max_queries(engine, 1):
+            client.get('/users/')
+
+
+def test_the_budget_does_not_grow_with_the_rows(database_app):
+    client, engine, _ = database_app
+    with count_queries(engine) as few:
+        client.get('/users/', params={'limit': 1})
+    with count_queries(engine) as many:
+        client.get('/users/', params={'limit': USERS})
+    assert few.count == many.count
+
+
+def test_cache_stats_are_those_of_the_overridden_cache(database_app):
+    client, engine, user_ids = database_app
+    from database_app.cache import LRUCache
+    from database_app.main import get_cache
+    cache = LRUCache()
+    client.app.dependency_overrides[get_cache] = lambda: cache
+    client.get(f'/uses/{user_ids[0]}')
+    with assert_max_queries(engine, 0):  # the second lookup is answered from the override
+        client.get(f'/uses/{user_ids[0]}')
+    assert client.get('/cache/stats').json() == {'hits': 1, 'misses': 1, 'evictions': 0, 'expirations': 0}
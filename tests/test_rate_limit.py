@@ -0,0 +1,97 @@
+import asyncio
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from rate_limit import MemoryBackend, RateLimit, RateLimiter, RateLimitMiddleware, RedisBackend, by_ip
+
+
+def test_burst_exhaustion_answers_429_with_retry_after():
+    app = FastAPI()
+    limiter = RateLimiter(rate=0.5, burst=3, backend=MemoryBackend())
+
+    @app.get('/limited', dependencies=[Depends(RateLimit(limiter, key=by_ip))])
+    def limited():
+        return {'ok': True}
+
+    client = TestClient(app)
+    assert [client.get('/limited').status_code for _ in range(3)] == [200, 200, 200]
+    response = client.get('/limited')
+    assert response.status_code == 429
+    assert response.headers['retry-after'] == '2'  # one token at 0.5/s
+    assert response.json() == {'detail': 'Too Many Requests'}
+
+
+def test_tokens_refill_as_time_passes():
+    backend = MemoryBackend()
+    for _ in range(2):
+        assert backend.take('key', rate=2, burst=2, now=100.0).allowed
+    denied = backend.take('key', rate=2, burst=2, now=100.0)
+    assert not denied.allowed
+    assert denied.retry_after == pytest.approx(0.5)
+    assert not backend.take('key', rate=2, burst=2, now=100.25).allowed
+    assert backend.take('key', rate=2, burst=2, now=100.5).allowed
+    # never more than burst, however long the wait
+    assert backend.take('key', rate=2, burst=2, now=1000.0).remaining == pytest.approx(1)
+
+
+def test_sweep_drops_the_buckets_that_are_full_again():
+    backend = MemoryBackend(shards=1, sweep_every=10 ** 6)
+    backend.take('idle', rate=1, burst=5, now=0.0)  # full again at 1
+    backend.take('busy', rate=1, burst=5, cost=5, now=0.0)  # full again at 5
+    assert len(backend) == 2
+    backend.sweep(now=2.0)
+    assert len(backend) == 1
+    assert backend.take('busy', rate=1, burst=5, now=2.0).remaining == pytest.approx(1)  # its state was kept
+    backend.sweep(now=10.0)
+    assert len(backend) == 0
+
+
+def test_sweep_runs_every_sweep_every_hits():
+    backend = MemoryBackend(shards=1, sweep_every=4)
+    for i in range(3):
+        backend.take(f'client {i}', rate=1, burst=1, now=0.0)
+    assert len(backend) == 3
+    backend.take('client 3', rate=1, burst=1, now=10.0)  # the 4th hit sweeps the others
+    assert len(backend) == 1
+
+
+def test_lua_script_on_fakeredis():
+    pytest.importorskip('lupa')  # fakeredis runs scripts with it
+    fakeredis = pytest.importorskip('fakeredis.aioredis')
+
+    async def run():
+        client = fakeredis.FakeRedis()
+        limiter = RateLimiter(rate=1, burst=2, backend=RedisBackend(client), name='login')
+        decisions = [await limiter.hit('ip:10.0.0.1') for _ in range(3)]
+        other = await limiter.hit('ip:10.0.0.2')
+        ttl = await client.pttl('rate_limit:login:ip:10.0.0.1')
+        return decisions, other, ttl
+
+    decisions, other, ttl = asyncio.run(run())
+    assert [decision.allowed for decision in decisions] == [True, True, False]
+    assert decisions[1].remaining == pytest.approx(0, abs=0.01)
+    assert 0.9 < decisions[2].retry_after <= 1
+    assert other.allowed  # buckets are per key
+    assert 0 < ttl <= 3000  # dropped once full again
+
+
+def test_middleware_limits_only_the_given_path_prefixes():
+    app = FastAPI()
+
+    @app.get('/users/')
+    def users():
+        return []
+
+    @app.get('/items/')
+    def items():
+        return []
+
+    app.add_middleware(
+        RateLimitMiddleware, limiter=RateLimiter(rate=1, burst=2, backend=MemoryBackend()), paths=['/users/'],
+    )
+    client = TestClient(app)
+    assert [client.get('/users/').status_code for _ in range(3)] == [200, 200, 429]
+    assert client.get('/users/').headers['retry-after'] == '1'
+    assert [client.get('/items/').status_code for _ in range(5)] == [200] * 5
@@ -0,0 +1,180 @@
+import asyncio
+import json
+from typing import Any, List, Optional
+
+import pytest
+from fastapi.routing import APIRoute, serialize_response
+from fastapi.testclient import TestClient
+from pydantic import BaseModel, Extra, Field, ValidationError, validator
+from starlette.responses import JSONResponse, Response
+
+import fast_responses
+from main import Image, Item, UserIn, UserOut, app
+from response_projection import NOT_PROJECTED
+
+
+class Child(Image):
+    extra: str = 'not in Image'
+
+
+class ItemPlus(Item):
+    secret: str = 'not in Item'
+
+
+class Aliased(BaseModel):
+    item_name: str = Field(..., alias='itemName')
+    count: int = 0
+
+
+class Checked(BaseModel):
+    name: str
+
+    @validator('name')
+    def upper(cls, value):
+        return value.upper()
+
+
+class NotChecked(BaseModel):
+    name: str
+
+
+class Loose(BaseModel):
+    name: int  # str in NotChecked
+
+
+class Counted(BaseModel):
+    counts: Optional[List[int]] = Field(default_factory=lambda: [0])
+    total: Optional[int] = 0
+
+
+class Open(BaseModel):
+    name: str
+
+    class Config:
+        extra = Extra.allow
+
+
+def endpoint():
+    pass
+
+
+def image(i: int = 0, model=Image):
+    return model(url=f'http://example.com/{i}.png', name=f'image {i}')
+
+
+def item(**values):
+    # the default of Item.tax is the tuple (10.5,), it fails the validation of the response when tax isn't set
+    return Item(**{'name': 'Foo', 'price': 10.0, 'tax': 1.0, **values})
+
+
+# response_model, route options, return value, whether the fast path projects it without validating a model
+CASES = [
+    (Item, {}, item(), True),
+    (Item, {}, item(tax=1.5, tags={'a', 'b'}, images=[image(1), image(2)]), True),
+    (Item, {}, Item(name='Foo', price=10.0), False),  # fails, see item()
+    (Item, {'response_model_exclude_unset': True}, Item(name='Foo', price=10.0), True),
+    (Item, {'response_model_exclude_unset': True}, item(description=None), True),
+    (Item, {'response_model_exclude_unset': True}, item(images=[image(1)]), True),
+    (Item, {'response_model_exclude_defaults': True}, item(description=None, tags=set()), True),
+    (Item, {'response_model_exclude_none': True}, item(description=None, tax=None), True),
+    (Item, {'response_model_exclude_none': True}, item(description=None, tax=None, images=None), True),
+    (Item, {'response_model_exclude_none': True, 'response_model_exclude_defaults': True}, item(tax=None), True),
+    (Item, {'response_model_include': {'name', 'price'}}, item(tax=3.0), True),
+    (Item, {'response_model_exclude': {'tax', 'images'}}, item(tax=3.0, images=[image()]), True),
+    (Item, {'response_model_exclude': {'images': {0: {'url'}}}}, item(images=[image(), image(1)]), False),
+    (Item, {}, item(images=[image(1, Child)]), False),  # nested subclass, validation drops its extra field
+    (Item, {}, ItemPlus(name='Foo', price=1.0), False),  # subclass, its extra field is dropped
+    (List[Item], {}, [item(), item(name='Bar', tags={'x'})], True),
+    (List[Item], {'response_model_exclude_unset': True}, [item(), ItemPlus(name='Bar', price=1.0)], True),
+    (UserOut, {}, UserIn(username='foo', password='secret', email='foo@example.com'), True),
+    (UserOut, {'response_model_exclude_unset': True}, UserIn(username='foo', password='x', email='foo@example.com'),
+     True),
+    (Aliased, {}, Aliased(itemName='foo'), True),
+    (Aliased, {'response_model_by_alias': False}, Aliased(itemName='foo', count=2), True),
+    (Checked, {}, NotChecked(name='foo'), False),  # validators on the response model, validated
+    (NotChecked, {}, Checked(name='foo'), True),
+    (Loose, {}, Loose(name=1), True),
+    (Optional[Item], {}, item(), True),
+    (Counted, {}, Counted(), True),
+    (Counted, {'response_model_exclude_none': True}, Counted(counts=None, total=None), False),
+    (Counted, {'response_model_exclude_defaults': True}, Counted(counts=None, total=0), False),
+    # dicts
+    (Item, {'response_model_exclude_unset': True}, {'name': 'Foo', 'price': 2.0}, True),
+    (Item, {'response_model_exclude_unset': True}, {'item_id': 1, **item().dict(), 'q': 'x'}, True),  # update_item
+    (Item, {}, {'name': 'Foo', 'price': '2', 'tags': ['a', 'a']}, True),  # coerced
+    (Item, {}, {'name': 'Foo', 'price': -1}, True),  # invalid, reported by the validating path
+    (Item, {}, {'name': 'Foo'}, True),  # missing a required field
+    (Item, {'response_model_exclude_unset': True}, {'name': 'Foo', 'price': 1, 'images': [image(1), {'url': 'x'}]},
+     True),
+    (Item, {'response_model_exclude_none': True}, {'name': 'Foo', 'price': 1, 'tax': None, 'description': None},
+     True),
+    (Item, {'response_model_exclude_defaults': True}, {'name': 'Foo', 'price': 1, 'tax': 10.5, 'tags': []}, True),
+    (Item, {'response_model_include': {'name'}}, {'name': 'Foo', 'price': 1}, True),
+    (Aliased, {}, {'itemName': 'foo', 'count': '3'}, True),
+    (Aliased, {}, {'item_name': 'foo'}, True),  # by name, not allowed
+    (Checked, {}, {'name': 'foo'}, True),
+    (Open, {}, {'name': 'foo', 'more': 1}, False),  # extra keys are in the response
+    (List[Item], {'response_model_exclude_unset': True}, [{'name': 'Foo', 'price': 1}, item(tags={'a'})], True),
+]
+
+
+async def fastapi_serialize(route: APIRoute, content: Any) -> bytes:
+    response = await serialize_response(
+        field=route.secure_cloned_response_field,
+        response_content=content,
+        include=route.response_model_include,
+        exclude=route.response_model_exclude,
+        by_alias=route.response_model_by_alias,
+        exclude_unset=route.response_model_exclude_unset,
+        exclude_defaults=route.response_model_exclude_defaults,
+        exclude_none=route.response_model_exclude_none,
+    )
+    return JSONResponse(response).body
+
+
+def fast_serialize(route: fast_responses.FastJSONRoute, content: Any) -> bytes:
+    sub_response = Response()
+    del sub_response.headers['content-length']
+    sub_response.status_code = None
+    return route.serialize(content, sub_response).body
+
+
+def normalized(body: bytes) -> Any:
+    # sets (Item.tags) have no order
+    def sort(value):
+        if isinstance(value, dict):
+            return {key: sort(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return sorted((sort(item) for item in value), key=repr)
+        return value
+
+    return sort(json.loads(body))
+
+
+def result(serialize) -> Any:
+    try:
+        return normalized(serialize())
+    except ValidationError as error:
+        return str(error)
+
+
+@pytest.mark.parametrize('response_model, options, content, projected', CASES)
+def test_fast_path_returns_what_fastapi_returns(response_model, options, content, projected):
+    route = APIRoute('/', endpoint, response_model=response_model, **options)
+    fast_route = fast_responses.FastJSONRoute('/', endpoint, response_model=response_model, **options)
+    expected = result(lambda: asyncio.run(fastapi_serialize(route, content)))
+    assert result(lambda: fast_serialize(fast_route, content)) == expected
+    try:
+        was_projected = fast_route.projection.project(content) is not NOT_PROJECTED
+    except ValidationError:
+        was_projected = False
+    assert was_projected == (projected and not isinstance(expected, str))
+
+
+def test_update_item_returns_every_field_of_the_item():
+    client = TestClient(app)
+    response = client.put('/items1/3', params={'q': 'x'}, json={'name': 'a', 'price': 1.0, 'tax': 0.5})
+    assert response.status_code == 200
+    assert response.json() == {
+        'name': 'a', 'description': None, 'price': 1.0, 'tax': 0.5, 'tags': [], 'images': None,
+    }
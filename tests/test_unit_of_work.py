@@ -0,0 +1,130 @@
+import sys
+from contextlib import contextmanager
+
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import event, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, sessionmaker
+
+from compression import CompressionMiddleware
+from database_app.query_counter import assert_max_queries
+
+
+class FailingCommitSession(Session):
+    def commit(self):
+        raise RuntimeError('commit failed')
+
+
+class FailingCommitAsyncSession(AsyncSession):
+    async def commit(self):
+        raise RuntimeError('commit failed')
+
+
+@contextmanager
+def count_checkouts(engine):
+    """ the connections checked out of the pool of engine meanwhile"""
+    engine = getattr(engine, 'sync_engine', engine)
+    checkouts = []
+
+    def on_checkout(dbapi_connection, connection_record, connection_proxy):
+        checkouts.append(connection_record)
+
+    event.listen(engine, 'checkout', on_checkout)
+    try:
+        yield checkouts
+    finally:
+        event.remove(engine, 'checkout', on_checkout)
+
+
+def rows_app(main) -> FastAPI:
+    """ a path operation writing a row through get_db of database_app.main, without committing it"""
+    with main.engine.begin() as connection:
+        connection.execute(text('CREATE TABLE IF NOT EXISTS rows (id INTEGER)'))
+    app = FastAPI()
+    if main.DATABASE_MODE == 'async':
+        @app.post('/rows')
+        async def create_row(db=Depends(main.get_async_db)):
+            await db.execute(text('INSERT INTO rows VALUES (1)'))
+            return {'created': True}
+    else:
+        @app.post('/rows')
+        def create_row(db=Depends(main.get_db)):
+            db.execute(text('INSERT INTO rows VALUES (1)'))
+            return {'created': True}
+    # as in database_app.main, compression copies the scope inside of the unit of work
+    app.add_middleware(CompressionMiddleware, minimum_size=0)
+    app.add_middleware(main.UnitOfWorkMiddleware)
+    return app
+
+
+def count_rows(main) -> int:
+    with main.engine.connect() as connection:
+        return connection.execute(text('SELECT count(*) FROM rows')).scalar()
+
+
+def test_a_cache_hit_checks_out_no_connection(database_app):
+    client, engine, user_ids = database_app
+    main = sys.modules['database_app.main']
+    from database_app.cache import LRUCache  # of the modules imported by the fixture
+    cache = LRUCache()
+    client.app.dependency_overrides[main.get_cache] = lambda: cache
+    with count_checkouts(engine) as checkouts:
+        client.get(f'/uses/{user_ids[0]}')
+    assert len(checkouts) == 1  # the whole request on one connection
+    with count_checkouts(engine) as checkouts, assert_max_queries(engine, 0):
+        response = client.get(f'/uses/{user_ids[0]}')
+    assert response.status_code == 200
+    assert checkouts == []
+    assert 'desc="0 queries"' in response.headers['server-timing']
+
+
+def test_a_rejected_request_checks_out_no_connection(database_app):
+    client, engine, _ = database_app
+    with count_checkouts(engine) as checkouts:
+        assert client.get('/uses/not-a-number').status_code == 422
+        assert client.get('/users/', params={'cursor': 'not a cursor'}).status_code == 400
+    assert checkouts == []
+
+
+def test_the_db_timing_is_in_server_timing(database_app):
+    client, _, _ = database_app
+    timing = client.get('/users/', headers={'Accept-Encoding': 'identity'}).headers['server-timing']
+    assert 'db-checkout;dur=' in timing
+    assert 'desc="2 queries"' in timing
+
+
+def test_committed_before_the_response(database_app):
+    main = sys.modules['database_app.main']
+    with TestClient(rows_app(main)) as client:
+        response = client.post('/rows', headers={'Accept-Encoding': 'gzip'})
+        assert response.status_code == 200
+        # read while the response is in hand, the row must already be there
+        assert count_rows(main) == 1
+    assert 'db-query' in response.headers['server-timing']
+
+
+def test_a_failing_commit_is_a_500(database_app, monkeypatch):
+    main = sys.modules['database_app.main']
+    if main.DATABASE_MODE == 'async':
+        monkeypatch.setattr(main, 'AsyncSessionLocal', sessionmaker(
+            class_=FailingCommitAsyncSession, autoflush=False, expire_on_commit=False,
+        ))
+    else:
+        monkeypatch.setattr(main, 'SessionLocal', sessionmaker(class_=FailingCommitSession, autoflush=False))
+    with TestClient(rows_app(main), raise_server_exceptions=False) as client:
+        assert client.post('/rows').status_code == 500
+    assert count_rows(main) == 0
+
+
+def test_requests_without_a_unit_of_work_pass_through(database_app):
+    main = sys.modules['database_app.main']
+    app = rows_app(main)
+
+    @app.get('/ping')
+    def ping():
+        return {'ping': 'pong'}
+
+    response = TestClient(app).get('/ping')
+    assert response.json() == {'ping': 'pong'}
+    assert 'db-query' not in response.headers.get('server-timing', '')
@@ -0,0 +1,151 @@
+import asyncio
+import hashlib
+import os
+
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+
+from form_data import form_data_app
+import uploads
+from uploads import SpooledUpload, StreamingMultipartParser, UploadTooLarge, spooled_upload
+
+CONTENT = b'x' * 200000
+BOUNDARY = 'boundary'
+
+
+def multipart(*parts: bytes) -> bytes:
+    """ a multipart/form-data body of the parts, each given with its headers"""
+    body = b''.join(b'--' + BOUNDARY.encode() + b'\r\n' + part + b'\r\n' for part in parts)
+    return body + b'--' + BOUNDARY.encode() + b'--\r\n'
+
+
+def field(name: str, value: bytes) -> bytes:
+    return f'Content-Disposition: form-data; name="{name}"\r\n\r\n'.encode() + value
+
+
+def file(name: str, filename: str, content: bytes) -> bytes:
+    return f'Content-Disposition: form-data; name="{name}"; filename="{filename}"\r\n\r\n'.encode() + content
+
+
+def chunks(body: bytes, size: int = 1000):
+    for start in range(0, len(body), size):
+        yield body[start:start + size]
+
+
+async def stream(body: bytes, size: int = 1000):
+    for chunk in chunks(body, size):
+        yield chunk
+
+
+@pytest.fixture
+def spool_dir(tmp_path, monkeypatch):
+    """ the spool directory of spooled_upload, to see what is left in it"""
+    directory = tmp_path / 'spool'
+    monkeypatch.setattr(uploads, 'UPLOAD_SPOOL_DIR', str(directory))
+    return directory
+
+
+def post(body: bytes, **headers):
+    client = TestClient(form_data_app)
+    return client.post('/files/stream', content=body, headers={
+        'Content-Type': f'multipart/form-data; boundary={BOUNDARY}', **headers,
+    })
+
+
+def test_stream_upload_response_has_no_server_paths():
+    client = TestClient(form_data_app)
+    response = client.post('/files/stream', data={'description': 'report'}, files={'file': ('big.iso', CONTENT, 'application/octet-stream')})
+    assert response.status_code == 200
+    assert response.json() == {
+        'fields': {'description': 'report'},
+        'files': [{
+            'field_name': 'file', 'filename': 'big.iso', 'content_type': 'application/octet-stream',
+            'size': len(CONTENT), 'sha256': hashlib.sha256(CONTENT).hexdigest(),
+        }],
+    }
+
+
+def test_spooled_files_are_deleted_after_the_response(tmp_path):
+    app = FastAPI()
+    seen = []
+
+    @app.post('/spool')
+    async def spool(upload: SpooledUpload = Depends(spooled_upload)):
+        for file in upload.files:
+            with open(file.path, 'rb') as spooled:
+                seen.append((file.path, spooled.read() == CONTENT))
+        # a kept file is moved out of the spool directory
+        os.replace(upload.files[1].path, tmp_path / 'kept')
+        return {}
+
+    client = TestClient(app)
+    response = client.post('/spool', files=[('file', ('a.bin', CONTENT)), ('file', ('b.bin', CONTENT))])
+    assert response.status_code == 200
+    assert [same for _, same in seen] == [True, True]
+    assert not any(os.path.exists(path) for path, _ in seen)
+    assert (tmp_path / 'kept').read_bytes() == CONTENT
+
+
+def test_a_file_over_the_limit_is_a_413(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_MAX_FILE_SIZE', 10000)
+    response = post(multipart(file('small', 'a.bin', b'x' * 10000), file('big', 'b.bin', b'x' * 10001)))
+    assert response.status_code == 413
+    assert response.json() == {'detail': "file 'b.bin' is larger than 10000 bytes"}
+    # the file already spooled is deleted too
+    assert os.listdir(spool_dir) == []
+
+
+def test_a_field_over_the_limit_is_a_413(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_MAX_FIELD_SIZE', 100)
+    assert post(multipart(field('description', b'x' * 100))).status_code == 200
+    response = post(multipart(file('file', 'a.bin', b'x' * 1000), field('description', b'x' * 101)))
+    assert response.status_code == 413
+    assert response.json() == {'detail': "form field 'description' is larger than 100 bytes"}
+    assert os.listdir(spool_dir) == []
+
+
+def test_a_content_length_over_the_limit_is_a_413_before_the_body_is_read(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_MAX_REQUEST_SIZE', 1000)
+    response = post(multipart(file('file', 'a.bin', b'x' * 1000)))
+    assert response.status_code == 413
+    assert response.json() == {'detail': 'request body is larger than 1000 bytes'}
+    assert not spool_dir.exists()  # the parser never ran
+
+
+def test_a_streamed_body_over_the_limit_is_a_413(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_MAX_REQUEST_SIZE', 5000)
+    body = multipart(file('file', 'a.bin', b'x' * 10000))
+    # without a Content-Length the size is only known while reading
+    response = post(chunks(body))
+    assert response.status_code == 413
+    assert response.json() == {'detail': 'request body is larger than 5000 bytes'}
+    assert os.listdir(spool_dir) == []
+
+
+def test_part_headers_over_the_limit_are_a_413(spool_dir, monkeypatch):
+    monkeypatch.setattr(uploads, 'UPLOAD_MAX_HEADER_SIZE', 200)
+    headers = b'X-Padding: ' + b'x' * 200 + b'\r\n'
+    response = post(multipart(headers + field('description', b'report')))
+    assert response.status_code == 413
+    assert response.json() == {'detail': 'part headers are larger than 200 bytes'}
+    # the limit is per part
+    assert post(multipart(field('a', b'1'), field('b', b'2'))).status_code == 200
+
+
+def test_the_header_lines_of_a_part_count_together(tmp_path):
+    parser = StreamingMultipartParser(f'multipart/form-data; boundary={BOUNDARY}', spool_dir=str(tmp_path), max_header_size=300)
+    headers = b''.join(f'X-Header-{n}: {"x" * 40}\r\n'.encode() for n in range(8))
+    # fed a few bytes at a time, a header arrives in several callbacks
+    with pytest.raises(UploadTooLarge, match='part headers are larger than 300 bytes'):
+        asyncio.run(parser.parse(stream(multipart(headers + field('description', b'report')), size=7)))
+
+
+def test_too_many_parts_are_rejected(tmp_path):
+    def parse(count: int) -> SpooledUpload:
+        parser = StreamingMultipartParser(f'multipart/form-data; boundary={BOUNDARY}', spool_dir=str(tmp_path), max_parts=3)
+        return asyncio.run(parser.parse(stream(multipart(*[field(f'f{n}', b'x') for n in range(count)]))))
+
+    assert parse(3).fields == {'f0': 'x', 'f1': 'x', 'f2': 'x'}
+    with pytest.raises(UploadTooLarge, match='more than 3 parts'):
+        parse(4)
@@ -0,0 +1,264 @@
+# streaming multipart uploads
+# File(...) as bytes keeps every file in memory, UploadFile keeps up to 1 MB per file in memory and the whole
+# request is parsed before the path operation runs, so a large upload can't be rejected until it was received
+#
+# here the request body is fed to the python-multipart parser message by message as it arrives
+# file parts are written straight to a file in the spool directory while their size and sha256 are computed,
+# so the memory used is about one received message whatever the size of the files
+# the limits are checked as the data arrives and the request is answered with 413 as soon as one is exceeded,
+# the files spooled so far are deleted then
+# the spooled files live as long as the request: they are deleted once the response is sent, a path operation that
+# keeps one moves it out of the spool directory first (os.replace(file.path, destination))
+# responses use SpooledUploadOut, the client is not told where the files were written on the server
+#
+# configuration
+#   UPLOAD_SPOOL_DIR         directory for the received files, <tmp>/uploads by default
+#   UPLOAD_MAX_FILE_SIZE     bytes per file, 100 MB by default
+#   UPLOAD_MAX_REQUEST_SIZE  bytes per request body, 1 GB by default
+#   UPLOAD_MAX_FIELD_SIZE    bytes per form field that isn't a file, 64 KB by default
+#   UPLOAD_MAX_HEADER_SIZE   bytes of the headers of a part, names and values, 8 KB by default
+#   UPLOAD_MAX_PARTS         fields and files per request, 1000 by default, the fields are kept in memory
+
+import hashlib
+import os
+import secrets
+import tempfile
+from typing import AsyncIterator, Dict, List, Optional
+
+import anyio
+from fastapi import HTTPException, Request
+from multipart.multipart import MultipartParser, parse_options_header
+from pydantic import BaseModel
+from starlette import status
+
+UPLOAD_SPOOL_DIR = os.getenv('UPLOAD_SPOOL_DIR', os.path.join(tempfile.gettempdir(), 'uploads'))
+UPLOAD_MAX_FILE_SIZE = int(os.getenv('UPLOAD_MAX_FILE_SIZE', str(100 * 1024 * 1024)))
+UPLOAD_MAX_REQUEST_SIZE = int(os.getenv('UPLOAD_MAX_REQUEST_SIZE', str(1024 * 1024 * 1024)))
+UPLOAD_MAX_FIELD_SIZE = int(os.getenv('UPLOAD_MAX_FIELD_SIZE', str(64 * 1024)))
+UPLOAD_MAX_HEADER_SIZE = int(os.getenv('UPLOAD_MAX_HEADER_SIZE', str(8 * 1024)))
+UPLOAD_MAX_PARTS = int(os.getenv('UPLOAD_MAX_PARTS', '1000'))
+
+
+class SpooledFileOut(BaseModel):
+    field_name: str
+    filename: Optional[str]
+    content_type: Optional[str]
+    size: int
+    sha256: str
+
+
+class SpooledFile(SpooledFileOut):
+    path: str  # where the content was written in the spool directory, never sent to the client
+
+
+class SpooledUploadOut(BaseModel):
+    fields: Dict[str, str]
+    files: List[SpooledFileOut]
+
+
+class SpooledUpload(SpooledUploadOut):
+    files: List[SpooledFile]
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadError(Exception):
+    pass
+
+
+class _Part:
+    __slots__ = ('headers', 'field_name', 'filename', 'content_type', 'data', 'file', 'path', 'size', 'sha256')
+
+    def __init__(self):
+        self.headers = {}
+        self.field_name = None
+        self.filename = None
+        self.content_type = None
+        self.data = b''  # only for fields, files go to self.file
+        self.file = None
+        self.path = None
+        self.size = 0
+        self.sha256 = None
+
+
+class StreamingMultipartParser:
+    def __init__(
+            self,
+            content_type: str,
+            spool_dir: str = UPLOAD_SPOOL_DIR,
+            max_file_size: int = UPLOAD_MAX_FILE_SIZE,
+            max_request_size: int = UPLOAD_MAX_REQUEST_SIZE,
+            max_field_size: int = UPLOAD_MAX_FIELD_SIZE,
+            max_header_size: int = UPLOAD_MAX_HEADER_SIZE,
+            max_parts: int = UPLOAD_MAX_PARTS,
+    ):
+        _, params = parse_options_header(content_type)
+        if b'boundary' not in params:
+            raise UploadError('missing boundary in multipart')
+        self.spool_dir = spool_dir
+        self.max_file_size = max_file_size
+        self.max_request_size = max_request_size
+        self.max_field_size = max_field_size
+        self.max_header_size = max_header_size
+        self.max_parts = max_parts
+        self.parts = 0
+        self.received = 0
+        self.fields: Dict[str, str] = {}
+        self.files: List[_Part] = []
+        self._part = _Part()
+        self._header_name = b''
+        self._header_value = b''
+        self._header_size = 0  # of the current part
+        self._pending = []  # (part, data) received in the current message, written after it was parsed
+        self._parser = MultipartParser(params[b'boundary'], {
+            'on_part_begin': self.on_part_begin,
+            'on_part_data': self.on_part_data,
+            'on_part_end': self.on_part_end,
+            'on_header_field': self.on_header_field,
+            'on_header_value': self.on_header_value,
+            'on_header_end': self.on_header_end,
+            'on_headers_finished': self.on_headers_finished,
+        })
+
+    def on_part_begin(self):
+        self.parts += 1
+        if self.parts > self.max_parts:
+            raise UploadTooLarge(f'more than {self.max_parts} parts')
+        self._part = _Part()
+        self._header_size = 0
+
+    def _count_header(self, size: int):
+        # the headers are collected in memory, they are bounded like the fields
+        self._header_size += size
+        if self._header_size > self.max_header_size:
+            raise UploadTooLarge(f'part headers are larger than {self.max_header_size} bytes')
+
+    def on_header_field(self, data: bytes, start: int, end: int):
+        self._count_header(end - start)
+        self._header_name += data[start:end]
+
+    def on_header_value(self, data: bytes, start: int, end: int):
+        self._count_header(end - start)
+        self._header_value += data[start:end]
+
+    def on_header_end(self):
+        self._part.headers[self._header_name.lower()] = self._header_value
+        self._header_name = b''
+        self._header_value = b''
+
+    def on_headers_finished(self):
+        part = self._part
+        _, options = parse_options_header(part.headers.get(b'content-disposition', b''))
+        if b'name' not in options:
+            raise UploadError('the Content-Disposition header field "name" must be provided')
+        part.field_name = options[b'name'].decode('utf-8', 'replace')
+        if b'filename' in options:
+            part.filename = options[b'filename'].decode('utf-8', 'replace')
+            part.content_type = part.headers.get(b'content-type', b'application/octet-stream').decode('latin-1')
+            part.sha256 = hashlib.sha256()
+            # the name the client sent is never used on disk
+            part.path = os.path.join(self.spool_dir, secrets.token_hex(16))
+            self.files.append(part)
+
+    def on_part_data(self, data: bytes, start: int, end: int):
+        part = self._part
+        chunk = data[start:end]
+        part.size += len(chunk)
+        if part.sha256 is None:
+            if part.size > self.max_field_size:
+                raise UploadTooLarge(f'form field {part.field_name!r} is larger than {self.max_field_size} bytes')
+            part.data += chunk
+            return
+        if part.size > self.max_file_size:
+            raise UploadTooLarge(f'file {part.filename!r} is larger than {self.max_file_size} bytes')
+        part.sha256.update(chunk)
+        self._pending.append((part, chunk))
+
+    def on_part_end(self):
+        part = self._part
+        if part.sha256 is None:
+            self.fields[part.field_name] = part.data.decode('utf-8', 'replace')
+
+    def _write_pending(self):
+        # runs in a worker thread, the event loop is not blocked by the disk
+        for part, chunk in self._pending:
+            if part.file is None:
+                part.file = open(part.path, 'wb')
+            part.file.write(chunk)
+
+    def _close_files(self, delete: bool):
+        for part in self.files:
+            if part.file is not None:
+                part.file.close()
+            if delete and part.path is not None and os.path.exists(part.path):
+                os.remove(part.path)
+
+    async def feed(self, chunk: bytes):
+        self.received += len(chunk)
+        if self.received > self.max_request_size:
+            raise UploadTooLarge(f'request body is larger than {self.max_request_size} bytes')
+        self._parser.write(chunk)
+        if self._pending:
+            await anyio.to_thread.run_sync(self._write_pending)
+            self._pending.clear()
+
+    async def parse(self, stream) -> SpooledUpload:
+        os.makedirs(self.spool_dir, exist_ok=True)
+        try:
+            async for chunk in stream:
+                await self.feed(chunk)
+            self._parser.finalize()
+            # empty files never had data written
+            for part in self.files:
+                if part.file is None:
+                    part.file = open(part.path, 'wb')
+        except BaseException:
+            await anyio.to_thread.run_sync(self._close_files, True)
+            raise
+        await anyio.to_thread.run_sync(self._close_files, False)
+        return SpooledUpload(fields=self.fields, files=[
+            SpooledFile(
+                field_name=part.field_name, filename=part.filename, content_type=part.content_type,
+                size=part.size, sha256=part.sha256.hexdigest(), path=part.path,
+            )
+            for part in self.files
+        ])
+
+
+def _remove_files(paths: List[str]):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:  # moved away by the path operation
+            pass
+
+
+# Dependency
+# reads the request body as it arrives, path operations using it must not declare Form or File parameters
+# (FastAPI would read the whole body for them first)
+# the files left in the spool directory are deleted after the response is sent
+async def spooled_upload(request: Request) -> AsyncIterator[SpooledUpload]:
+    content_length = request.headers.get('content-length')
+    if content_length is not None and content_length.isdigit() and int(content_length) > UPLOAD_MAX_REQUEST_SIZE:
+        # rejected before reading any of the body
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f'request body is larger than {UPLOAD_MAX_REQUEST_SIZE} bytes',
+        )
+    try:
+        parser = StreamingMultipartParser(
+            request.headers.get('content-type', ''), spool_dir=UPLOAD_SPOOL_DIR,
+            max_file_size=UPLOAD_MAX_FILE_SIZE, max_request_size=UPLOAD_MAX_REQUEST_SIZE,
+            max_field_size=UPLOAD_MAX_FIELD_SIZE, max_header_size=UPLOAD_MAX_HEADER_SIZE, max_parts=UPLOAD_MAX_PARTS,
+        )
+        upload = await parser.parse(request.stream())
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except (UploadError, ValueError) as e:  # python-multipart raises ValueError subclasses for malformed bodies
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    try:
+        yield upload
+    finally:
+        await anyio.to_thread.run_sync(_remove_files, [file.path for file in upload.files])
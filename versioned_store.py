@@ -0,0 +1,68 @@
+# key value store with a version per key for optimistic concurrency
+# every write increments the version of the key, its ETag is the version in quotes
+# a write sent with If-Match is only applied when the ETag still matches, so a client that read an item, changed it
+# and writes it back can't overwrite a change made by someone else meanwhile, it gets a conflict, reads again and
+# retries
+# patches are merged field by field into the stored dict under the lock, no model is rebuilt and nothing is
+# re-encoded, the values are the already validated ones of the request body
+
+import threading
+from typing import Dict, Optional, Tuple
+
+
+class VersionConflict(Exception):
+    def __init__(self, etag: Optional[str]):
+        super().__init__(f'precondition failed, the current ETag is {etag}' if etag else 'precondition failed, no such key')
+        self.etag = etag  # None when the key doesn't exist
+
+
+def make_etag(version: int) -> str:
+    return f'"{version}"'
+
+
+def etag_matches(if_match: str, etag: Optional[str]) -> bool:
+    # If-Match uses the strong comparison, weak tags never match
+    if etag is None:
+        return False
+    if if_match.strip() == '*':
+        return True
+    return any(tag.strip() == etag for tag in if_match.split(','))
+
+
+class VersionedStore:
+    def __init__(self, initial: Optional[Dict[str, dict]] = None):
+        self._entries: Dict[str, Tuple[int, dict]] = {key: (1, value) for key, value in (initial or {}).items()}
+        self._lock = threading.Lock()
+
+    def __contains__(self, key: str):
+        return key in self._entries
+
+    def get(self, key: str) -> Tuple[dict, str]:
+        """ the value and its ETag, raises KeyError"""
+        version, value = self._entries[key]
+        return value, make_etag(version)
+
+    def _check(self, key: str, if_match: Optional[str]) -> int:
+        entry = self._entries.get(key)
+        version = entry[0] if entry is not None else 0
+        if if_match is not None and not etag_matches(if_match, make_etag(version) if entry is not None else None):
+            raise VersionConflict(make_etag(version) if entry is not None else None)
+        return version
+
+    def put(self, key: str, value: dict, if_match: Optional[str] = None) -> Tuple[dict, str]:
+        """ replaces the value, creates the key if it doesn't exist"""
+        with self._lock:
+            version = self._check(key, if_match) + 1
+            self._entries[key] = (version, value)
+        return value, make_etag(version)
+
+    def patch(self, key: str, changes: dict, if_match: Optional[str] = None) -> Tuple[dict, str]:
+        """ merges changes into the value, raises KeyError when the key doesn't exist"""
+        with self._lock:
+            if key not in self._entries:
+                raise KeyError(key)
+            version = self._check(key, if_match) + 1
+            # a new dict, readers holding the previous value never see it change
+            value = {**self._entries[key][1], **changes}
+            self._entries[key] = (version, value)
+        return value, make_etag(version)